@@ -0,0 +1,56 @@
+"""
+协作式取消：后台任务持有一个CancelToken，网络等待（select）同时监听令牌的唤醒socket，
+取消时正在等待的select立即返回，不必等到超时
+"""
+import socket
+import threading
+
+
+class Cancelled(Exception):
+    """操作已被取消"""
+
+
+class CancelToken:
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        # 取消时向写端发送一个字节，使监听读端的select立即返回
+        self.reader, self.writer = socket.socketpair()
+        self.reader.setblocking(False)
+        self.closed = False
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            if not self.closed:
+                try:
+                    self.writer.send(b"\0")
+                except OSError:
+                    pass
+
+    def check(self):
+        """已取消时抛出Cancelled"""
+        if self.event.is_set():
+            raise Cancelled("操作已取消")
+
+    def fileno(self):
+        """供select监听的文件描述符"""
+        return self.reader.fileno()
+
+    def sleep(self, seconds):
+        """等待指定秒数，取消时提前返回并抛出Cancelled"""
+        if self.event.wait(seconds):
+            raise Cancelled("操作已取消")
+
+    def close(self):
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.reader.close()
+                self.writer.close()
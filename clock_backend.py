@@ -0,0 +1,158 @@
+"""
+系统时钟后端：只依赖标准库，供主程序和特权助手 time_helper.py 共用
+
+按偏移调整时钟时使用精确调整：先选定不久之后的一个时刻，算出该时刻应有的时间（对齐到后端能设置的最小单位，
+不会被截断），睡眠到接近该时刻后忙等，在该时刻发出设置调用。这样调整本身引入的误差只剩设置调用的耗时，
+不受线程调度延迟和毫秒截断的影响。
+"""
+import sys
+import time
+import ctypes
+from datetime import datetime, timezone, timedelta
+
+# 精确调整时，设置时刻距现在的提前量（秒），留出计算和唤醒的时间
+STEP_LEAD = 0.02
+# 睡眠到设置时刻前这么久，剩下的时间忙等（秒），避开睡眠唤醒的抖动
+SPIN_MARGIN = 0.002
+# 各平台设置时间接口的分辨率（纳秒）：Windows的SYSTEMTIME为毫秒，macOS内核为微秒，Linux为纳秒
+if sys.platform == 'win32':
+    SET_RESOLUTION_NS = 1000000
+elif sys.platform == 'darwin':
+    SET_RESOLUTION_NS = 1000
+else:
+    SET_RESOLUTION_NS = 1
+
+# Windows SYSTEMTIME结构
+class SYSTEMTIME(ctypes.Structure):
+    _fields_ = [
+        ("wYear", ctypes.c_ushort),
+        ("wMonth", ctypes.c_ushort),
+        ("wDayOfWeek", ctypes.c_ushort),
+        ("wDay", ctypes.c_ushort),
+        ("wHour", ctypes.c_ushort),
+        ("wMinute", ctypes.c_ushort),
+        ("wSecond", ctypes.c_ushort),
+        ("wMilliseconds", ctypes.c_ushort)
+    ]
+
+# 设置Windows系统时间
+def set_windows_time(utc_time):
+    """设置Windows系统时间"""
+    try:
+        # 转换为本地时间
+        local_time = utc_time.astimezone()
+        
+        # 创建SYSTEMTIME结构
+        st = SYSTEMTIME()
+        st.wYear = local_time.year
+        st.wMonth = local_time.month
+        st.wDay = local_time.day
+        st.wDayOfWeek = local_time.weekday()  # 0=Monday, 6=Sunday
+        st.wHour = local_time.hour
+        st.wMinute = local_time.minute
+        st.wSecond = local_time.second
+        st.wMilliseconds = local_time.microsecond // 1000
+        
+        # 调用Windows API
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        success = kernel32.SetLocalTime(ctypes.byref(st))
+        
+        if success:
+            return True, f"系统时间已更新: {local_time.strftime('%Y-%m-%d %H:%M:%S')}"
+        else:
+            error_code = ctypes.get_last_error()
+            return False, f"设置系统时间失败，错误代码: {error_code}"
+    
+    except Exception as e:
+        return False, f"设置系统时间时发生错误: {str(e)}"
+
+# 设置类Unix系统时间
+def set_unix_time(utc_time):
+    """设置Linux/macOS系统时间（需要root或CAP_SYS_TIME）"""
+    try:
+        time.clock_settime(time.CLOCK_REALTIME, utc_time.timestamp())
+        local_time = utc_time.astimezone()
+        return True, f"系统时间已更新: {local_time.strftime('%Y-%m-%d %H:%M:%S')}"
+    except PermissionError:
+        return False, "设置系统时间失败: 权限不足"
+    except Exception as e:
+        return False, f"设置系统时间时发生错误: {str(e)}"
+
+def set_system_time(utc_time):
+    """按平台设置系统时间"""
+    if sys.platform == 'win32':
+        return set_windows_time(utc_time)
+    return set_unix_time(utc_time)
+
+# 准备精确设置系统时间（纳秒时间戳）：结构体和函数事先准备好，到设置时刻只剩一次系统调用
+def prepare_set_time(target_ns):
+    """返回无参数的设置函数，调用时返回 (success, error)，error为失败原因"""
+    if sys.platform == 'win32':
+        utc_time = datetime(1970, 1, 1) + timedelta(microseconds=target_ns // 1000)
+        st = SYSTEMTIME(utc_time.year, utc_time.month, (utc_time.weekday() + 1) % 7, utc_time.day,
+                        utc_time.hour, utc_time.minute, utc_time.second, utc_time.microsecond // 1000)
+        # SetSystemTime直接使用UTC，避免本地时间换算
+        set_system = ctypes.WinDLL('kernel32', use_last_error=True).SetSystemTime
+        pointer = ctypes.byref(st)
+
+        def set_time():
+            if set_system(pointer):
+                return True, None
+            return False, f"错误代码: {ctypes.get_last_error()}"
+        return set_time
+
+    def set_time():
+        try:
+            time.clock_settime_ns(time.CLOCK_REALTIME, target_ns)
+            return True, None
+        except PermissionError:
+            return False, "权限不足"
+        except OSError as e:
+            return False, str(e)
+    return set_time
+
+def sample_clocks():
+    """同时读取墙上时钟和高精度单调时钟（纳秒），墙上时钟取两次单调读数的中点"""
+    before = time.perf_counter_ns()
+    wall = time.time_ns()
+    after = time.perf_counter_ns()
+    return wall, (before + after) // 2
+
+def wait_until(deadline_ns):
+    """等待到高精度单调时钟的 deadline_ns：先睡眠，最后一小段忙等"""
+    while True:
+        remaining = (deadline_ns - time.perf_counter_ns()) / 1e9
+        if remaining <= 0:
+            return
+        if remaining > SPIN_MARGIN:
+            time.sleep(remaining - SPIN_MARGIN)
+
+def plan_step(offset, lead=STEP_LEAD):
+    """选定设置时刻：返回 (设置时刻的单调时钟读数, 该时刻应设置的时间)，均为纳秒，时间对齐到设置接口的分辨率"""
+    wall_ns, mono_ns = sample_clocks()
+    offset_ns = round(offset * 1e9)
+    target_ns = wall_ns + offset_ns + round(lead * 1e9)
+    target_ns = -(-target_ns // SET_RESOLUTION_NS) * SET_RESOLUTION_NS
+    return mono_ns + (target_ns - offset_ns - wall_ns), target_ns
+
+def precise_step(offset, lead=STEP_LEAD):
+    """在不久之后的选定时刻把系统时间精确调整offset秒"""
+    instant_ns, target_ns = plan_step(offset, lead)
+    set_time = prepare_set_time(target_ns)
+    wait_until(instant_ns)
+    success, error = set_time()
+    late_us = (time.perf_counter_ns() - instant_ns) / 1000
+    local_time = datetime.fromtimestamp(target_ns / 1e9).strftime('%Y-%m-%d %H:%M:%S.%f')
+    if not success:
+        return False, f"设置系统时间失败: {error}"
+    return True, f"系统时间已更新: {local_time}（精确调整，设置调用耗时 {late_us:.1f}µs）"
+
+def apply_offset(offset, precise=True):
+    """把系统时间调整offset秒（正数表示本机时间偏慢）；precise为False时立即按当前时间设置"""
+    if precise:
+        try:
+            return precise_step(offset)
+        except Exception as e:
+            return False, f"设置系统时间时发生错误: {str(e)}"
+    utc_time = datetime.now(timezone.utc) + timedelta(seconds=offset)
+    return set_system_time(utc_time)
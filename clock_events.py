@@ -0,0 +1,171 @@
+"""
+触发立即重新同步的事件：时钟跳变、从睡眠中恢复、网络变化
+
+时钟跳变和睡眠通过比较墙上时钟与单调时钟的走时检测：其他程序修改了系统时间时两者之差突变；
+睡眠期间单调时钟（Linux上不含睡眠时间）停走而墙上时钟和开机时钟继续走，或者本线程的等待远超预期。
+网络变化在Linux上通过netlink订阅网卡和地址变化，其他平台定期比较本机地址集合。
+检测到事件后调用 callback(reason)（在监视线程中调用）。
+"""
+import sys
+import time
+import random
+import socket
+import select
+import struct
+import logging
+import threading
+
+from cancellation import CancelToken
+from discipline import clock_state
+
+# 检查时钟的间隔（秒）；检测不需要频繁轮询，间隔长一些以减少空闲时的唤醒
+CHECK_INTERVAL = 5.0
+# 墙上时钟与单调时钟走时之差超过该值视为时钟跳变（秒）
+JUMP_THRESHOLD = 1.0
+# 等待超出预期或开机时钟多走超过该值视为睡眠（秒）
+SUSPEND_THRESHOLD = 5.0
+# 网络变化后等待这么久再同步，等DHCP、路由稳定，连续的变化合并为一次（秒）
+NETWORK_SETTLE = 3.0
+# 在上面的基础上再随机多等 0 ~ NETWORK_JITTER 秒：同一网络中的大量机器会同时看到网络变化，错开它们的同步
+NETWORK_JITTER = 10.0
+
+# netlink 常量（linux/rtnetlink.h）
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+RTM_NEWLINK, RTM_DELLINK, RTM_NEWADDR, RTM_DELADDR = 16, 17, 20, 21
+NLMSG_HEADER = struct.Struct("=IHHII")
+
+
+def open_netlink():
+    """订阅网卡和地址变化，不支持时返回None"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+        sock.setblocking(False)
+        return sock
+    except OSError:
+        return None
+
+
+def read_netlink(sock):
+    """读出所有待处理的netlink消息，返回其中是否有网卡或地址变化"""
+    changed = False
+    while True:
+        try:
+            data = sock.recv(65536)
+        except BlockingIOError:
+            return changed
+        except OSError:
+            # 缓冲区溢出(ENOBUFS)说明变化很多，同样视为网络变化
+            return True
+        offset = 0
+        while offset + NLMSG_HEADER.size <= len(data):
+            length, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+            if msg_type in (RTM_NEWLINK, RTM_DELLINK, RTM_NEWADDR, RTM_DELADDR):
+                changed = True
+            if length < NLMSG_HEADER.size:
+                break
+            offset += (length + 3) & ~3
+
+
+def local_addresses():
+    """本机地址集合（没有netlink的平台用于比较网络是否变化）"""
+    try:
+        return {info[4][0] for info in socket.getaddrinfo(socket.gethostname(), None)}
+    except OSError:
+        return set()
+
+
+def boot_time():
+    """包含睡眠时间的单调时钟，不支持时返回None"""
+    clock = getattr(time, "CLOCK_BOOTTIME", None)
+    return time.clock_gettime(clock) if clock is not None else None
+
+
+# 事件监视线程
+class ClockEventWatcher:
+    def __init__(self, callback, check_interval=CHECK_INTERVAL):
+        self.callback = callback
+        self.check_interval = check_interval
+        self.token = CancelToken()
+        self.thread = None
+        self.logger = logging.getLogger("ClockEventWatcher")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="ClockEventWatcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.token.cancel()
+        if self.thread is not None:
+            self.thread.join(1.0)
+        self.token.close()
+
+    def sample(self):
+        wall, stepped = clock_state.step_sample()
+        return wall, time.monotonic(), boot_time(), stepped
+
+    def check_clock(self, previous, current):
+        """比较两次采样，返回事件描述或None"""
+        wall0, mono0, boot0, stepped0 = previous
+        wall1, mono1, boot1, stepped1 = current
+        elapsed = mono1 - mono0
+        # 扣除两次采样之间本程序自己写入的全部调整（一次同步可能先调整再按复查结果修正）
+        jump = (wall1 - wall0) - elapsed - (stepped1 - stepped0)
+        if boot0 is not None and boot1 is not None and (boot1 - boot0) - elapsed > SUSPEND_THRESHOLD:
+            return f"系统从睡眠中恢复（约 {(boot1 - boot0) - elapsed:.0f} 秒）"
+        if elapsed - self.check_interval > SUSPEND_THRESHOLD:
+            return f"系统从睡眠中恢复（约 {elapsed - self.check_interval:.0f} 秒）"
+        if abs(jump) > JUMP_THRESHOLD:
+            return f"检测到系统时间跳变 {jump:+.1f} 秒"
+        return None
+
+    def run(self):
+        netlink = open_netlink()
+        addresses = local_addresses() if netlink is None else None
+        watched = [self.token] + ([netlink] if netlink is not None else [])
+        previous = self.sample()
+        network_deadline = None
+        try:
+            while not self.token.cancelled:
+                wait = self.check_interval
+                if network_deadline is not None:
+                    wait = max(0.0, min(wait, network_deadline - time.monotonic()))
+                readable, _, _ = select.select(watched, [], [], wait)
+                if self.token.cancelled:
+                    break
+                if netlink is not None and netlink in readable and read_netlink(netlink):
+                    network_deadline = time.monotonic() + NETWORK_SETTLE + random.uniform(0.0, NETWORK_JITTER)
+
+                current = self.sample()
+                if current[1] - previous[1] >= self.check_interval:
+                    reason = self.check_clock(previous, current)
+                    previous = current
+                    if reason is None and addresses is not None:
+                        now_addresses = local_addresses()
+                        if now_addresses != addresses:
+                            addresses = now_addresses
+                            network_deadline = time.monotonic() + NETWORK_SETTLE + random.uniform(0.0, NETWORK_JITTER)
+                    if reason is not None:
+                        self.fire(reason)
+                        # 睡眠恢复通常伴随网络重连，合并为一次同步
+                        network_deadline = None
+                        continue
+
+                if network_deadline is not None and time.monotonic() >= network_deadline:
+                    network_deadline = None
+                    self.fire("检测到网络变化")
+        finally:
+            if netlink is not None:
+                netlink.close()
+
+    def fire(self, reason):
+        self.logger.info(reason)
+        try:
+            self.callback(reason)
+        except Exception:
+            self.logger.exception("处理时钟事件失败")
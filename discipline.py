@@ -0,0 +1,286 @@
+"""
+本机时钟的同步状态（最近一次同步的结果），由同步线程更新，服务端模式等组件读取
+
+保持模式（holdover）：每次成功同步记录一个 (真实时间, 未修正时钟的偏移) 样本，对最近的样本做最小二乘拟合
+估计本机时钟的频率误差。所有服务器都不可用时，按 上次同步后剩余的偏移 + 频率误差 × 经过时间 预测当前偏移，
+误差上界随时间按频率估计的不确定度增长；预测量较小时可以直接修正系统时钟。
+"""
+import os
+import json
+import math
+import time
+import struct
+import hashlib
+import ipaddress
+import threading
+
+# 同步后误差每秒增长的上限（RFC 5905 中的 PHI，15ppm）
+MAX_DRIFT_RATE = 15e-6
+# 未同步时对外宣告的层级
+STRATUM_UNSYNCED = 16
+# 参与频率估计的样本数和最长时间跨度（秒）
+HISTORY_SIZE = 16
+HISTORY_MAX_AGE = 3 * 86400
+# 估计频率所需的最短时间跨度（秒），太短时测量误差会被放大
+MIN_FREQUENCY_SPAN = 60.0
+# 频率误差估计的下限和可信的上限（晶振误差通常在几十ppm以内，超过说明期间时钟被其他程序调整过）
+MIN_FREQUENCY_ERROR = 0.5e-6
+MAX_FREQUENCY = 500e-6
+# 长期样本文件（供 analytics.py 做稳定性分析）：每条为 时间、测得偏移、当时累计写入系统时钟的修正量、延迟、服务器编号，
+# 服务器名按编号保存在 <文件名>.servers 中，每行一个
+SAMPLE_FILE = "sync_samples.bin"
+SAMPLE_RECORD = struct.Struct("<dddfH")
+
+
+def make_ref_id(server):
+    """按RFC 5905生成上游服务器的参考标识：IPv4地址本身，其他情况取MD5前4字节"""
+    try:
+        address = ipaddress.ip_address(server)
+        if address.version == 4:
+            return address.packed
+    except ValueError:
+        pass
+    return hashlib.md5(server.encode('utf-8')).digest()[:4]
+
+
+# 时钟同步状态
+class ClockState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.synced = False
+        self.server = ""
+        # 最近一次测得的偏移；已经写入系统时钟时applied为True，读取时间时不再叠加
+        self.offset = 0.0
+        self.applied = False
+        self.stratum = STRATUM_UNSYNCED
+        self.ref_id = b"\0\0\0\0"
+        self.ref_time = 0.0
+        self.ref_monotonic = 0.0
+        self.root_delay = 0.0
+        self.root_dispersion = 0.0
+        # 每次状态变化递增，便于读取方判断是否需要刷新缓存
+        self.generation = 0
+        # 频率估计：样本为 [真实时间, 未修正时钟的偏移, 测量误差]；total_applied 为累计写入系统时钟的修正量
+        self.history = []
+        self.total_applied = 0.0
+        self.frequency = None
+        self.frequency_error = None
+        # 最近一次同步失败后处于保持模式；holdover_applied 为保持模式下已写入系统时钟的修正量
+        self.holdover = False
+        self.holdover_applied = 0.0
+        # 本程序累计写入系统时钟的调整量，只在 step_lock 内与写入一起更新，供时钟跳变检测扣除
+        self.stepped_total = 0.0
+        self.step_lock = threading.Lock()
+        # 设置时钟后复查测得的剩余偏移，未复查时为None
+        self.residual = None
+        self.history_path = None
+
+    def load(self, path):
+        """读取保存的同步历史（频率估计在重启后继续有效），之后每次同步自动保存到该文件"""
+        self.history_path = path
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            history = [[float(t), float(raw), float(error)] for t, raw, error in data.get("history", [])]
+            total_applied = float(data.get("total_applied", 0.0))
+        except (OSError, ValueError, TypeError):
+            return
+        with self.lock:
+            self.history = history
+            self.total_applied = total_applied
+            self.estimate_frequency()
+
+    def save(self):
+        if self.history_path is None:
+            return
+        with self.lock:
+            data = {"history": self.history, "total_applied": self.total_applied}
+        tmp_path = self.history_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.history_path)
+        except OSError:
+            pass
+
+    def estimate_frequency(self):
+        """对历史样本做最小二乘拟合，得到本机时钟的频率误差（秒/秒，正值表示本机走慢）及其不确定度"""
+        self.frequency = self.frequency_error = None
+        if len(self.history) < 2:
+            return
+        times = [t for t, _, _ in self.history]
+        raws = [raw for _, raw, _ in self.history]
+        span = times[-1] - times[0]
+        if span < MIN_FREQUENCY_SPAN:
+            return
+        n = len(times)
+        mean_t = sum(times) / n
+        mean_raw = sum(raws) / n
+        sxx = sum((t - mean_t) ** 2 for t in times)
+        slope = sum((t - mean_t) * (raw - mean_raw) for t, raw in zip(times, raws)) / sxx
+        # 不确定度取拟合残差给出的标准误差与单次测量误差给出的下限中较大者
+        error = math.sqrt(2) * (sum(e for _, _, e in self.history) / n) / span
+        if n > 2:
+            residual = sum((raw - mean_raw - slope * (t - mean_t)) ** 2 for t, raw in zip(times, raws))
+            error = max(error, math.sqrt(residual / (n - 2) / sxx))
+        self.frequency = slope
+        self.frequency_error = max(error, MIN_FREQUENCY_ERROR)
+
+    def update(self, server, response, applied):
+        """用一次成功的NTP响应更新状态，response需提供offset/delay/stratum/root_delay/root_dispersion"""
+        with self.lock:
+            # 记录频率样本；估计出的频率不可信时（时钟被其他程序调整过）从这次重新开始积累
+            now = time.time()
+            self.history.append([now + response.offset, response.offset + self.total_applied,
+                                 response.delay / 2 + response.root_dispersion])
+            self.history = [h for h in self.history[-HISTORY_SIZE:] if h[0] > now - HISTORY_MAX_AGE]
+            self.estimate_frequency()
+            if self.frequency is not None and abs(self.frequency) > MAX_FREQUENCY:
+                self.history = self.history[-1:]
+                self.estimate_frequency()
+            if applied:
+                self.total_applied += response.offset
+            self.residual = None
+            self.holdover = False
+            self.holdover_applied = 0.0
+            self.synced = True
+            self.server = server
+            self.offset = response.offset
+            self.applied = applied
+            self.stratum = min(response.stratum + 1, STRATUM_UNSYNCED)
+            self.ref_id = make_ref_id(server)
+            self.ref_time = time.time() + (0.0 if applied else response.offset)
+            self.ref_monotonic = time.monotonic()
+            self.root_delay = response.root_delay + response.delay
+            self.root_dispersion = response.root_dispersion + response.delay / 2
+            self.generation += 1
+        self.save()
+
+    def record_residual(self, residual, corrected=False):
+        """记录复查测得的剩余偏移；corrected为True表示已按该值再修正了一次系统时钟"""
+        with self.lock:
+            self.residual = residual
+            if corrected:
+                self.total_applied += residual
+                self.generation += 1
+
+    def enter_holdover(self):
+        """同步失败：之后按频率估计预测偏移"""
+        with self.lock:
+            if self.synced and not self.holdover:
+                self.holdover = True
+                self.generation += 1
+
+    def step(self, clock, offset):
+        """通过clock（clock_backend或助手客户端）调整系统时钟，成功时在同一把锁内记入stepped_total"""
+        with self.step_lock:
+            applied, message = clock.apply_offset(offset)
+            if applied:
+                self.stepped_total += offset
+        return applied, message
+
+    def step_sample(self):
+        """(当前时间, 累计调整量)：与step互斥，不会读到已经写入系统时钟但还没记入的调整"""
+        with self.step_lock:
+            return time.time(), self.stepped_total
+
+    def predicted_offset(self):
+        """当前的预测偏移：上次同步后未写入系统时钟的部分，加上按频率误差累积的漂移，减去保持模式已做的修正"""
+        remaining = 0.0 if self.applied else self.offset
+        if self.frequency is not None:
+            remaining += self.frequency * (time.monotonic() - self.ref_monotonic)
+        return remaining - self.holdover_applied
+
+    def error_bound(self):
+        """预测偏移的误差上界：同步时的误差加上频率不确定度（未知时为最大漂移率）随时间的累积"""
+        if not self.synced:
+            return 16.0
+        rate = self.frequency_error if self.frequency_error is not None else MAX_DRIFT_RATE
+        return self.root_delay / 2 + self.root_dispersion + rate * (time.monotonic() - self.ref_monotonic)
+
+    def apply_holdover(self, correction):
+        """记录保持模式下写入系统时钟的修正量"""
+        with self.lock:
+            self.holdover_applied += correction
+            self.total_applied += correction
+            self.generation += 1
+
+    def correction(self):
+        """读取本机时间时需要叠加的修正量（秒），包含按频率误差预测的漂移"""
+        if not self.synced:
+            return 0.0
+        return self.predicted_offset()
+
+    def now(self):
+        """经过修正的当前时间（Unix时间戳）"""
+        return time.time() + self.correction()
+
+    def dispersion(self):
+        """当前误差上界：同步时的根离散度加上之后按最大漂移率累积的部分"""
+        if not self.synced:
+            return 16.0
+        return self.root_dispersion + MAX_DRIFT_RATE * (time.monotonic() - self.ref_monotonic)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'synced': self.synced,
+                'server': self.server,
+                'offset': self.offset,
+                'applied': self.applied,
+                'stratum': self.stratum,
+                'ref_time': self.ref_time,
+                'root_delay': self.root_delay,
+                'root_dispersion': self.dispersion(),
+                'residual': self.residual,
+                'holdover': self.holdover,
+                'frequency': self.frequency,
+                'frequency_error': self.frequency_error,
+                'predicted_offset': self.predicted_offset() if self.synced else 0.0,
+                'error_bound': self.error_bound(),
+            }
+
+
+# 进程内共享的时钟状态
+clock_state = ClockState()
+
+
+def load_server_names(path):
+    """样本文件对应的服务器名列表（下标即样本中的服务器编号）"""
+    try:
+        with open(path + ".servers", "r", encoding="utf-8") as f:
+            return [line.rstrip("\n") for line in f]
+    except OSError:
+        return []
+
+
+# 同步样本的追加写入：进程内共享，open()之后才记录
+class SampleStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.path = None
+        self.servers = {}
+
+    def open(self, path):
+        self.path = path
+        self.servers = {name: i for i, name in enumerate(load_server_names(path))}
+
+    def record(self, server, offset, applied, delay, when):
+        """追加一条样本；offset/applied/delay单位为秒，when为Unix时间"""
+        if self.path is None:
+            return
+        with self.lock:
+            try:
+                index = self.servers.get(server)
+                if index is None:
+                    index = self.servers[server] = len(self.servers)
+                    with open(self.path + ".servers", "a", encoding="utf-8") as f:
+                        f.write(server + "\n")
+                with open(self.path, "ab") as f:
+                    f.write(SAMPLE_RECORD.pack(when, offset, applied, delay, index))
+            except OSError:
+                pass
+
+
+# 进程内共享的样本记录
+sample_store = SampleStore()
@@ -0,0 +1,153 @@
+"""
+NTP交换录制：把真实同步中的每次交换（原始报文、本地收发时间戳、耗时、错误）写入紧凑的轨迹文件
+
+轨迹为gzip压缩的JSON Lines，每行一条记录：
+  {"type": "sync", "time": 开始时的Unix时间, "servers": [...]}        一次同步开始
+  {"type": "exchange", "server": ..., "at": 距同步开始的毫秒数, "elapsed": 耗时毫秒,
+   "packet": 回复报文头hex, "t1": ..., "t4": ..., "address": ...}   一次成功的交换（交错回复另有 "interleaved": true）
+  {"type": "exchange", "server": ..., "at": ..., "elapsed": ..., "source": "http", "offset": 秒, "delay": 秒,
+   "dispersion": 秒, "stratum": ..., "t1": ..., "t4": ..., "address": ...}  非NTP时间源（HTTP、Roughtime）的一次成功查询
+  {"type": "exchange", "server": ..., "at": ..., "elapsed": ..., "error": ..., "kind": "timeout"}
+  {"type": "step", "offset": 秒}                                      同步过程中调整了系统时钟
+回放见 replay.py。
+
+启用方式: python main.py --record-exchanges trace.jsonl.gz  （界面和无界面模式均可）
+"""
+import gzip
+import json
+import time
+import threading
+
+from ntp_client import NTPResponse
+from ntp_packet import NTPPacket
+from time_sources import SourceResponse
+
+
+# 交换录制器：进程内共享，open()之后才记录
+class ExchangeRecorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stream = None
+        self.sync_start = None
+        self.count = 0
+
+    @property
+    def enabled(self):
+        return self.stream is not None
+
+    def open(self, path):
+        """追加录制到 path（gzip多成员文件可以直接追加）"""
+        with self.lock:
+            self.stream = gzip.open(path, "at", encoding="utf-8")
+
+    def close(self):
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+
+    def write(self, record):
+        with self.lock:
+            if self.stream is None:
+                return
+            self.stream.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self.count += 1
+
+    def begin_sync(self, servers):
+        if self.stream is None:
+            return
+        # 上一次同步的记录已经完整，刷新到文件，程序意外退出时最多丢失当前这次
+        with self.lock:
+            if self.stream is not None:
+                self.stream.flush()
+        self.sync_start = time.monotonic()
+        self.write({"type": "sync", "time": time.time(), "servers": list(servers)})
+
+    def record(self, server, elapsed, response=None, error=None, kind=None):
+        """记录一次交换，elapsed单位为毫秒"""
+        if self.stream is None:
+            return
+        record = {"type": "exchange", "server": server, "elapsed": round(elapsed, 3)}
+        if self.sync_start is not None:
+            record["at"] = round((time.monotonic() - self.sync_start) * 1000, 3)
+        if response is not None and response.packet is None:
+            record.update(source=response.source, offset=response.offset, delay=response.delay,
+                          dispersion=response.root_dispersion, stratum=response.stratum,
+                          t1=response.t1, t4=response.t4, address=response.address)
+        elif response is not None:
+            record.update(packet=response.packet.hex(), t1=response.t1, t4=response.t4,
+                          address=response.address)
+            if response.interleaved:
+                record["interleaved"] = True
+        else:
+            record.update(error=error, kind=kind)
+        self.write(record)
+
+    def note_step(self, offset):
+        """记录本次同步中写入系统时钟的调整量，回放时用来把之后的交换换算回调整前的时钟"""
+        self.write({"type": "step", "offset": offset})
+
+
+# 进程内共享的录制器
+exchange_recorder = ExchangeRecorder()
+
+
+# 轨迹中的一次同步
+class RecordedSync:
+    def __init__(self, time, servers):
+        self.time = time
+        self.servers = servers
+        self.exchanges = []
+
+    def successes(self):
+        return [e for e in self.exchanges if e["response"] is not None]
+
+
+def load_response(record):
+    """由录制的报文和时间戳重建 NTPResponse（非NTP时间源重建 SourceResponse）"""
+    if "source" in record:
+        return SourceResponse(record["source"], record.get("address", ""), record["offset"], record["delay"],
+                              record["dispersion"], record["stratum"], record["t1"], record["t4"])
+    packet = NTPPacket.unpack(bytes.fromhex(record["packet"]))
+    response = NTPResponse(packet, record["t1"], record["t4"], record.get("address", ""))
+    response.interleaved = record.get("interleaved", False)
+    return response
+
+
+def read_lines(stream):
+    """逐行读取，文件末尾的gzip数据不完整（录制时程序意外退出）时读到能读的为止"""
+    try:
+        yield from stream
+    except EOFError:
+        return
+
+
+def load_trace(path):
+    """逐个返回轨迹中的 RecordedSync；每次交换的 response 已换算到本次同步开始时的时钟（扣除期间的调整）"""
+    current, shift = None, 0.0
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in read_lines(f):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 程序意外退出时最后一行可能不完整
+                continue
+            kind = record.get("type")
+            if kind == "sync":
+                if current is not None:
+                    yield current
+                current, shift = RecordedSync(record["time"], record["servers"]), 0.0
+            elif current is None:
+                continue
+            elif kind == "step":
+                shift += record["offset"]
+            elif kind == "exchange":
+                response = None
+                if "packet" in record or "source" in record:
+                    response = load_response(record)
+                    response.offset += shift
+                current.exchanges.append({"server": record["server"], "elapsed": record["elapsed"],
+                                          "response": response, "error": record.get("error"),
+                                          "kind": record.get("kind")})
+    if current is not None:
+        yield current
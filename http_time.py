@@ -0,0 +1,199 @@
+"""
+HTTP Date头时间源：出口封锁了UDP 123的网络中，通过普通的HTTP(S)请求读取服务器的Date头估计本机时钟偏移
+
+Date头只精确到秒。一次请求只能得出 Date ≤ 服务器处理时刻 < Date+1，而处理时刻位于本地发出请求(t1)
+和收到回复(t4)之间，于是偏移 θ 满足 Date - t4 < θ < Date + 1 - t1。之后的请求选在
+“按当前区间中点估计服务器恰好跨过整秒”的时刻发出（往返取中点），Date落在整秒的哪一边就排除区间的哪一半，
+几次之后区间宽度收敛到往返时间量级。各次请求复用同一个持久连接，TCP和TLS握手不计入往返时间。
+
+服务器写作 http://主机[:端口][/路径] 或 https://主机[:端口][/路径]，默认请求路径为 /（HEAD请求）。
+本文件还带有一个本地替身服务端（HTTPDateServer），可以给Date头加上任意偏移来演练。
+"""
+import math
+import time
+import socket
+import logging
+import threading
+import http.client
+from email.utils import parsedate_to_datetime, formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from cancellation import Cancelled
+from time_sources import SourceResponse, TimeSource
+
+HTTP_SCHEMES = ("http://", "https://")
+# 每次查询最多发出的请求数：第一次得到宽1秒的区间，之后每次大约减半
+HTTP_MAX_PROBES = 6
+# 区间宽度缩小到往返时间的这个倍数以内就不再继续（再多的请求也无法更准）
+HTTP_WIDTH_RTT_FACTOR = 1.5
+# 按预计的跨秒时刻发出请求时留出的提前量，保证来得及发出（秒）
+HTTP_SCHEDULE_MARGIN = 0.01
+# 假定网站服务器的时钟经过NTP同步，层级按公共NTP服务器的下游估计
+HTTP_STRATUM = 3
+
+
+def parse_http_server(server):
+    """http(s)://host[:port][/path] -> (scheme, host, port, path)"""
+    parts = urlsplit(server)
+    scheme = parts.scheme.lower()
+    port = parts.port or (443 if scheme == "https" else 80)
+    return scheme, parts.hostname, port, parts.path or "/"
+
+
+# HTTP Date头时间源：连接在多次查询之间保持
+class HTTPDateSource(TimeSource):
+    name = "http"
+    fallback = True
+
+    def __init__(self, max_probes=HTTP_MAX_PROBES):
+        self.max_probes = max_probes
+        self.connections = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("HTTPDate")
+
+    def matches(self, server):
+        return server.lower().startswith(HTTP_SCHEMES)
+
+    def connection(self, scheme, host, port, timeout):
+        """取出该服务器的持久连接，没有时新建；取出期间其他查询不会共用"""
+        with self.lock:
+            conn = self.connections.pop((scheme, host, port), None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conn = cls(host, port, timeout=timeout)
+        conn.timeout = timeout
+        if conn.sock is None:
+            conn.connect()
+        else:
+            conn.sock.settimeout(timeout)
+        return conn
+
+    def release(self, scheme, host, port, conn):
+        with self.lock:
+            old = self.connections.pop((scheme, host, port), None)
+            self.connections[(scheme, host, port)] = conn
+        if old is not None:
+            old.close()
+
+    def close(self):
+        with self.lock:
+            connections, self.connections = self.connections, {}
+        for conn in connections.values():
+            conn.close()
+
+    def probe(self, conn, host, path):
+        """发出一次HEAD请求，返回 (t1, t4, Date的Unix秒, 服务器是否要求关闭连接)"""
+        t1 = time.time()
+        conn.request("HEAD", path, headers={"Host": host, "Cache-Control": "no-cache"})
+        reply = conn.getresponse()
+        t4 = time.time()
+        reply.read()
+        date = reply.getheader("Date")
+        if not date:
+            raise ValueError("服务器回复中没有Date头")
+        return t1, t4, parsedate_to_datetime(date).timestamp(), reply.will_close
+
+    def query(self, server, timeout, cancel=None):
+        scheme, host, port, path = parse_http_server(server)
+        if cancel is not None:
+            cancel.check()
+        conn = self.connection(scheme, host, port, timeout)
+        try:
+            try:
+                first = self.probe(conn, host, path)
+            except (http.client.RemoteDisconnected, ConnectionError, http.client.BadStatusLine):
+                # 复用的连接已被服务器关闭，重新连接后再试一次
+                conn.close()
+                conn.connect()
+                first = self.probe(conn, host, path)
+            probes = [first]
+            lo, hi = first[2] - first[1], first[2] + 1 - first[0]
+            best_rtt = first[1] - first[0]
+            will_close = first[3]
+            while len(probes) < self.max_probes and not will_close:
+                if hi - lo <= HTTP_WIDTH_RTT_FACTOR * best_rtt:
+                    break
+                # 下一次请求让服务器的处理时刻（往返中点）落在按区间中点估计的下一个整秒上
+                middle = (lo + hi) / 2
+                earliest = time.time() + HTTP_SCHEDULE_MARGIN + best_rtt / 2
+                target = math.ceil(earliest + middle) - middle
+                wait = target - best_rtt / 2 - time.time()
+                if wait > 0:
+                    if cancel is not None:
+                        cancel.sleep(wait)
+                    else:
+                        time.sleep(wait)
+                t1, t4, date, will_close = self.probe(conn, host, path)
+                probes.append((t1, t4, date, will_close))
+                best_rtt = min(best_rtt, t4 - t1)
+                new_lo, new_hi = max(lo, date - t4), min(hi, date + 1 - t1)
+                if new_lo >= new_hi:
+                    # 与之前的请求矛盾（负载均衡后面的服务器时钟不一致或服务器时钟被调整过），从这次重新开始
+                    self.logger.debug(f"{server} 的Date头前后矛盾，重新估计")
+                    new_lo, new_hi = date - t4, date + 1 - t1
+                lo, hi = new_lo, new_hi
+        except Cancelled:
+            conn.close()
+            raise
+        except (OSError, http.client.HTTPException, ValueError, TypeError) as e:
+            conn.close()
+            if isinstance(e, socket.timeout):
+                raise
+            raise OSError(f"HTTP请求失败: {e}") from e
+        if will_close:
+            conn.close()
+        else:
+            self.release(scheme, host, port, conn)
+        t1, t4 = probes[-1][0], probes[-1][1]
+        return SourceResponse(self.name, host, (lo + hi) / 2, best_rtt, (hi - lo) / 2, HTTP_STRATUM, t1, t4)
+
+
+# 进程内共享的HTTP时间源（持久连接在多次同步之间复用）
+http_date_source = HTTPDateSource()
+
+
+# 本地替身服务端的请求处理：只回复带Date头的空响应
+class DateHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def date_time_string(self, timestamp=None):
+        return formatdate(time.time() + self.server.offset, usegmt=True)
+
+    def do_HEAD(self):
+        self.server.stats['requests'] += 1
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_GET = do_HEAD
+
+    def setup(self):
+        super().setup()
+        self.server.stats['connections'] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+# 本地HTTP替身服务端：Date头按本机时间加offset秒给出，支持持久连接
+class HTTPDateServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, offset=0.0):
+        super().__init__((host, port), DateHandler)
+        self.offset = offset
+        self.thread = None
+        self.stats = {'connections': 0, 'requests': 0}
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="HTTPDateServer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
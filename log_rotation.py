@@ -0,0 +1,165 @@
+"""
+带后台压缩的日志轮转
+
+日志文件写满后改名为带时间戳的归档（timesync.log.20261019-022540），由后台线程压缩为 .gz
+（安装了 zstandard 时可用 .zst），写日志的线程（包括界面线程）只做一次改名，从不做压缩。
+归档不再按编号依次改名，按总大小预算保留：超出预算时删除最旧的归档。
+程序在压缩完成前退出时，未压缩的归档会在下次启动时继续压缩。
+"""
+import os
+import re
+import gzip
+import time
+import queue
+import shutil
+import threading
+from logging.handlers import RotatingFileHandler
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 默认的归档总大小预算（压缩后），约相当于500MB未压缩日志
+DEFAULT_RETENTION_BYTES = 50 * 1024 * 1024
+ARCHIVE_RE = re.compile(r"^\d{8}-\d{6}(-\d+)?$")
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def archive_segments(base):
+    """列出 base 的所有轮转归档（含旧版本留下的 .1 ~ .5 编号备份），按修改时间从旧到新排列"""
+    directory = os.path.dirname(os.path.abspath(base))
+    prefix = os.path.basename(base) + "."
+    segments = []
+    for name in os.listdir(directory):
+        if not name.startswith(prefix):
+            continue
+        suffix = name[len(prefix):]
+        for extension in COMPRESSED_SUFFIXES.values():
+            if suffix.endswith(extension):
+                suffix = suffix[:-len(extension)]
+                break
+        if suffix.isdigit() or ARCHIVE_RE.match(suffix):
+            path = os.path.join(directory, name)
+            try:
+                segments.append((os.stat(path).st_mtime_ns, path))
+            except OSError:
+                pass
+    return [path for _, path in sorted(segments)]
+
+
+def compress_file(path, method):
+    """把归档压缩为 path + 扩展名，保留原修改时间后删除原文件；返回压缩后的路径"""
+    target = path + COMPRESSED_SUFFIXES[method]
+    tmp_path = target + ".tmp"
+    with open(path, "rb") as source:
+        if method == "zstd":
+            with open(tmp_path, "wb") as raw:
+                with zstandard.ZstdCompressor(level=10).stream_writer(raw) as destination:
+                    shutil.copyfileobj(source, destination, 256 * 1024)
+        else:
+            with gzip.open(tmp_path, "wb", compresslevel=6) as destination:
+                shutil.copyfileobj(source, destination, 256 * 1024)
+    stat = os.stat(path)
+    os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(tmp_path, target)
+    os.remove(path)
+    return target
+
+
+def enforce_retention(base, retention_bytes):
+    """归档总大小超出预算时从最旧的开始删除"""
+    sizes = []
+    for path in archive_segments(base):
+        try:
+            sizes.append((path, os.path.getsize(path)))
+        except OSError:
+            pass
+    total = sum(size for _, size in sizes)
+    for path, size in sizes:
+        if total <= retention_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+# 后台压缩线程，所有日志处理器共用
+class LogCompressor:
+    def __init__(self):
+        self.tasks = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, path, method, base, retention_bytes):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="LogCompressor", daemon=True)
+                self.thread.start()
+        self.tasks.put((path, method, base, retention_bytes))
+
+    def run(self):
+        while True:
+            path, method, base, retention_bytes = self.tasks.get()
+            try:
+                if path is not None:
+                    compress_file(path, method)
+                enforce_retention(base, retention_bytes)
+            except OSError:
+                # 压缩失败时保留未压缩的归档，下次启动重试
+                pass
+            finally:
+                self.tasks.task_done()
+
+
+# 进程内共享的压缩线程
+log_compressor = LogCompressor()
+
+
+# 日志写满后改名归档，交给后台线程压缩
+class CompressingRotatingFileHandler(RotatingFileHandler):
+    def __init__(self, filename, maxBytes=1024*1024, retention_bytes=DEFAULT_RETENTION_BYTES,
+                 compression=None, encoding='utf-8', delay=False):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=0, encoding=encoding, delay=delay)
+        if compression is None:
+            compression = "zstd" if zstandard is not None else "gzip"
+        elif compression == "zstd" and zstandard is None:
+            compression = "gzip"
+        self.compression = compression
+        self.retention_bytes = retention_bytes
+        self.resume_pending()
+
+    def resume_pending(self):
+        """继续压缩上次退出时还没压缩的归档"""
+        for path in archive_segments(self.baseFilename):
+            suffix = path[len(self.baseFilename) + 1:]
+            if ARCHIVE_RE.match(suffix):
+                log_compressor.submit(path, self.compression, self.baseFilename, self.retention_bytes)
+
+    def archive_name(self):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        name = f"{self.baseFilename}.{stamp}"
+        counter = 1
+        while any(os.path.exists(name + ext) for ext in ("", ".gz", ".zst")):
+            name = f"{self.baseFilename}.{stamp}-{counter}"
+            counter += 1
+        return name
+
+    def doRollover(self):
+        """只把当前文件改名为归档（很快），压缩和清理在后台线程进行"""
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        if os.path.exists(self.baseFilename):
+            archive = self.archive_name()
+            try:
+                os.rename(self.baseFilename, archive)
+            except OSError:
+                # 例如Windows上文件被其他进程占用，继续写原文件
+                archive = None
+            if archive is not None:
+                log_compressor.submit(archive, self.compression, self.baseFilename, self.retention_bytes)
+        if not self.delay:
+            self.stream = self._open()
@@ -0,0 +1,270 @@
+"""
+日志查询：按级别、时间范围、服务器和关键字流式筛选 timesync.log 及其轮转备份（含压缩的备份）
+
+日志行的时间戳格式为 "YYYY-MM-DD HH:MM:SS,mmm"，按字符串比较即按时间比较，筛选时不解析日期。
+每个已轮转的备份在第一次被完整扫描时建立索引：首尾时间，以及大约每64KB一个 (时间, 字节偏移) 采样点，
+保存在旁路文件 timesync.log.idx 中，以文件大小和修改时间为键（轮转改名后仍然有效）。
+按时间范围查询时，完全不在范围内的备份直接跳过，其余备份从索引中不晚于起始时间的采样点处开始读。
+
+用法: python log_search.py [关键字] [--level WARNING] [--since "2026-10-18 08:00"] [--until ...] [--server ntp.aliyun.com]
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import bisect
+import argparse
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from log_rotation import archive_segments
+
+DEFAULT_LOG_FILE = "timesync.log"
+# 索引采样点的间隔（字节）
+INDEX_STRIDE = 64 * 1024
+HEADER_RE = re.compile(rb"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - ([A-Z]+) - ")
+TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+
+# 一条日志记录（多行消息的后续行并入message）
+class LogEntry:
+    __slots__ = ("segment", "time", "level", "message")
+
+    def __init__(self, segment, time, level, message):
+        self.segment = segment
+        self.time = time
+        self.level = level
+        self.message = message
+
+    def __str__(self):
+        return f"{self.time} - {self.level} - {self.message}"
+
+
+def parse_time(text, end=False):
+    """把用户输入的时间转换为与日志相同格式的字符串；end为True时包含该秒（只给日期时包含整天）"""
+    text = text.strip()
+    for fmt in TIME_FORMATS:
+        try:
+            value = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        if not end:
+            return value.strftime("%Y-%m-%d %H:%M:%S,000")
+        if fmt == "%Y-%m-%d":
+            return value.strftime("%Y-%m-%d 23:59:59,999")
+        if fmt == "%Y-%m-%d %H:%M":
+            return value.strftime("%Y-%m-%d %H:%M:59,999")
+        return value.strftime("%Y-%m-%d %H:%M:%S,999")
+    raise ValueError(f"无法识别的时间: {text}（格式如 2026-10-18 08:00:00）")
+
+
+def find_segments(base=DEFAULT_LOG_FILE):
+    """按从旧到新的顺序列出日志文件：各轮转归档（含压缩的），最后是正在写入的 timesync.log"""
+    segments = archive_segments(base)
+    if os.path.exists(base):
+        segments.append(os.path.abspath(base))
+    return segments
+
+
+def open_segment(path):
+    """以二进制方式打开日志文件，压缩文件透明解压（支持tell和向前seek）"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"读取 {os.path.basename(path)} 需要安装 zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+def iter_lines(stream):
+    """逐行读取，返回 (行起始偏移, 行内容)；zstd流不支持readline，自行分行"""
+    offset = stream.tell()
+    if zstandard is None or not isinstance(stream, zstandard.ZstdDecompressionReader):
+        for line in iter(stream.readline, b""):
+            yield offset, line
+            offset += len(line)
+        return
+    pending = b""
+    while True:
+        chunk = stream.read(INDEX_STRIDE)
+        if not chunk:
+            break
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield offset, line + b"\n"
+            offset += len(line) + 1
+    if pending:
+        yield offset, pending
+
+
+def iter_records(stream):
+    """把日志行组装成记录，返回 (偏移, 时间, 级别, 消息)；文件开头没有时间戳的残行忽略"""
+    current = None
+    for offset, line in iter_lines(stream):
+        match = HEADER_RE.match(line)
+        if match:
+            if current is not None:
+                yield current
+            current = [offset, match.group(1).decode("ascii"), match.group(2).decode("ascii"),
+                       line[match.end():].decode("utf-8", "replace").rstrip("\r\n")]
+        elif current is not None:
+            current[3] += "\n" + line.decode("utf-8", "replace").rstrip("\r\n")
+    if current is not None:
+        yield current
+
+
+# 旁路索引文件
+class LogIndex:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def key(segment):
+        stat = os.stat(segment)
+        return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+    def get(self, segment):
+        return self.entries.get(self.key(segment))
+
+    def put(self, segment, first, last, points):
+        self.entries[self.key(segment)] = {"first": first, "last": last, "points": points}
+        self.dirty = True
+
+    def save(self, segments):
+        """只保留仍然存在的备份的索引，写入旁路文件"""
+        live = set()
+        for segment in segments:
+            try:
+                live.add(self.key(segment))
+            except OSError:
+                pass
+        stale = set(self.entries) - live
+        if not self.dirty and not stale:
+            return
+        for key in stale:
+            del self.entries[key]
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+        self.dirty = False
+
+
+def search(base=DEFAULT_LOG_FILE, min_level=None, since=None, until=None, server=None, pattern=None):
+    """
+    按从旧到新的顺序逐条返回匹配的 LogEntry（生成器，可边查边显示）
+
+    min_level 为级别名（如 "WARNING"，包含更高级别）；since/until 为 parse_time 返回的字符串；
+    server 按子串匹配整条记录；pattern 为不区分大小写的正则表达式
+    """
+    if min_level and min_level not in LEVELS:
+        raise ValueError(f"未知的日志级别: {min_level}")
+    threshold = LEVELS[min_level] if min_level else None
+    regex = re.compile(pattern, re.IGNORECASE) if pattern else None
+    segments = find_segments(base)
+    active = os.path.abspath(base)
+    index = LogIndex(active + ".idx")
+    try:
+        for segment in segments:
+            # 正在写入的日志不建索引（内容一直在变），已轮转的备份内容不再变化
+            cached = None if segment == active else index.get(segment)
+            if cached is not None:
+                if (since and cached["last"] < since) or (until and cached["first"] > until):
+                    continue
+            start = 0
+            if cached is not None and since:
+                times = [t for t, _ in cached["points"]]
+                position = bisect.bisect_left(times, since) - 1
+                if position >= 0:
+                    start = cached["points"][position][1]
+            # 只在从头完整扫描时顺便建立索引
+            building = cached is None and segment != active
+            points, first, last, next_point = [], None, None, 0
+            name = os.path.basename(segment)
+            with open_segment(segment) as stream:
+                if start:
+                    stream.seek(start)
+                for offset, time_text, level, message in iter_records(stream):
+                    if building:
+                        if first is None:
+                            first = time_text
+                        last = time_text
+                        if offset >= next_point:
+                            points.append([time_text, offset])
+                            next_point = offset + INDEX_STRIDE
+                    elif until and time_text > until:
+                        break
+                    if since and time_text < since:
+                        continue
+                    if until and time_text > until:
+                        continue
+                    if threshold is not None and LEVELS.get(level, 0) < threshold:
+                        continue
+                    if server and server not in message:
+                        continue
+                    if regex is not None and not regex.search(message):
+                        continue
+                    yield LogEntry(name, time_text, level, message)
+            if building and first is not None:
+                index.put(segment, first, last, points)
+            # 更新的备份只会更晚
+            segment_last = cached["last"] if cached is not None else last
+            if until and segment_last is not None and segment_last > until:
+                break
+    finally:
+        index.save([s for s in segments if s != active])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查询时间同步日志（含轮转和压缩的备份）")
+    parser.add_argument("pattern", nargs="?", help="消息中要查找的关键字（正则表达式，不区分大小写）")
+    parser.add_argument("--log-file", default=DEFAULT_LOG_FILE, help="日志文件路径")
+    parser.add_argument("--level", type=str.upper, choices=("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"),
+                        help="最低日志级别")
+    parser.add_argument("--since", help="起始时间，如 \"2026-10-18 08:00\"")
+    parser.add_argument("--until", help="结束时间（包含）")
+    parser.add_argument("--server", help="只显示包含该服务器的记录")
+    parser.add_argument("--limit", type=int, default=0, help="最多显示多少条（0表示不限）")
+    args = parser.parse_args(argv)
+
+    try:
+        since = parse_time(args.since) if args.since else None
+        until = parse_time(args.until, end=True) if args.until else None
+    except ValueError as e:
+        parser.error(str(e))
+
+    count = 0
+    results = search(args.log_file, args.level, since, until, args.server, args.pattern)
+    try:
+        for entry in results:
+            print(entry, flush=True)
+            count += 1
+            if args.limit and count >= args.limit:
+                break
+    finally:
+        results.close()
+    print(f"共 {count} 条匹配记录", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,13 +2,15 @@ import sys
 import os
 import time
 import threading
-import socket
 import ctypes
 import configparser
 import warnings
-from datetime import datetime, timezone, timedelta
+import argparse
+import getpass
+import subprocess
+from collections import deque
+from datetime import datetime, timedelta
 import logging
-from logging.handlers import RotatingFileHandler
 
 # 忽略sip相关的DeprecationWarning（兼容Win7和旧版本PyQt）
 warnings.filterwarnings('ignore', category=DeprecationWarning)
@@ -21,145 +23,229 @@ base_path = sys._MEIPASS if is_frozen else os.path.dirname(os.path.abspath(__fil
 try:
     from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                                QPushButton, QTextEdit, QLabel, QStatusBar, QSizePolicy,
-                               QMessageBox, QDialog, QTextBrowser, QFrame, QScrollArea)
-    from PyQt5.QtCore import Qt, QTimer, QThread, pyqtSignal, QSize, QMetaObject, Q_ARG, pyqtSlot
+                               QDialog, QTextBrowser, QFrame, QScrollArea, QAction,
+                               QSystemTrayIcon, QMenu, QStyle, QLineEdit, QComboBox, QPlainTextEdit)
+    from PyQt5.QtCore import (Qt, QTimer, pyqtSignal, QSize, QMetaObject, Q_ARG, pyqtSlot,
+                              QObject, QDir, QLockFile, QCoreApplication, QEvent,
+                              QRunnable, QThreadPool)
+    from PyQt5.QtNetwork import QLocalServer, QLocalSocket
     from PyQt5.QtGui import (QIcon, QFont, QColor, QPalette, QTextCharFormat, 
                            QTextCursor, QLinearGradient, QPainter, QBrush, QPen)
 except ImportError:
     print("请先安装PyQt5: pip install pyqt5")
     sys.exit(1)
 
-# 导入ntplib
-try:
-    import ntplib
-except ImportError:
-    print("请先安装ntplib: pip install ntplib")
-    sys.exit(1)
+import clock_backend
+import ntp_client
+from discipline import clock_state, sample_store, SAMPLE_FILE
+from ntp_server import NTPServer
+from metrics import MetricsServer, sync_metrics
+from tracing import tracer
+from cancellation import Cancelled, CancelToken
+from ntp_sync import NTPSync, ntp_blocked
+from http_time import http_date_source
+from exchange_trace import exchange_recorder
+from server_pool import pool_manager
+from sync_coordinator import SyncCoordinator
+from sync_schedule import SyncSchedule, DEFAULT_START_DELAY, DEFAULT_POLL_JITTER
+from clock_events import ClockEventWatcher
+import log_search
+from log_rotation import CompressingRotatingFileHandler
+from time_helper import HelperClient, KeyPipe, DEFAULT_HELPER_PORT, KEY_CHANNEL_STDOUT, read_key
 
 # 检查管理员权限
 def is_admin():
     try:
+        if sys.platform != 'win32':
+            return os.geteuid() == 0
         return ctypes.windll.shell32.IsUserAnAdmin()
     except:
         return False
 
-# 以管理员身份重新启动
-def run_as_admin():
-    executable = sys.executable
-    script = os.path.abspath(sys.argv[0])
-    params = ' '.join([script] + sys.argv[1:])
+# 读取进程资源占用
+def process_stats():
+    """返回 (常驻内存字节数, 累计唤醒次数)，唤醒次数取主动让出CPU的上下文切换次数，无法获取时为None"""
+    rss, wakeups = None, None
+    if sys.platform == 'win32':
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', ctypes.c_ulong), ('PageFaultCount', ctypes.c_ulong)] + \
+                       [(name, ctypes.c_size_t) for name in (
+                           'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage',
+                           'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage',
+                           'PagefileUsage', 'PeakPagefileUsage')]
+        try:
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            get_info = ctypes.windll.psapi.GetProcessMemoryInfo
+            get_info.argtypes = [ctypes.c_void_p, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), ctypes.c_ulong]
+            if get_info(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+                rss = counters.WorkingSetSize
+        except Exception:
+            pass
+        return rss, wakeups
     try:
-        ctypes.windll.shell32.ShellExecuteW(None, "runas", executable, params, None, 1)
-        return True
-    except:
-        return False
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith('voluntary_ctxt_switches:'):
+                    wakeups = int(line.split()[1])
+    except OSError:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        wakeups = usage.ru_nvcsw
+    return rss, wakeups
 
-# 设置Windows系统时间
-def set_windows_time(utc_time):
-    """设置Windows系统时间"""
+# ShellExecuteExW的参数结构，用于取得提权后助手的进程句柄
+class SHELLEXECUTEINFOW(ctypes.Structure):
+    _fields_ = [('cbSize', ctypes.c_ulong), ('fMask', ctypes.c_ulong), ('hwnd', ctypes.c_void_p),
+                ('lpVerb', ctypes.c_wchar_p), ('lpFile', ctypes.c_wchar_p), ('lpParameters', ctypes.c_wchar_p),
+                ('lpDirectory', ctypes.c_wchar_p), ('nShow', ctypes.c_int), ('hInstApp', ctypes.c_void_p),
+                ('lpIDList', ctypes.c_void_p), ('lpClass', ctypes.c_wchar_p), ('hkeyClass', ctypes.c_void_p),
+                ('dwHotKey', ctypes.c_ulong), ('hIconOrMonitor', ctypes.c_void_p), ('hProcess', ctypes.c_void_p)]
+
+# 以管理员身份启动时间设置助手（只有助手需要提权，GUI以普通权限运行），返回连接它的客户端
+def start_time_helper(port=DEFAULT_HELPER_PORT, start_timeout=30):
+    """密钥由助手生成并只交给本进程（见 time_helper.py），等待用户确认提权期间最多等start_timeout秒"""
+    if is_frozen:
+        executable = os.path.join(os.path.dirname(sys.executable), "TimeSyncHelper.exe")
+        params = []
+    else:
+        executable = sys.executable
+        params = [os.path.join(base_path, "time_helper.py")]
+    params += ["--port", str(port), "--parent", str(os.getpid())]
     try:
-        # 转换为本地时间
-        local_time = utc_time.astimezone()
-        
-        # 创建SYSTEMTIME结构
-        class SYSTEMTIME(ctypes.Structure):
-            _fields_ = [
-                ("wYear", ctypes.c_ushort),
-                ("wMonth", ctypes.c_ushort),
-                ("wDayOfWeek", ctypes.c_ushort),
-                ("wDay", ctypes.c_ushort),
-                ("wHour", ctypes.c_ushort),
-                ("wMinute", ctypes.c_ushort),
-                ("wSecond", ctypes.c_ushort),
-                ("wMilliseconds", ctypes.c_ushort)
-            ]
-        
-        st = SYSTEMTIME()
-        st.wYear = local_time.year
-        st.wMonth = local_time.month
-        st.wDay = local_time.day
-        st.wDayOfWeek = local_time.weekday()  # 0=Monday, 6=Sunday
-        st.wHour = local_time.hour
-        st.wMinute = local_time.minute
-        st.wSecond = local_time.second
-        st.wMilliseconds = local_time.microsecond // 1000
-        
-        # 调用Windows API
-        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
-        success = kernel32.SetLocalTime(ctypes.byref(st))
-        
-        if success:
-            return True, f"系统时间已更新: {local_time.strftime('%Y-%m-%d %H:%M:%S')}"
+        if sys.platform == 'win32':
+            pipe = KeyPipe()
+            info = SHELLEXECUTEINFOW(cbSize=ctypes.sizeof(SHELLEXECUTEINFOW), fMask=0x40,  # SEE_MASK_NOCLOSEPROCESS
+                                     lpVerb="runas", lpFile=executable,
+                                     lpParameters=subprocess.list2cmdline(params + ["--key-channel", pipe.name]),
+                                     lpDirectory=os.getcwd(), nShow=0)
+            if not ctypes.windll.shell32.ShellExecuteExW(ctypes.byref(info)) or not info.hProcess:
+                pipe.close()
+                return None
+            helper_pid = ctypes.windll.kernel32.GetProcessId(ctypes.c_void_p(info.hProcess))
+            ctypes.windll.kernel32.CloseHandle(ctypes.c_void_p(info.hProcess))
+            key = pipe.receive(helper_pid, start_timeout)
         else:
-            error_code = ctypes.get_last_error()
-            return False, f"设置系统时间失败，错误代码: {error_code}"
-    
-    except Exception as e:
-        return False, f"设置系统时间时发生错误: {str(e)}"
+            process = subprocess.Popen(["pkexec", executable] + params + ["--key-channel", KEY_CHANNEL_STDOUT],
+                                       stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+            try:
+                key = read_key(process.stdout, start_timeout)
+            finally:
+                process.stdout.close()
+    except Exception:
+        return None
+    return HelperClient(key, port=port) if key else None
 
-# NTP时间同步器
-class NTPSync:
-    def __init__(self, servers=None, timeout=15):
-        # 默认NTP服务器列表
-        self.default_servers = [
-            "ntp.ntsc.ac.cn",
-            "ntp.aliyun.com",
-            "pool.ntp.org",
-            "time.windows.com", 
-            "ntp.tencent.com",
-            "time.edu.cn",
-            "ntp.tuna.tsinghua.edu.cn",
-            "ntp1.aliyun.com",
-            "ntp2.aliyun.com",
-            "ntp3.aliyun.com",
-            "ntp4.aliyun.com",
-            "time1.cloud.tencent.com",
-            "time2.cloud.tencent.com",
-            "time3.cloud.tencent.com",
-            "time4.cloud.tencent.com"
-        ]
-        self.servers = servers or self.default_servers
-        self.timeout = timeout
-        self.logger = logging.getLogger("NTPSync")
-    
-    def get_time_from_server(self, server):
-        """从单个NTP服务器获取时间，返回延迟"""
-        start_time = time.time()
-        try:
-            client = ntplib.NTPClient()
-            response = client.request(server, version=3, timeout=self.timeout)
-            elapsed_time = (time.time() - start_time) * 1000  # 转换为毫秒
-            return True, response, None, elapsed_time
-        except socket.timeout:
-            elapsed_time = (time.time() - start_time) * 1000
-            return False, None, f"连接超时 ({self.timeout}秒)", elapsed_time
-        except socket.gaierror:
-            elapsed_time = (time.time() - start_time) * 1000
-            return False, None, "DNS解析失败", elapsed_time
-        except Exception as e:
-            elapsed_time = (time.time() - start_time) * 1000
-            return False, None, str(e), elapsed_time
+# 本进程启动的特权助手的客户端（密钥只在内存中）
+helper_client = None
+helper_lock = threading.Lock()
+
+def running_helper(timeout=1):
+    """本进程启动的助手仍在运行时返回其客户端，否则返回None（不会弹出提权提示）"""
+    client = helper_client
+    if client is None:
+        return None
+    client = HelperClient(client.key, port=client.port, timeout=timeout)
+    return client if client.ping() else None
+
+# 获取调整系统时间的后端：已有权限时直接调用，否则通过特权助手
+def get_clock(start_timeout=30):
+    global helper_client
+    if is_admin():
+        return clock_backend
+    with helper_lock:
+        if helper_client is None or not helper_client.ping():
+            helper_client = start_time_helper(start_timeout=start_timeout)
+        return helper_client
+
+# 界面和无界面模式默认使用的NTP服务器
+DEFAULT_SERVERS = [
+    "ntp.ntsc.ac.cn",
+    "pool.ntp.org",
+    "ntp.aliyun.com",
+    "time.windows.com", 
+    "ntp.tencent.com",
+    "time.edu.cn",
+    "ntp.tuna.tsinghua.edu.cn",
+    "ntp1.aliyun.com",
+    "ntp2.aliyun.com"
+]
+
+# 单实例标识（按用户区分，避免多用户共用/tmp时互相阻塞）
+SINGLE_INSTANCE_KEY = f"TimeSyncTool-{getpass.getuser()}"
+# 第二个实例可以转发给运行中实例的命令
+IPC_COMMANDS = ("show", "sync", "test")
+
+# 托盘模式下窗口隐藏时保留的最近日志条数，重新显示窗口时回放
+LOG_HISTORY_SIZE = 200
+
+# 日志查询窗口最多显示的记录数（超出后只计数）
+LOG_SEARCH_MAX_RESULTS = 5000
+
+# 显示毫秒时时钟的刷新间隔（秒）
+CLOCK_MS_INTERVAL = 0.05
+# 每次刷新安排在边界之后这么久触发，避免定时器略早触发时显示旧值
+CLOCK_TICK_SLACK = 0.002
+
+# 保持模式下自动修正的范围（秒）：预测偏移小于下限不值得调整，超过上限说明预测不可靠，不自动调整
+HOLDOVER_MIN_STEP = 0.005
+HOLDOVER_MAX_STEP = 0.1
+# 设置时钟后复查的服务器数：从选中的服务器开始取这么多个成功响应，按延迟最小者计算剩余偏移
+VERIFY_SOURCES = 2
+# 复查查询的超时（秒），时钟刚设置过，不必等慢服务器
+VERIFY_TIMEOUT = 5
+# 剩余偏移超过该值时再做一次修正（秒），0表示只记录不修正
+CORRECT_THRESHOLD = 0.02
+# 同步历史（用于估计频率误差，重启后继续有效）
+SYNC_HISTORY_FILE = "sync_history.json"
+
+def forward_to_running_instance(command, timeout_ms=300):
+    """把命令转发给正在运行的实例，成功返回True"""
+    client = QLocalSocket()
+    client.connectToServer(SINGLE_INSTANCE_KEY)
+    if not client.waitForConnected(timeout_ms):
+        return False
+    client.write((command + "\n").encode('utf-8'))
+    client.waitForBytesWritten(timeout_ms)
+    client.disconnectFromServer()
+    return True
+
+# 单实例IPC服务端：接收后续启动转发过来的命令
+class SingleInstanceServer(QObject):
+    command_received = pyqtSignal(str)
     
-    def sync_time(self):
-        """尝试从多个服务器同步时间"""
-        results = []
-        
-        for server in self.servers:
-            success, response, error, delay = self.get_time_from_server(server)
-            results.append({
-                'server': server,
-                'success': success,
-                'response': response,
-                'error': error,
-                'delay': delay
-            })
-            
-            if success:
-                # 转换为UTC时间
-                utc_time = datetime.fromtimestamp(response.tx_time, timezone.utc)
-                return True, utc_time, server, delay, results
-        
-        return False, None, None, None, results
+    def __init__(self, key=SINGLE_INSTANCE_KEY, parent=None):
+        super().__init__(parent)
+        self.key = key
+        self.server = QLocalServer(self)
+        self.server.newConnection.connect(self.on_new_connection)
+        self.logger = logging.getLogger("TimeSyncApp")
+    
+    def listen(self):
+        """开始监听，清理上次异常退出残留的socket文件"""
+        if self.server.listen(self.key):
+            return True
+        QLocalServer.removeServer(self.key)
+        return self.server.listen(self.key)
+    
+    def on_new_connection(self):
+        while self.server.hasPendingConnections():
+            conn = self.server.nextPendingConnection()
+            conn.readyRead.connect(lambda conn=conn: self.on_ready_read(conn))
+            conn.disconnected.connect(conn.deleteLater)
+    
+    def on_ready_read(self, conn):
+        while conn.canReadLine():
+            command = bytes(conn.readLine()).decode('utf-8', 'ignore').strip()
+            if command in IPC_COMMANDS:
+                self.command_received.emit(command)
+            else:
+                self.logger.warning(f"收到未知的实例间命令: {command!r}")
+    
+    def close(self):
+        self.server.close()
 
 # 日志处理器
 class LogHandler(logging.Handler):
@@ -172,73 +258,239 @@ class LogHandler(logging.Handler):
         QMetaObject.invokeMethod(self.text_widget, "append_log", Qt.QueuedConnection,
                                Q_ARG(str, msg), Q_ARG(int, record.levelno))
 
-# 后台同步线程
-class SyncThread(QThread):
-    sync_finished = pyqtSignal(bool, str, str, float)  # success, message, server, delay
-    sync_progress = pyqtSignal(str)
+# 执行一次完整的时间同步：查询服务器并调整系统时间
+def perform_sync(servers, cancel=None, correct_threshold=CORRECT_THRESHOLD):
+    """返回 (success, message, server, delay)，供界面线程和无界面模式共用；被取消时抛出Cancelled"""
+    # pool.ntp.org 类域名展开为池中当前质量最好的几个后端
+    ntp_sync = NTPSync(pool_manager.expand(servers), timeout=15)
+    success, utc_time, server, delay, results = ntp_sync.sync_time(cancel)
     
-    def __init__(self, servers):
-        super().__init__()
-        self.servers = servers
+    if not success:
+        error_messages = []
+        for result in results:
+            if not result['success']:
+                error_messages.append(f"{result['server']}: {result['error']} (延迟: {result['delay']:.2f}ms)")
+        sync_metrics.record_sync(False)
+        return False, "所有服务器同步失败:\n" + "\n".join(error_messages) + apply_holdover(), "", 0.0
     
-    def run(self):
-        try:
-            self.sync_progress.emit("开始时间同步...")
-            ntp_sync = NTPSync(self.servers, timeout=15)
-            
-            success, utc_time, server, delay, results = ntp_sync.sync_time()
-            
-            if success:
-                # 设置系统时间
-                set_success, set_message = set_windows_time(utc_time)
-                if set_success:
-                    local_time = utc_time.astimezone()
-                    message = f"时间同步成功!\n服务器: {server}\n延迟: {delay:.2f}ms\n本地时间: {local_time.strftime('%Y-%m-%d %H:%M:%S')}"
-                    self.sync_finished.emit(True, message, server, delay)
+    # 通过特权助手按偏移调整系统时间，避免把传输耗时算进设置的时间；已取消时不再修改时钟
+    if cancel is not None:
+        cancel.check()
+    response = results[-1]['response']
+    with tracer.span("helper_connect"):
+        clock = get_clock()
+    if clock is None:
+        set_success, set_message = False, "无法启动时间设置助手（需要管理员权限）"
+    else:
+        with tracer.span("set_clock", offset=response.offset):
+            set_success, set_message = clock_state.step(clock, response.offset)
+    if set_success:
+        exchange_recorder.note_step(response.offset)
+    # 即使设置失败也记录测得的偏移，服务端模式仍可对外提供修正后的时间
+    clock_state.update(server, response, applied=set_success)
+    sync_metrics.record_sync(set_success, response.offset)
+    
+    if not set_success:
+        return False, f"同步失败: {set_message}", "", 0.0
+    local_time = utc_time.astimezone()
+    message = f"时间同步成功!\n服务器: {server}\n延迟: {delay:.2f}ms\n本地时间: {local_time.strftime('%Y-%m-%d %H:%M:%S')}"
+    return True, message + verify_sync(ntp_sync, server, clock, correct_threshold, cancel), server, delay
+
+# 设置时钟后复查：查询其他几个服务器，测出设置后实际剩余的偏移
+def measure_residual(ntp_sync, server, cancel=None):
+    """
+    返回 (剩余偏移, 测得该值的服务器, 不确定度)，所有复查查询都失败时返回 (None, None, None)
+
+    刚用过的服务器还在最小查询间隔内，先用列表中的其他服务器复查；都没有回复时才等到它可以再次查询，
+    这次查询带着设置前那次交换的时间戳，服务器支持交错模式时正好同时作为交错模式的后续交换。
+    不确定度只对备用时间源（HTTP、Roughtime）给出，NTP为0；UDP 123被判断为封锁时不再用NTP服务器复查
+    """
+    candidates = [s for s in ntp_sync.servers if s != server
+                  and not (ntp_sync.source_for(s).port123 and ntp_blocked.is_set())]
+    replies = []
+    with tracer.span("verify") as span_args:
+        for candidate in candidates + [server]:
+            if len(replies) >= VERIFY_SOURCES or (candidate == server and replies):
+                break
+            if candidate == server and ntp_sync.source_for(server).name == "ntp":
+                wait = ntp_client.poll_gate.ready_in(server)
+                if wait > ntp_client.MIN_POLL_INTERVAL:
+                    break
+                if cancel is not None:
+                    cancel.sleep(wait)
                 else:
-                    self.sync_finished.emit(False, f"同步失败: {set_message}", "", 0.0)
-            else:
-                error_messages = []
-                for result in results:
-                    if not result['success']:
-                        error_messages.append(f"{result['server']}: {result['error']} (延迟: {result['delay']:.2f}ms)")
-                error_msg = "所有服务器同步失败:\n" + "\n".join(error_messages)
-                self.sync_finished.emit(False, error_msg, "", 0.0)
-        
-        except Exception as e:
-            self.sync_finished.emit(False, f"同步过程中发生错误: {str(e)}", "", 0.0)
+                    time.sleep(wait)
+            success, response, _, _ = ntp_sync.get_time_from_server(candidate, cancel)
+            if success:
+                uncertainty = response.root_dispersion if ntp_sync.source_for(candidate).fallback else 0.0
+                replies.append((response.delay, response.offset, candidate, uncertainty))
+        if not replies:
+            return None, None, None
+        _, residual, source, uncertainty = min(replies)
+        span_args['residual'] = residual
+    return residual, source, uncertainty
 
-# 服务器测试线程
-class TestServersThread(QThread):
-    test_finished = pyqtSignal(str)
-    test_progress = pyqtSignal(str)
-    
-    def __init__(self, servers):
+# 复查剩余偏移，超过阈值时再修正一次并重新复查；返回附加到成功消息后的说明
+def verify_sync(ntp_sync, server, clock, correct_threshold, cancel=None):
+    ntp_sync.timeout = VERIFY_TIMEOUT
+    residual, source, uncertainty = measure_residual(ntp_sync, server, cancel)
+    if residual is None:
+        return "\n复查: 所有服务器均无响应，未能测得剩余偏移"
+    message = f"\n剩余偏移: {residual * 1000:+.2f}ms ({source})"
+    # 备用时间源的测量本身有较大的不确定度，剩余偏移超出不确定度之外的部分才值得修正
+    if correct_threshold and abs(residual) > correct_threshold + uncertainty:
+        if cancel is not None:
+            cancel.check()
+        with tracer.span("correct_clock", offset=residual):
+            corrected, _ = clock_state.step(clock, residual)
+        if corrected:
+            exchange_recorder.note_step(residual)
+            clock_state.record_residual(residual, corrected=True)
+            sync_metrics.record_correction()
+            residual, source, _ = measure_residual(ntp_sync, server, cancel)
+            if residual is None:
+                return message + "，已修正一次，修正后复查无响应"
+            message += f"，已修正一次，修正后 {residual * 1000:+.2f}ms ({source})"
+    clock_state.record_residual(residual)
+    sync_metrics.record_residual(residual)
+    return message
+
+# 所有服务器都不可用时进入保持模式：按估计的频率误差预测偏移，预测足够可靠时做小幅修正
+def apply_holdover():
+    """返回附加到失败消息后的说明，从未同步过时返回空字符串"""
+    clock_state.enter_holdover()
+    if not clock_state.synced:
+        return ""
+    predicted, bound = clock_state.predicted_offset(), clock_state.error_bound()
+    message = f"\n\n保持模式: 预测偏移 {predicted * 1000:+.1f}ms，误差上界 ±{bound * 1000:.1f}ms"
+    if clock_state.frequency is None:
+        return message + "（频率误差尚未估计，不自动修正）"
+    if not (HOLDOVER_MIN_STEP <= abs(predicted) <= HOLDOVER_MAX_STEP and abs(predicted) > bound):
+        return message
+    # 保持模式不弹出提权提示：没有权限且助手未运行时只报告预测值
+    if is_admin():
+        clock = clock_backend
+    else:
+        clock = running_helper()
+        if clock is None:
+            return message
+    with tracer.span("holdover_step", offset=predicted):
+        applied, _ = clock_state.step(clock, predicted)
+    if not applied:
+        return message
+    clock_state.apply_holdover(predicted)
+    return message + "，已按预测修正系统时钟"
+
+# 后台任务的信号（QRunnable不是QObject，信号放在单独的对象上）
+class JobSignals(QObject):
+    finished = pyqtSignal(object)
+    progress = pyqtSignal(str)
+
+# 在共享线程池中运行的后台任务：func(job, *args) 的返回值通过finished信号传回界面线程
+class Job(QRunnable):
+    def __init__(self, func, *args):
         super().__init__()
-        self.servers = servers
+        self.setAutoDelete(False)
+        self.func = func
+        self.args = args
+        self.signals = JobSignals()
+        self.token = CancelToken()
+        # 记录任务提交和发出结果的时刻，用于统计线程切换延迟
+        self.created_ns = time.monotonic_ns()
+        self.finished_ns = 0
+    
+    def cancel(self):
+        self.token.cancel()
     
     def run(self):
+        tracer.record("thread_handoff", self.created_ns)
         try:
-            self.test_progress.emit("开始测试所有NTP服务器连接...")
-            ntp_sync = NTPSync(self.servers, timeout=5)
-            results = []
-            
-            for i, server in enumerate(self.servers):
-                self.test_progress.emit(f"测试服务器 ({i+1}/{len(self.servers)}): {server}")
-                success, _, error, delay = ntp_sync.get_time_from_server(server)
-                
-                if success:
-                    status = f"✅ 成功 (延迟: {delay:.2f}ms)"
-                    results.append(f"<span style='color:#2196F3; font-weight:bold;'>{server}:</span> {status}")
-                else:
-                    status = f"❌ 失败: {error} (延迟: {delay:.2f}ms)"
-                    results.append(f"<span style='color:#F44336; font-weight:bold;'>{server}:</span> {status}")
+            result = self.func(self, *self.args)
+        finally:
+            self.token.close()
+        self.finished_ns = time.monotonic_ns()
+        self.signals.finished.emit(result)
+
+# 时钟/网络事件：监视线程通过信号把事件转到界面线程
+class ClockEventBridge(QObject):
+    event_detected = pyqtSignal(str)
+
+# 事件触发的重新同步优先使用上次成功的服务器
+def targeted_servers(servers):
+    if clock_state.synced and clock_state.server:
+        return [clock_state.server] + [s for s in servers if s != clock_state.server]
+    return servers
+
+# 同步任务：返回 (success, message, server, delay)
+def sync_job(job, servers, correct_threshold=CORRECT_THRESHOLD):
+    try:
+        job.signals.progress.emit("开始时间同步...")
+        with tracer.span("sync"):
+            return perform_sync(servers, job.token, correct_threshold)
+    except Cancelled:
+        return (False, "同步已取消", "", 0.0)
+    except Exception as e:
+        return (False, f"同步过程中发生错误: {str(e)}", "", 0.0)
+
+# 服务器测试任务：返回结果HTML
+def test_servers_job(job, servers):
+    try:
+        job.signals.progress.emit("开始测试所有NTP服务器连接...")
+        ntp_sync = NTPSync(servers, timeout=5)
+        results = []
+        
+        for i, server in enumerate(servers):
+            job.signals.progress.emit(f"测试服务器 ({i+1}/{len(servers)}): {server}")
+            success, _, error, delay = ntp_sync.get_time_from_server(server, job.token)
             
-            result_text = "<br>".join(results)
-            self.test_finished.emit(f"<h3 style='color:#2196F3;'>服务器测试结果:</h3>{result_text}")
+            if success:
+                status = f"✅ 成功 (延迟: {delay:.2f}ms)"
+                results.append(f"<span style='color:#2196F3; font-weight:bold;'>{server}:</span> {status}")
+            else:
+                status = f"❌ 失败: {error} (延迟: {delay:.2f}ms)"
+                results.append(f"<span style='color:#F44336; font-weight:bold;'>{server}:</span> {status}")
         
-        except Exception as e:
-            self.test_finished.emit(f"<span style='color:#F44336; font-weight:bold;'>测试过程中发生错误:</span> {str(e)}")
+        result_text = "<br>".join(results)
+        return f"<h3 style='color:#2196F3;'>服务器测试结果:</h3>{result_text}"
+    
+    except Cancelled:
+        return "<span style='color:#FF9800; font-weight:bold;'>服务器测试已取消</span>"
+    except Exception as e:
+        return f"<span style='color:#F44336; font-weight:bold;'>测试过程中发生错误:</span> {str(e)}"
+
+# 稳定性分析任务：返回文本报告（NumPy只在需要时导入，不增加常驻内存）
+def analytics_job(job, path, server):
+    try:
+        import analytics
+        samples, server_names = analytics.load_samples(path)
+        return analytics.format_report(analytics.analyze(samples, server_names, server))
+    except Exception as e:
+        return f"分析失败: {str(e)}"
+
+# 日志查询任务：边查边通过progress信号分批发回匹配的行，返回 (匹配条数, 错误信息)
+def log_search_job(job, log_file, filters):
+    count = 0
+    batch = []
+    last_emit = time.monotonic()
+    try:
+        results = log_search.search(log_file, **filters)
+        for entry in results:
+            if job.token.cancelled:
+                results.close()
+                break
+            count += 1
+            if count <= LOG_SEARCH_MAX_RESULTS:
+                batch.append(str(entry))
+            # 每100毫秒发送一批，避免逐条跨线程发信号
+            if batch and time.monotonic() - last_emit >= 0.1:
+                job.signals.progress.emit("\n".join(batch))
+                batch = []
+                last_emit = time.monotonic()
+        if batch:
+            job.signals.progress.emit("\n".join(batch))
+        return count, ""
+    except Exception as e:
+        return count, str(e)
 
 # 自定义消息框（修复Win7兼容性）
 class CustomMessageBox(QDialog):
@@ -375,6 +627,146 @@ class CustomMessageBox(QDialog):
         # 直接绘制背景色，避免复杂的阴影计算
         painter.fillRect(self.rect(), QBrush(QColor(240, 240, 240, 200)))
 
+# 日志查询窗口
+class LogSearchDialog(QDialog):
+    def __init__(self, parent, log_file, servers):
+        super().__init__(parent)
+        self.setWindowTitle("🔎 查询日志")
+        self.setMinimumSize(900, 600)
+        self.log_file = log_file
+        self.job = None
+        
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(15, 15, 15, 15)
+        layout.setSpacing(10)
+        
+        # 筛选条件
+        filter_layout = QHBoxLayout()
+        self.level_combo = QComboBox()
+        self.level_combo.addItems(["全部级别", "INFO", "WARNING", "ERROR"])
+        filter_layout.addWidget(self.level_combo)
+        self.since_edit = QLineEdit()
+        self.since_edit.setPlaceholderText("起始时间 2026-10-18 08:00")
+        filter_layout.addWidget(self.since_edit)
+        self.until_edit = QLineEdit()
+        self.until_edit.setPlaceholderText("结束时间（包含）")
+        filter_layout.addWidget(self.until_edit)
+        self.server_combo = QComboBox()
+        self.server_combo.setEditable(True)
+        self.server_combo.addItems([""] + list(servers))
+        self.server_combo.lineEdit().setPlaceholderText("服务器")
+        filter_layout.addWidget(self.server_combo)
+        self.pattern_edit = QLineEdit()
+        self.pattern_edit.setPlaceholderText("关键字（正则）")
+        self.pattern_edit.returnPressed.connect(self.start_search)
+        filter_layout.addWidget(self.pattern_edit, 1)
+        self.search_btn = QPushButton("🔎 查询")
+        self.search_btn.clicked.connect(self.start_search)
+        filter_layout.addWidget(self.search_btn)
+        layout.addLayout(filter_layout)
+        
+        # 查询结果（纯文本控件追加大量行时开销小）
+        self.result_view = QPlainTextEdit()
+        self.result_view.setReadOnly(True)
+        self.result_view.setFont(QFont("Consolas", 10))
+        self.result_view.setLineWrapMode(QPlainTextEdit.NoWrap)
+        layout.addWidget(self.result_view, 1)
+        
+        self.status_label = QLabel("输入筛选条件后点击查询")
+        layout.addWidget(self.status_label)
+    
+    def start_search(self):
+        """按当前条件开始查询，正在进行的查询先取消"""
+        self.cancel_search()
+        try:
+            level = self.level_combo.currentText()
+            filters = {
+                'min_level': level if level in log_search.LEVELS else None,
+                'since': log_search.parse_time(self.since_edit.text()) if self.since_edit.text().strip() else None,
+                'until': log_search.parse_time(self.until_edit.text(), end=True) if self.until_edit.text().strip() else None,
+                'server': self.server_combo.currentText().strip() or None,
+                'pattern': self.pattern_edit.text().strip() or None,
+            }
+        except ValueError as e:
+            self.status_label.setText(f"❌ {e}")
+            return
+        self.result_view.clear()
+        self.status_label.setText("⏳ 正在查询...")
+        self.search_started = time.monotonic()
+        self.job = self.parent().start_job(self.on_search_finished, self.on_results_ready,
+                                           log_search_job, self.log_file, filters)
+    
+    def on_results_ready(self, lines):
+        # 已取消的查询还在队列中的结果不再显示
+        if self.job is None or self.sender() is not self.job.signals:
+            return
+        self.result_view.appendPlainText(lines)
+    
+    def on_search_finished(self, result):
+        self.job = None
+        count, error = result
+        elapsed = (time.monotonic() - self.search_started) * 1000
+        if error:
+            self.status_label.setText(f"❌ 查询失败: {error}")
+        elif count > LOG_SEARCH_MAX_RESULTS:
+            self.status_label.setText(f"✅ 共 {count} 条匹配记录（显示前 {LOG_SEARCH_MAX_RESULTS} 条），耗时 {elapsed:.0f}ms")
+        else:
+            self.status_label.setText(f"✅ 共 {count} 条匹配记录，耗时 {elapsed:.0f}ms")
+    
+    def cancel_search(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
+    
+    def closeEvent(self, event):
+        self.cancel_search()
+        event.accept()
+
+# 稳定性分析窗口
+class AnalyticsDialog(QDialog):
+    def __init__(self, parent, sample_file, servers):
+        super().__init__(parent)
+        self.setWindowTitle("📊 稳定性分析")
+        self.setMinimumSize(900, 600)
+        self.sample_file = sample_file
+        self.job = None
+        
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(15, 15, 15, 15)
+        layout.setSpacing(10)
+        
+        filter_layout = QHBoxLayout()
+        self.server_combo = QComboBox()
+        self.server_combo.setEditable(True)
+        self.server_combo.addItems([""] + list(servers))
+        self.server_combo.lineEdit().setPlaceholderText("全部服务器")
+        filter_layout.addWidget(self.server_combo, 1)
+        self.analyze_btn = QPushButton("📊 分析")
+        self.analyze_btn.clicked.connect(self.start_analysis)
+        filter_layout.addWidget(self.analyze_btn)
+        layout.addLayout(filter_layout)
+        
+        self.result_view = QPlainTextEdit()
+        self.result_view.setReadOnly(True)
+        self.result_view.setFont(QFont("Consolas", 10))
+        self.result_view.setLineWrapMode(QPlainTextEdit.NoWrap)
+        layout.addWidget(self.result_view, 1)
+    
+    def start_analysis(self):
+        """在线程池中分析样本文件（百万条样本约需零点几秒）"""
+        if self.job is not None:
+            return
+        self.analyze_btn.setEnabled(False)
+        self.result_view.setPlainText("⏳ 正在分析...")
+        server = self.server_combo.currentText().strip() or None
+        self.job = self.parent().start_job(self.on_analysis_finished, lambda message: None,
+                                           analytics_job, self.sample_file, server)
+    
+    def on_analysis_finished(self, report):
+        self.job = None
+        self.analyze_btn.setEnabled(True)
+        self.result_view.setPlainText(report)
+
 # 带边框的框架（兼容Win7）
 class BorderFrame(QFrame):
     def __init__(self, parent=None):
@@ -412,19 +804,40 @@ class TimeSyncApp(QMainWindow):
         
         # 初始化配置
         self.config_file = "settings.ini"
-        self.default_servers = [
-            "ntp.ntsc.ac.cn",
-            "pool.ntp.org",
-            "ntp.aliyun.com",
-            "time.windows.com", 
-            "ntp.tencent.com",
-            "time.edu.cn",
-            "ntp.tuna.tsinghua.edu.cn",
-            "ntp1.aliyun.com",
-            "ntp2.aliyun.com"
-        ]
+        self.correct_threshold = CORRECT_THRESHOLD
+        self.default_servers = DEFAULT_SERVERS.copy()
         self.servers = self.default_servers.copy()
         self.dark_mode = False  # 默认亮色模式
+        self.show_milliseconds = False  # 时钟是否显示毫秒
+        
+        # 托盘模式：关闭窗口时隐藏到托盘，隐藏期间销毁日志和服务器编辑区域，只保留同步定时器和最近日志
+        self.tray_mode = False
+        self.tray_icon = None
+        self.sync_timer = None
+        self.quitting = False
+        self.log_history = deque(maxlen=LOG_HISTORY_SIZE)
+        self.idle_stats = None  # 上次报告资源占用时的 (时刻, 唤醒次数)
+        self.panels = None
+        self.log_view = None
+        self.server_edit = None
+        self.log_search_dialog = None
+        self.analytics_dialog = None
+        
+        # 同步和测试任务共用的线程池，线程常驻复用；当前正在运行的任务
+        self.worker_pool = QThreadPool(self)
+        self.worker_pool.setMaxThreadCount(2)
+        self.worker_pool.setExpiryTimeout(-1)
+        self.jobs = set()
+        self.sync_job = None
+        self.test_job = None
+        # 合并并发的同步请求，所有请求方共享同一次同步的结果
+        self.sync_coordinator = SyncCoordinator(logger=logging.getLogger("TimeSyncApp"))
+        self.sync_future = None
+        # 时钟跳变、睡眠恢复、网络变化时立即重新同步
+        self.clock_events = ClockEventBridge(self)
+        self.clock_events.event_detected.connect(self.on_clock_event)
+        self.event_watcher = ClockEventWatcher(self.clock_events.event_detected.emit)
+        self.event_watcher.start()
         
         # 窗口拖动相关变量
         self.is_dragging = False
@@ -439,13 +852,25 @@ class TimeSyncApp(QMainWindow):
         # 创建UI
         self.create_ui()
         
-        # 启动自动同步
-        QTimer.singleShot(1000, self.auto_sync)
-        
-        # 启动时间更新定时器
+        # 同步时刻安排（main()按命令行参数替换），首次同步在事件循环启动后安排
+        self.sync_schedule = SyncSchedule(3600, start_delay=0.0)
+        QTimer.singleShot(0, self.schedule_first_sync)
+        
+        # 单实例IPC服务端，由main()在窗口创建后挂接
+        self.instance_server = None
+        # 局域网NTP服务端（--serve启用）
+        self.ntp_server = None
+        # OpenMetrics指标端点（--metrics-port启用）
+        self.metrics_server = None
+        # 计时导出文件（--trace-file启用）
+        self.trace_file = None
+        self.trace_format = "chrome"
+        
+        # 时间更新定时器：单次触发，每次重新对齐到下一个整秒；窗口显示时才启动（见showEvent）
         self.time_timer = QTimer()
+        self.time_timer.setSingleShot(True)
+        self.time_timer.setTimerType(Qt.PreciseTimer)
         self.time_timer.timeout.connect(self.update_current_time)
-        self.time_timer.start(1000)
 
     def paintEvent(self, event):
         # 简化绘制，修复Win7兼容性
@@ -566,8 +991,60 @@ class TimeSyncApp(QMainWindow):
         function_btn_layout.addWidget(self.clear_btn)
         self.clear_btn.clicked.connect(self.clear_log)
         
+        # 查询日志按钮
+        self.search_log_btn = QPushButton("🔎 查询日志")
+        self.search_log_btn.setFixedHeight(48)
+        self.search_log_btn.setFont(QFont("Microsoft YaHei", 11, QFont.Bold))
+        self.search_log_btn.setMinimumWidth(150)
+        function_btn_layout.addWidget(self.search_log_btn)
+        self.search_log_btn.clicked.connect(self.show_log_search)
+        
+        # 稳定性分析按钮
+        self.analytics_btn = QPushButton("📊 稳定性分析")
+        self.analytics_btn.setFixedHeight(48)
+        self.analytics_btn.setFont(QFont("Microsoft YaHei", 11, QFont.Bold))
+        self.analytics_btn.setMinimumWidth(150)
+        function_btn_layout.addWidget(self.analytics_btn)
+        self.analytics_btn.clicked.connect(self.show_analytics)
+        
         content_layout.addLayout(function_btn_layout)
         
+        # 服务器配置和日志区域（托盘模式下窗口隐藏时销毁，显示时重建）
+        self.content_layout = content_layout
+        self.create_panels()
+        
+        # 状态栏（高对比度）
+        self.status_bar = QStatusBar()
+        self.status_bar.setFixedHeight(30)
+        self.setStatusBar(self.status_bar)
+        self.status_bar.setFont(QFont("Microsoft YaHei", 9))
+        
+        self.status_label = QLabel("🚀 就绪 - 程序启动成功")
+        self.status_label.setMinimumWidth(300)
+        self.status_bar.addWidget(self.status_label)
+        
+        self.current_time_label = QLabel("")
+        self.current_time_label.setFont(QFont("Microsoft YaHei", 10, QFont.Bold))
+        self.current_time_label.setMinimumWidth(200)
+        # 右键菜单切换是否显示毫秒
+        self.current_time_label.setContextMenuPolicy(Qt.ActionsContextMenu)
+        self.ms_action = QAction("显示毫秒", self.current_time_label)
+        self.ms_action.setCheckable(True)
+        self.ms_action.setChecked(self.show_milliseconds)
+        self.ms_action.toggled.connect(self.toggle_milliseconds)
+        self.current_time_label.addAction(self.ms_action)
+        self.status_bar.addPermanentWidget(self.current_time_label)
+        
+        # 应用主题
+        self.apply_theme()
+    
+    def create_panels(self):
+        """创建服务器配置区域和日志区域，并回放保留的最近日志"""
+        self.panels = QWidget()
+        panels_layout = QVBoxLayout(self.panels)
+        panels_layout.setContentsMargins(0, 0, 0, 0)
+        panels_layout.setSpacing(15)
+        
         # 服务器配置区域（合理高度）
         server_frame = QFrame()
         server_frame.setObjectName("serverFrame")
@@ -602,7 +1079,7 @@ class TimeSyncApp(QMainWindow):
         """)
         server_layout.addWidget(self.server_edit)
         
-        content_layout.addWidget(server_frame)
+        panels_layout.addWidget(server_frame)
         
         # 日志显示区域（修复显示不全问题）- 占满所有剩余空间
         log_frame = QFrame()
@@ -646,29 +1123,25 @@ class TimeSyncApp(QMainWindow):
         self.log_view.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         log_layout.addWidget(self.log_view, 1)  # 日志区域占满剩余空间
         
-        content_layout.addWidget(log_frame, 1)  # 日志区域占满主内容区域剩余空间
-        
-        # 状态栏（高对比度）
-        self.status_bar = QStatusBar()
-        self.status_bar.setFixedHeight(30)
-        self.setStatusBar(self.status_bar)
-        self.status_bar.setFont(QFont("Microsoft YaHei", 9))
-        
-        self.status_label = QLabel("🚀 就绪 - 程序启动成功")
-        self.status_label.setMinimumWidth(300)
-        self.status_bar.addWidget(self.status_label)
-        
-        self.current_time_label = QLabel("")
-        self.current_time_label.setFont(QFont("Microsoft YaHei", 10, QFont.Bold))
-        self.current_time_label.setMinimumWidth(200)
-        self.status_bar.addPermanentWidget(self.current_time_label)
+        panels_layout.addWidget(log_frame, 1)  # 日志区域占满剩余空间
+        self.content_layout.addWidget(self.panels, 1)  # 占满主内容区域剩余空间
         
-        # 应用主题
-        self.apply_theme()
+        for message, level in self.log_history:
+            self.render_log(message, level)
         
         # 连接服务器配置变更
         self.server_edit.textChanged.connect(self.save_servers)
     
+    def destroy_panels(self):
+        """销毁服务器配置区域和日志区域（包括日志文档），释放内存"""
+        if self.panels is None:
+            return
+        self.content_layout.removeWidget(self.panels)
+        self.panels.deleteLater()
+        self.panels = None
+        self.log_view = None
+        self.server_edit = None
+    
     def toggle_maximize(self):
         """切换窗口最大化/还原"""
         if self.isMaximized():
@@ -679,25 +1152,36 @@ class TimeSyncApp(QMainWindow):
             self.max_btn.setText("☐")
     
     def setup_logging(self):
-        # 配置日志
+        # 配置日志：处理器挂在根日志器上，NTPClient、NTPSync、NTSClient、ServerPool 等模块的日志同样写入文件和界面
         self.logger = logging.getLogger("TimeSyncApp")
-        self.logger.setLevel(logging.INFO)
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
         
-        # 文件日志
-        file_handler = RotatingFileHandler("timesync.log", maxBytes=1024*1024, backupCount=5, encoding='utf-8')
+        # 文件日志（写满1MB后归档，由后台线程压缩，按总大小预算保留）
+        file_handler = CompressingRotatingFileHandler("timesync.log", maxBytes=1024*1024)
         file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
         file_handler.setFormatter(file_formatter)
-        self.logger.addHandler(file_handler)
+        root.addHandler(file_handler)
         
         # UI日志
         ui_handler = LogHandler(self)
         ui_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
         ui_handler.setFormatter(ui_formatter)
-        self.logger.addHandler(ui_handler)
+        root.addHandler(ui_handler)
     
     @pyqtSlot(str, int)
     def append_log(self, message, level=logging.INFO):
-        """向UI添加日志（确保完全显示）"""
+        """向UI添加日志（确保完全显示）；日志区域已销毁时只保留在最近日志中"""
+        self.log_history.append((message, level))
+        if self.log_view is None:
+            return
+        self.render_log(message, level)
+        
+        # 强制刷新界面
+        QApplication.processEvents()
+    
+    def render_log(self, message, level):
+        """把一条日志写入日志区域"""
         # 禁用更新，提高性能
         self.log_view.blockSignals(True)
         
@@ -732,9 +1216,6 @@ class TimeSyncApp(QMainWindow):
         
         # 启用更新
         self.log_view.blockSignals(False)
-        
-        # 强制刷新界面
-        QApplication.processEvents()
     
     def apply_theme(self):
         """完善主题一致性 - 所有按钮都有主题色"""
@@ -1211,6 +1692,8 @@ class TimeSyncApp(QMainWindow):
         self.test_btn.setStyleSheet(test_btn_style)    # 测试服务器（青绿色）
         self.theme_btn.setStyleSheet(theme_btn_style)  # 主题切换（紫色）
         self.clear_btn.setStyleSheet(clear_btn_style)  # 清除日志（橙色）
+        self.search_log_btn.setStyleSheet(test_btn_style)  # 查询日志（与测试服务器同色）
+        self.analytics_btn.setStyleSheet(test_btn_style)  # 稳定性分析（与测试服务器同色）
         
         # 重新连接关闭按钮功能
         self.close_btn.clicked.connect(self.close)
@@ -1232,6 +1715,7 @@ class TimeSyncApp(QMainWindow):
                 config.read(self.config_file, encoding='utf-8')
                 if 'Settings' in config:
                     self.dark_mode = config.getboolean('Settings', 'dark_mode', fallback=False)
+                    self.show_milliseconds = config.getboolean('Settings', 'show_milliseconds', fallback=False)
                     if 'servers' in config['Settings']:
                         server_list = [s.strip() for s in config['Settings']['servers'].split('\n') if s.strip()]
                         if server_list:
@@ -1255,6 +1739,7 @@ class TimeSyncApp(QMainWindow):
         config = configparser.ConfigParser()
         config['Settings'] = {
             'dark_mode': str(self.dark_mode),
+            'show_milliseconds': str(self.show_milliseconds),
             'servers': '\n'.join(self.servers)
         }
         try:
@@ -1283,26 +1768,41 @@ class TimeSyncApp(QMainWindow):
     def auto_sync(self):
         """自动同步时间"""
         self.logger.info("🚀 启动自动时间同步...")
-        self.sync_btn.setEnabled(False)
-        self.sync_btn.setText("🔄 同步中...")
-        self.status_label.setText("⏳ 正在自动同步时间...")
-        
-        self.sync_thread = SyncThread(self.servers)
-        self.sync_thread.sync_finished.connect(self.on_sync_finished)
-        self.sync_thread.sync_progress.connect(self.on_sync_progress)
-        self.sync_thread.start()
+        self.request_sync("⏳ 正在自动同步时间...")
     
     def manual_sync(self):
         """手动同步时间"""
         self.logger.info("👤 用户手动触发时间同步")
+        self.request_sync("⏳ 正在手动同步时间...")
+    
+    def on_clock_event(self, reason):
+        """时钟跳变、睡眠恢复或网络变化：忽略最小间隔立即重新同步，结果不弹窗"""
+        self.logger.warning(f"⚡ {reason}，立即重新同步")
+        self.request_sync("⏳ 检测到时钟或网络变化，正在重新同步...", force=True, quiet=True)
+    
+    def request_sync(self, status_message, force=False, quiet=False):
+        """通过同步协调器请求同步：进行中时并入当前同步，距上次同步太近时直接使用上次结果"""
+        servers = targeted_servers(self.servers) if force else self.servers
+        future = self.sync_coordinator.submit(lambda: self.launch_sync(status_message, servers), force)
+        if future is self.sync_future:
+            return
+        self.sync_future = future
+        future.add_done_callback(lambda f: self.on_sync_done(f, quiet))
+    
+    def launch_sync(self, status_message, servers):
+        """真正发起一次同步（由协调器调用）"""
         self.sync_btn.setEnabled(False)
         self.sync_btn.setText("🔄 同步中...")
-        self.status_label.setText("⏳ 正在手动同步时间...")
+        self.status_label.setText(status_message)
         
-        self.sync_thread = SyncThread(self.servers)
-        self.sync_thread.sync_finished.connect(self.on_sync_finished)
-        self.sync_thread.sync_progress.connect(self.on_sync_progress)
-        self.sync_thread.start()
+        self.sync_job = self.start_job(self.sync_coordinator.finish, self.on_sync_progress,
+                                       sync_job, servers, self.correct_threshold)
+    
+    def on_sync_done(self, future, quiet=False):
+        """同步结果就绪（在调用finish的界面线程中回调）"""
+        if self.sync_future is future:
+            self.sync_future = None
+        self.on_sync_finished(*future.result(), quiet=quiet)
     
     def test_servers(self):
         """测试所有NTP服务器连接"""
@@ -1311,22 +1811,52 @@ class TimeSyncApp(QMainWindow):
         self.status_label.setText("🔍 正在测试服务器连接...")
         self.append_log("🔧 开始测试所有NTP服务器连接...", logging.INFO)
         
-        self.test_thread = TestServersThread(self.servers)
-        self.test_thread.test_finished.connect(self.on_test_finished)
-        self.test_thread.test_progress.connect(self.on_test_progress)
-        self.test_thread.start()
+        self.test_job = self.start_job(self.on_test_finished, self.on_test_progress,
+                                       test_servers_job, self.servers)
+    
+    def start_job(self, on_finished, on_progress, func, *args):
+        """把任务提交到线程池，完成后在界面线程调用on_finished"""
+        job = Job(func, *args)
+        job.signals.progress.connect(on_progress)
+        job.signals.finished.connect(lambda result: self.on_job_finished(job, on_finished, result))
+        self.jobs.add(job)
+        self.worker_pool.start(job)
+        return job
+    
+    def on_job_finished(self, job, on_finished, result):
+        # 结果从工作线程传回界面线程的耗时
+        tracer.record("result_handoff", job.finished_ns, job=job.func.__name__)
+        self.jobs.discard(job)
+        if self.sync_job is job:
+            self.sync_job = None
+        if self.test_job is job:
+            self.test_job = None
+        # 被取消的任务（如关闭窗口时）不再弹出结果
+        if not job.token.cancelled:
+            on_finished(result)
     
     def on_sync_progress(self, message):
         """同步进度更新"""
         self.status_label.setText(message)
         self.logger.info(message)
     
-    def on_sync_finished(self, success, message, server, delay):
+    def on_sync_finished(self, success, message, server, delay, quiet=False):
         """同步完成处理"""
         self.sync_btn.setEnabled(True)
         self.sync_btn.setText("🔄 手动同步时间")
         self.status_label.setText("✅ 就绪 - 同步完成" if success else "❌ 同步失败")
         
+        # 事件触发的同步和窗口隐藏在托盘时不弹出对话框，改为托盘通知（只通知失败）
+        if quiet or (not self.isVisible() and self.tray_icon is not None):
+            if success:
+                self.logger.info(f"✅ 时间同步成功: {message}")
+            else:
+                self.logger.error(f"❌ 时间同步失败: {message}")
+                if self.tray_icon is not None:
+                    self.tray_icon.showMessage("同步失败", message.split("\n")[0], QSystemTrayIcon.Warning)
+            self.update_tray_tooltip()
+            return
+        
         if success:
             self.logger.info(f"✅ 时间同步成功: {message}")
             msg_box = CustomMessageBox(self, "同步成功", message, True)
@@ -1354,44 +1884,463 @@ class TimeSyncApp(QMainWindow):
     
     def clear_log(self):
         """清除日志"""
-        self.log_view.clear()
+        self.log_history.clear()
+        if self.log_view is not None:
+            self.log_view.clear()
         self.logger.info("🧹 日志已清除")
         self.append_log("🧹 日志已清除", logging.INFO)
     
+    def show_log_search(self):
+        """打开日志查询窗口（已打开时激活）"""
+        if self.log_search_dialog is None:
+            self.log_search_dialog = LogSearchDialog(self, "timesync.log", self.servers)
+        self.log_search_dialog.show()
+        self.log_search_dialog.raise_()
+        self.log_search_dialog.activateWindow()
+    
+    def show_analytics(self):
+        """打开稳定性分析窗口（已打开时激活），首次打开时自动分析一次"""
+        if self.analytics_dialog is None:
+            self.analytics_dialog = AnalyticsDialog(self, os.path.abspath(SAMPLE_FILE), self.servers)
+            self.analytics_dialog.start_analysis()
+        self.analytics_dialog.show()
+        self.analytics_dialog.raise_()
+        self.analytics_dialog.activateWindow()
+    
+    def start_ntp_server(self, host, port):
+        """启动局域网NTP服务端，对外提供本机同步后的时间"""
+        try:
+            self.ntp_server = NTPServer(host=host, port=port)
+        except OSError as e:
+            self.logger.error(f"❌ NTP服务端启动失败 ({host}:{port}): {e}")
+            return
+        self.ntp_server.start()
+        export_ntp_server_metrics(self.ntp_server)
+        self.logger.info(f"📡 NTP服务端已启动: {host}:{port}")
+    
+    def handle_ipc_command(self, command):
+        """处理其他启动实例转发过来的命令"""
+        self.logger.info(f"📨 收到来自新启动实例的命令: {command}")
+        if command == "show":
+            self.show_window()
+        elif command == "sync":
+            self.manual_sync()
+        elif command == "test":
+            if self.test_btn.isEnabled():
+                self.test_servers()
+            else:
+                self.logger.info("服务器测试正在进行中，忽略重复的测试命令")
+    
+    def show_window(self):
+        """显示并激活主窗口，托盘模式下先重建日志和服务器编辑区域"""
+        if self.panels is None:
+            self.create_panels()
+        if self.isMinimized():
+            self.showNormal()
+        self.show()
+        self.raise_()
+        self.activateWindow()
+    
+    def schedule_first_sync(self):
+        """按同步时刻安排启动首次自动同步"""
+        delay = self.sync_schedule.first_delay()
+        if delay > 2:
+            self.logger.info(f"⏳ 首次同步将在 {delay:.0f} 秒后进行")
+        QTimer.singleShot(int(delay * 1000), self.auto_sync)
+    
+    def schedule_next_sync(self):
+        """托盘模式：安排下一次定时同步（带抖动或对齐到本机槽位）"""
+        self.sync_timer.start(int(self.sync_schedule.next_delay() * 1000))
+    
+    def on_sync_timer(self):
+        self.auto_sync()
+        self.schedule_next_sync()
+    
+    def enable_tray(self, interval, start_hidden=True):
+        """进入托盘模式：按interval秒定时同步，关闭窗口时隐藏到托盘"""
+        if not QSystemTrayIcon.isSystemTrayAvailable():
+            self.logger.warning("⚠️ 系统托盘不可用，以普通窗口模式运行")
+            return False
+        self.tray_mode = True
+        QApplication.setQuitOnLastWindowClosed(False)
+        
+        icon = self.windowIcon()
+        if icon.isNull():
+            icon = self.style().standardIcon(QStyle.SP_ComputerIcon)
+        self.tray_icon = QSystemTrayIcon(icon, self)
+        menu = QMenu(self)
+        menu.addAction("🖥️ 显示窗口", self.show_window)
+        menu.addAction("🔄 立即同步", self.auto_sync)
+        menu.addAction("📊 资源占用", self.report_idle_usage)
+        menu.addSeparator()
+        menu.addAction("📤 退出", self.quit_from_tray)
+        self.tray_icon.setContextMenu(menu)
+        self.tray_icon.activated.connect(self.on_tray_activated)
+        self.tray_icon.show()
+        
+        self.sync_schedule.interval = interval
+        self.sync_timer = QTimer(self)
+        self.sync_timer.setSingleShot(True)
+        self.sync_timer.timeout.connect(self.on_sync_timer)
+        self.schedule_next_sync()
+        self.logger.info(f"📥 托盘模式已启用，{self.sync_schedule.describe()}")
+        self.update_tray_tooltip()
+        if start_hidden:
+            self.hide_to_tray()
+        return True
+    
+    def on_tray_activated(self, reason):
+        if reason in (QSystemTrayIcon.Trigger, QSystemTrayIcon.DoubleClick):
+            self.show_window()
+    
+    def hide_to_tray(self):
+        """隐藏窗口并销毁占内存的区域，开始统计空闲资源占用"""
+        self.hide()
+        self.destroy_panels()
+        self.idle_stats = (time.monotonic(), process_stats()[1])
+    
+    def quit_from_tray(self):
+        self.quitting = True
+        self.close()
+    
+    def report_idle_usage(self):
+        """记录当前常驻内存，以及自上次报告以来的平均唤醒频率"""
+        rss, wakeups = process_stats()
+        parts = [f"内存 {rss / 1048576:.1f} MB" if rss is not None else "内存 未知"]
+        now = time.monotonic()
+        if wakeups is not None and self.idle_stats is not None and self.idle_stats[1] is not None:
+            elapsed = now - self.idle_stats[0]
+            if elapsed > 0:
+                parts.append(f"唤醒 {(wakeups - self.idle_stats[1]) / elapsed:.2f} 次/秒（{elapsed:.0f} 秒内）")
+        self.idle_stats = (now, wakeups)
+        self.logger.info("📊 资源占用: " + "，".join(parts))
+        self.update_tray_tooltip(rss)
+    
+    def update_tray_tooltip(self, rss=None):
+        if self.tray_icon is None:
+            return
+        lines = ["时间同步工具"]
+        if clock_state.synced:
+            lines.append(f"服务器: {clock_state.server}")
+            lines.append(f"偏移: {clock_state.offset * 1000:+.1f}ms")
+            if clock_state.residual is not None:
+                lines.append(f"剩余偏移: {clock_state.residual * 1000:+.2f}ms")
+            if clock_state.holdover:
+                lines.append(f"保持模式: 误差上界 ±{clock_state.error_bound() * 1000:.1f}ms")
+        if rss is not None:
+            lines.append(f"内存: {rss / 1048576:.1f} MB")
+        self.tray_icon.setToolTip("\n".join(lines))
+    
     def update_current_time(self):
-        """更新当前时间显示（高对比度）"""
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.current_time_label.setText(f"⏰ 当前时间: {current_time}")
+        """更新当前时间显示（高对比度），附带最近一次测得的偏移，并安排下一次刷新"""
+        now = clock_state.now()
+        local_time = datetime.fromtimestamp(now)
+        current_time = local_time.strftime("%Y-%m-%d %H:%M:%S")
+        if self.show_milliseconds:
+            current_time += f".{local_time.microsecond // 1000:03d}"
+        text = f"⏰ 当前时间: {current_time}"
+        if clock_state.holdover:
+            text += f"  (保持模式 ±{clock_state.error_bound() * 1000:.1f}ms)"
+        elif clock_state.synced:
+            text += f"  (偏移 {clock_state.offset * 1000:+.1f}ms)"
+        self.current_time_label.setText(text)
+        self.schedule_clock_tick(now)
+    
+    def schedule_clock_tick(self, now=None):
+        """让定时器在下一个整秒（显示毫秒时为下一个刷新间隔）刚过时触发"""
+        interval = CLOCK_MS_INTERVAL if self.show_milliseconds else 1.0
+        if now is None:
+            now = clock_state.now()
+        delay = interval - now % interval + CLOCK_TICK_SLACK
+        self.time_timer.start(int(delay * 1000) + 1)
+    
+    def toggle_milliseconds(self, checked):
+        """切换时钟是否显示毫秒"""
+        self.show_milliseconds = checked
+        self.save_config()
+        if self.time_timer.isActive():
+            self.update_current_time()
+    
+    def showEvent(self, event):
+        """窗口显示时恢复时钟刷新"""
+        super().showEvent(event)
+        if hasattr(self, 'time_timer') and not self.isMinimized():
+            self.update_current_time()
+    
+    def hideEvent(self, event):
+        """窗口隐藏时停止时钟刷新，避免无用的重绘"""
+        super().hideEvent(event)
+        if hasattr(self, 'time_timer'):
+            self.time_timer.stop()
+    
+    def changeEvent(self, event):
+        """最小化时停止时钟刷新，还原后立即刷新并重新对齐"""
+        if event.type() == QEvent.WindowStateChange and hasattr(self, 'time_timer'):
+            if self.isMinimized():
+                self.time_timer.stop()
+            elif self.isVisible():
+                self.update_current_time()
+        super().changeEvent(event)
     
     def closeEvent(self, event):
         """关闭事件处理"""
+        # 托盘模式下关闭按钮只隐藏到托盘，从托盘菜单退出时才真正关闭
+        if self.tray_mode and not self.quitting:
+            event.ignore()
+            self.hide_to_tray()
+            return
+        
         self.logger.info("📤 CloseOperation: 程序正在关闭，清理资源...")
         
-        # 停止所有线程
-        if hasattr(self, 'sync_thread') and self.sync_thread.isRunning():
-            self.sync_thread.quit()
-            self.sync_thread.wait(2000)
+        # 停止时钟/网络事件监视
+        self.event_watcher.stop()
         
-        if hasattr(self, 'test_thread') and self.test_thread.isRunning():
-            self.test_thread.quit()
-            self.test_thread.wait(2000)
+        # 取消所有后台任务：正在等待网络回复的任务会立即返回
+        for job in list(self.jobs):
+            job.cancel()
+        self.worker_pool.waitForDone(1000)
+        if self.log_search_dialog is not None:
+            self.log_search_dialog.cancel_search()
         
         # 停止定时器
         if hasattr(self, 'time_timer') and self.time_timer.isActive():
             self.time_timer.stop()
+        if self.sync_timer is not None:
+            self.sync_timer.stop()
+        if self.tray_icon is not None:
+            self.tray_icon.hide()
+        
+        # 停止单实例IPC服务
+        if self.instance_server is not None:
+            self.instance_server.close()
+        
+        # 停止NTP服务端
+        if self.ntp_server is not None:
+            self.ntp_server.stop()
+        
+        # 停止指标端点
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        
+        # 停止服务器池的后台刷新
+        pool_manager.stop()
+        exchange_recorder.close()
+        http_date_source.close()
+        
+        # 导出同步各阶段的计时
+        if self.trace_file:
+            count = tracer.export(self.trace_file, self.trace_format)
+            self.logger.info(f"⏱️ 已导出 {count} 条计时记录到 {self.trace_file}")
+        
+        # 通知本进程启动的特权助手退出（即使没有通知到，助手也会在本进程退出后自行退出）
+        helper = running_helper(timeout=0.5)
+        if helper is not None:
+            helper.shutdown()
         
         event.accept()
+        if self.tray_mode:
+            QApplication.quit()
+
+# 启动本地OpenMetrics端点
+def start_metrics_server(host, port, logger):
+    try:
+        server = MetricsServer(sync_metrics.registry, host=host, port=port)
+    except OSError as e:
+        logger.error(f"❌ 指标端点启动失败 ({host}:{port}): {e}")
+        return None
+    server.start()
+    export_clock_metrics()
+    logger.info(f"📈 指标端点已启动: http://{host}:{port}/metrics")
+    return server
+
+# 把保持模式的预测和不确定度导出为指标（抓取时读取）
+def export_clock_metrics():
+    sync_metrics.add_callback_gauge("timesync_holdover", "是否处于保持模式（所有服务器不可用）",
+                                    lambda: 1 if clock_state.holdover else 0)
+    sync_metrics.add_callback_gauge("timesync_predicted_offset_seconds", "按频率误差预测的当前偏移",
+                                    lambda: clock_state.predicted_offset() if clock_state.synced else None)
+    sync_metrics.add_callback_gauge("timesync_error_bound_seconds", "当前时间的误差上界",
+                                    lambda: clock_state.error_bound() if clock_state.synced else None)
+    sync_metrics.add_callback_gauge("timesync_frequency_ppm", "估计的本机时钟频率误差",
+                                    lambda: None if clock_state.frequency is None else clock_state.frequency * 1e6)
+
+# 把NTP服务端的统计导出为指标（抓取时读取）
+def export_ntp_server_metrics(ntp_server):
+    for key in ntp_server.stats:
+        sync_metrics.add_callback_gauge(f"timesync_ntp_server_{key}_packets",
+                                        f"NTP服务端统计: {key}",
+                                        lambda key=key: ntp_server.stats[key])
+
+# 命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="时间同步工具")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--show", dest="command", action="store_const", const="show",
+                       help="显示主窗口（默认）")
+    group.add_argument("--sync", dest="command", action="store_const", const="sync",
+                       help="立即同步时间")
+    group.add_argument("--test", dest="command", action="store_const", const="test",
+                       help="测试服务器连接")
+    parser.set_defaults(command="show")
+    parser.add_argument("--headless", action="store_true",
+                        help="无界面运行，按固定间隔同步时间")
+    parser.add_argument("--interval", type=float, default=3600,
+                        help="无界面模式和托盘模式的同步间隔（秒）")
+    parser.add_argument("--tray", action="store_true",
+                        help="最小化到系统托盘运行，按固定间隔同步时间")
+    parser.add_argument("--start-delay", type=float,
+                        help=f"首次同步前随机等待的最长时间（秒），无界面和托盘模式默认 {DEFAULT_START_DELAY:.0f}，界面模式默认 0")
+    parser.add_argument("--poll-jitter", type=float, default=DEFAULT_POLL_JITTER,
+                        help="定时同步间隔的随机抖动比例（如 0.1 表示 ±10%%）")
+    parser.add_argument("--spread", action="store_true",
+                        help="按主机名和机器ID把首次同步和定时同步分散到固定槽位，避免机群同时同步")
+    parser.add_argument("--serve", action="store_true",
+                        help="作为局域网NTP服务器提供同步后的时间")
+    parser.add_argument("--serve-host", default="0.0.0.0", help="NTP服务端监听地址")
+    parser.add_argument("--serve-port", type=int, default=123, help="NTP服务端监听端口")
+    parser.add_argument("--correct-threshold", type=float, default=CORRECT_THRESHOLD * 1000,
+                        help="设置时钟后复查的剩余偏移超过该值时再修正一次（毫秒，0表示只记录不修正）")
+    parser.add_argument("--record-exchanges", metavar="PATH",
+                        help="把每次NTP交换录制到该文件（gzip JSON Lines），可用 replay.py 离线回放")
+    parser.add_argument("--trace-file", help="退出时把同步各阶段的计时导出到该文件")
+    parser.add_argument("--trace-format", choices=("chrome", "json"), default="chrome",
+                        help="计时导出格式：Chrome trace 或 JSON列表")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="指标端点监听地址")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="在该端口提供OpenMetrics格式的 /metrics 端点（0表示不启用）")
+    # 忽略Qt自身的参数（如 -style）
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+# 从配置文件读取服务器列表
+def load_server_list(config_file):
+    config = configparser.ConfigParser()
+    try:
+        config.read(config_file, encoding='utf-8')
+    except configparser.Error:
+        return DEFAULT_SERVERS.copy()
+    servers = [s.strip() for s in config.get('Settings', 'servers', fallback='').split('\n') if s.strip()]
+    return servers or DEFAULT_SERVERS.copy()
+
+# 按命令行参数创建同步时刻安排；background为True表示无界面或托盘模式（可能大量机器同时启动）
+def make_schedule(args, background):
+    start_delay = args.start_delay
+    if start_delay is None:
+        start_delay = DEFAULT_START_DELAY if background else 0.0
+    return SyncSchedule(args.interval, start_delay=start_delay, jitter=args.poll_jitter, spread=args.spread)
+
+# 无界面模式
+def run_headless(args):
+    """按固定间隔同步时间，可同时作为局域网NTP服务器"""
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    for handler in (CompressingRotatingFileHandler("timesync.log", maxBytes=1024*1024),
+                    logging.StreamHandler()):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    
+    servers = load_server_list("settings.ini")
+    clock_state.load(os.path.abspath(SYNC_HISTORY_FILE))
+    sample_store.open(os.path.abspath(SAMPLE_FILE))
+    if args.record_exchanges:
+        exchange_recorder.open(args.record_exchanges)
+        logger.info(f"📼 录制NTP交换到 {args.record_exchanges}")
+    schedule = make_schedule(args, background=True)
+    logger.info(f"🚀 无界面模式启动，{len(servers)} 个服务器，{schedule.describe()}")
+    
+    ntp_server = None
+    if args.serve:
+        try:
+            ntp_server = NTPServer(host=args.serve_host, port=args.serve_port)
+        except OSError as e:
+            logger.error(f"❌ NTP服务端启动失败 ({args.serve_host}:{args.serve_port}): {e}")
+        else:
+            ntp_server.start()
+            export_ntp_server_metrics(ntp_server)
+            logger.info(f"📡 NTP服务端已启动: {args.serve_host}:{args.serve_port}")
+    
+    metrics_server = None
+    if args.metrics_port:
+        metrics_server = start_metrics_server(args.metrics_host, args.metrics_port, logger)
+    
+    coordinator = SyncCoordinator(logger=logger)
+    
+    # 时钟跳变、睡眠恢复、网络变化时提前结束等待，立即重新同步
+    wakeup = threading.Event()
+    events = []
+    
+    def on_clock_event(reason):
+        events.append(reason)
+        wakeup.set()
+    
+    event_watcher = ClockEventWatcher(on_clock_event)
+    event_watcher.start()
+    
+    def sync_once(sync_servers):
+        with tracer.span("sync"):
+            return perform_sync(sync_servers, correct_threshold=args.correct_threshold / 1000)
+    
+    try:
+        # 首次同步前的等待同样可以被时钟事件提前结束
+        delay = schedule.first_delay()
+        logger.info(f"⏳ 首次同步将在 {delay:.0f} 秒后进行")
+        force = wakeup.wait(delay)
+        wakeup.clear()
+        events.clear()
+        while True:
+            sync_servers = targeted_servers(servers) if force else servers
+            try:
+                success, message, server, delay = coordinator.run(lambda: sync_once(sync_servers), force)
+            except Exception as e:
+                success, message = False, f"同步过程中发生错误: {str(e)}"
+            if success:
+                logger.info(f"✅ 时间同步成功: {message}")
+            else:
+                logger.error(f"❌ 时间同步失败: {message}")
+            force = wakeup.wait(schedule.next_delay())
+            wakeup.clear()
+            if force:
+                logger.warning(f"⚡ {'；'.join(events)}，立即重新同步")
+                events.clear()
+    except KeyboardInterrupt:
+        logger.info("📤 无界面模式退出")
+    finally:
+        event_watcher.stop()
+        pool_manager.stop()
+        exchange_recorder.close()
+        http_date_source.close()
+        if ntp_server is not None:
+            ntp_server.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        if args.trace_file:
+            tracer.export(args.trace_file, args.trace_format)
+    return 0
 
 # 主程序入口
 def main():
-    # 检查管理员权限
-    if not is_admin():
-        if not run_as_admin():
-            app = QApplication(sys.argv)
-            QMessageBox.critical(None, "权限错误", "需要管理员权限才能设置系统时间！")
+    args = parse_args(sys.argv[1:])
+    
+    # 单实例锁：已有实例运行时，把命令转发过去后立即退出
+    instance_lock = QLockFile(os.path.join(QDir.tempPath(), SINGLE_INSTANCE_KEY + ".lock"))
+    if not instance_lock.tryLock(0):
+        if args.headless:
+            print("时间同步工具已在运行")
             sys.exit(1)
-        else:
-            sys.exit(0)
+        ipc_app = QCoreApplication(sys.argv)
+        # 运行中的实例可能还在初始化，短时间内重试
+        for _ in range(10):
+            if forward_to_running_instance(args.command):
+                sys.exit(0)
+            time.sleep(0.2)
+        print("时间同步工具已在运行，但无法与其通信")
+        sys.exit(1)
+    
+    if args.headless:
+        exit_code = run_headless(args)
+        instance_lock.unlock()
+        sys.exit(exit_code)
     
     # 设置高DPI支持（兼容Win7）
     QApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
@@ -1402,10 +2351,36 @@ def main():
     # 设置应用样式（兼容Win7的Fusion风格）
     app.setStyle("Fusion")
     
+    clock_state.load(os.path.abspath(SYNC_HISTORY_FILE))
+    sample_store.open(os.path.abspath(SAMPLE_FILE))
+    if args.record_exchanges:
+        exchange_recorder.open(args.record_exchanges)
     window = TimeSyncApp()
-    window.show()
+    window.sync_schedule = make_schedule(args, background=args.tray)
+    if not (args.tray and window.enable_tray(args.interval)):
+        window.show()
+    
+    # 启动单实例IPC服务
+    window.instance_server = SingleInstanceServer(parent=window)
+    window.instance_server.command_received.connect(window.handle_ipc_command)
+    if not window.instance_server.listen():
+        window.logger.warning(f"单实例IPC服务启动失败: {window.instance_server.server.errorString()}")
+    
+    if args.serve:
+        window.start_ntp_server(args.serve_host, args.serve_port)
+    window.trace_file = args.trace_file
+    window.correct_threshold = args.correct_threshold / 1000
+    window.trace_format = args.trace_format
+    if args.metrics_port:
+        window.metrics_server = start_metrics_server(args.metrics_host, args.metrics_port, window.logger)
+    
+    # 启动时执行命令行指定的操作（同步在启动后会自动进行）
+    if args.command == "test":
+        QTimer.singleShot(0, window.test_servers)
     
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    instance_lock.unlock()
+    sys.exit(exit_code)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,248 @@
+"""
+OpenMetrics指标：同步路径中增量更新，本地HTTP /metrics 端点只负责把当前值格式化输出
+
+启用方式: python main.py --metrics-port 9123  （界面和无界面模式均可）
+"""
+import math
+import time
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+# RTT直方图的桶上界（秒）
+RTT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 15.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+# 指标基类：按标签值分组保存数值
+class Metric:
+    type_name = "unknown"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# TYPE {self.name} {self.type_name}", f"# HELP {self.name} {self.help}"]
+        with self.lock:
+            items = list(self.values.items())
+        for label_values, value in items:
+            lines.extend(self.render_sample(label_values, value))
+        return lines
+
+    def render_sample(self, label_values, value):
+        return [f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}"]
+
+
+# 计数器：只增不减
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, *label_values, amount=1.0):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def render_sample(self, label_values, value):
+        return [f"{self.name}_total{_labels(self.label_names, label_values)} {_number(value)}"]
+
+
+# 仪表：可以设为任意值；也可以传入回调在抓取时计算（用于“距上次同步的时间”这类随时间变化的值）
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def __init__(self, name, help_text, labels=(), callback=None):
+        super().__init__(name, help_text, labels)
+        self.callback = callback
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def render(self):
+        if self.callback is not None:
+            value = self.callback()
+            if value is None:
+                return [f"# TYPE {self.name} gauge", f"# HELP {self.name} {self.help}"]
+            with self.lock:
+                self.values[()] = value
+        return super().render()
+
+
+# 直方图：固定桶，观测时只增加一个桶计数
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=RTT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            state = self.values.get(label_values)
+            if state is None:
+                state = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            state[1] += value
+
+    def render_sample(self, label_values, state):
+        counts, total = state
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            le = f'le="{_number(bound)}"'
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {cumulative}")
+        lines.append(f"{self.name}_count{_labels(self.label_names, label_values)} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.label_names, label_values)} {_number(total)}")
+        return lines
+
+
+# 指标注册表
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+# 时间同步相关的指标集合
+class SyncMetrics:
+    def __init__(self, registry=None, jitter_window=8):
+        self.registry = registry or Registry()
+        r = self.registry
+        self.offset = r.register(Gauge("timesync_offset_seconds", "最近一次同步测得的本机时钟偏移"))
+        self.jitter = r.register(Gauge("timesync_jitter_seconds", "最近几次同步偏移之差的均方根"))
+        self.syncs = r.register(Counter("timesync_syncs", "同步次数", ("result",)))
+        self.residual = r.register(Gauge("timesync_residual_offset_seconds", "设置时钟后复查测得的剩余偏移"))
+        self.corrections = r.register(Counter("timesync_corrective_steps", "复查后因剩余偏移过大再修正的次数"))
+        self.rtt = r.register(Histogram("timesync_server_rtt_seconds", "各服务器的往返延迟", ("server",)))
+        self.requests = r.register(Counter("timesync_server_requests", "各服务器的请求次数", ("server", "result")))
+        self.consecutive_failures = r.register(
+            Gauge("timesync_server_consecutive_failures", "各服务器当前的连续失败次数", ("server",)))
+        self.server_up = r.register(Gauge("timesync_server_up", "各服务器最近一次请求是否成功", ("server",)))
+        self.last_sync_time = None
+        self.last_sync_age = r.register(Gauge("timesync_last_sync_age_seconds", "距上次成功同步的秒数",
+                                              callback=self.sync_age))
+        self.recent_offsets = deque(maxlen=jitter_window)
+        self.failure_streaks = {}
+        self.lock = threading.Lock()
+
+    def sync_age(self):
+        if self.last_sync_time is None:
+            return None
+        return time.monotonic() - self.last_sync_time
+
+    def record_request(self, server, success, rtt):
+        """记录一次对单个服务器的请求，rtt单位为秒"""
+        self.requests.inc(server, "success" if success else "failure")
+        with self.lock:
+            streak = 0 if success else self.failure_streaks.get(server, 0) + 1
+            self.failure_streaks[server] = streak
+        self.consecutive_failures.set(streak, server)
+        self.server_up.set(1 if success else 0, server)
+        if success:
+            self.rtt.observe(rtt, server)
+
+    def record_sync(self, success, offset=None):
+        """记录一次同步结果，offset单位为秒"""
+        self.syncs.inc("success" if success else "failure")
+        if not success or offset is None:
+            return
+        self.offset.set(offset)
+        with self.lock:
+            self.last_sync_time = time.monotonic()
+            self.recent_offsets.append(offset)
+            offsets = list(self.recent_offsets)
+        if len(offsets) > 1:
+            diffs = [b - a for a, b in zip(offsets, offsets[1:])]
+            self.jitter.set(math.sqrt(sum(d * d for d in diffs) / len(diffs)))
+
+    def record_residual(self, residual):
+        """记录设置时钟后复查测得的剩余偏移（秒）"""
+        self.residual.set(residual)
+
+    def record_correction(self):
+        self.corrections.inc()
+
+    def add_callback_gauge(self, name, help_text, callback):
+        """注册在抓取时才计算的指标（如NTP服务端的统计）"""
+        return self.registry.register(Gauge(name, help_text, callback=callback))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# 本地HTTP指标端点
+class MetricsServer:
+    def __init__(self, registry, host="127.0.0.1", port=9123):
+        handler = type("BoundMetricsHandler", (MetricsHandler,), {"registry": registry})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.address = self.httpd.server_address
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="MetricsServer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# 进程内共享的指标
+sync_metrics = SyncMetrics()
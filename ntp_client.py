@@ -0,0 +1,351 @@
+"""
+NTP客户端：替代 ntplib.NTPClient.request，把一次查询拆成DNS解析、建socket、发送、接收几个阶段，
+每个阶段记录到 tracing.tracer 中，便于定位同步慢在哪一步；双栈服务器的IPv6/IPv4地址按happy eyeballs方式竞速
+
+所有查询经过进程内共享的 poll_gate：距同一服务器上次查询不足 MIN_POLL_INTERVAL 秒时不再发送；
+收到 Kiss-o'-Death RATE 后按指数退避暂停查询该服务器，收到 DENY/RSTR 后较长时间内不再查询。
+被拦下的查询直接抛出 PollDeferred，不排队等待，也不会发到网络上。
+
+交错模式（RFC 9769）：服务器在下一次回复中给出上一次回复真正发出之后的发送时间戳，比写在回复里的（发送前取的）更准确。
+开启后每个地址保留最近一次交换的时间戳：下一次请求的 origin 填上次回复的接收时间戳、receive 填上次的本地接收时间，
+支持的服务器回复的 origin 是这个本地接收时间，客户端据此识别交错回复，用上次交换的 T1、T2、T4 和新给出的 T3 重新计算；
+不支持的服务器照常按基本模式回复（origin 为本次的发送时间戳），自动退回基本模式。
+"""
+import time
+import socket
+import select
+import logging
+import threading
+
+from ntp_packet import (NTP_PORT, NTP_PACKET_SIZE, MODE_CLIENT, MODE_SERVER, KOD_RATE, KOD_DENY, KOD_RSTR,
+                        NTPPacket, system_to_ntp, ntp_to_system, short_to_seconds)
+from tracing import tracer
+from cancellation import Cancelled
+
+# 双栈竞速时，向下一个地址族发送前等待首选地址回复的时间（秒）
+HAPPY_EYEBALLS_DELAY = 0.05
+# 各主机上次最先回复的地址族，下次优先使用
+preferred_family = {}
+# 同一服务器两次查询之间的最小间隔（秒），进程内所有调用方共同遵守；
+# 与ntpd的 discard average 和chrony的 ratelimit interval 默认值（2^3秒）一致，更密的查询会被服务器回以RATE
+MIN_POLL_INTERVAL = 8.0
+# 收到RATE后暂停查询的初始时间和上限（秒），连续收到时加倍
+RATE_BACKOFF = 64.0
+MAX_RATE_BACKOFF = 4 * 3600.0
+# 收到DENY/RSTR后不再查询该服务器的时间（秒）
+DENY_BLACKLIST = 24 * 3600.0
+# 上一次交换超过这么久就不再用于交错请求（秒）：结果描述的是上一次交换，间隔越长单调时钟的频率误差越大；
+# 至少要能容下一个最小查询间隔
+INTERLEAVED_MAX_AGE = 4 * MIN_POLL_INTERVAL
+
+
+class NTPError(Exception):
+    """服务器回复无效（模式不对、与请求不匹配、Kiss-o'-Death等）"""
+
+
+class KissOfDeath(NTPError):
+    """服务器回复了Kiss-o'-Death"""
+
+    def __init__(self, code):
+        super().__init__(f"服务器拒绝服务 (Kiss-o'-Death: {code})")
+        self.code = code
+
+
+class PollDeferred(NTPError):
+    """查询被本地的查询节奏限制拦下，没有发到网络上"""
+
+
+# 单个服务器的查询节奏
+class PollState:
+    __slots__ = ("last_query", "blocked_until", "backoff", "reason")
+
+    def __init__(self):
+        self.last_query = -1e9
+        self.blocked_until = 0.0
+        self.backoff = 0.0
+        self.reason = ""
+
+
+# 进程内所有查询共用的节奏控制：最小查询间隔、RATE退避和DENY/RSTR黑名单
+class PollGate:
+    def __init__(self, min_interval=MIN_POLL_INTERVAL):
+        self.min_interval = min_interval
+        self.states = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("NTPClient")
+
+    def acquire(self, host):
+        """查询前调用：处于退避或黑名单期间、或距上次查询不足最小间隔时抛出PollDeferred，否则记下本次查询"""
+        with self.lock:
+            state = self.states.setdefault(host, PollState())
+            now = time.monotonic()
+            if state.blocked_until > now:
+                raise PollDeferred(f"{state.reason}，{state.blocked_until - now:.0f} 秒内不再查询")
+            wait = state.last_query + self.min_interval - now
+            if wait > 0:
+                raise PollDeferred(f"距上次查询 {host} 不足 {self.min_interval:g} 秒，{wait:.1f} 秒后才能再次查询")
+            state.last_query = now
+
+    def kiss(self, host, code):
+        """记录收到的Kiss-o'-Death：RATE按指数退避，DENY/RSTR加入黑名单，其他代码不影响查询节奏"""
+        with self.lock:
+            state = self.states.setdefault(host, PollState())
+            now = time.monotonic()
+            if code == KOD_RATE.decode('ascii'):
+                state.backoff = min(max(state.backoff * 2, RATE_BACKOFF), MAX_RATE_BACKOFF)
+                state.blocked_until = now + state.backoff
+                state.reason = f"{host} 要求降低查询频率 (RATE)"
+            elif code in (KOD_DENY.decode('ascii'), KOD_RSTR.decode('ascii')):
+                state.blocked_until = now + DENY_BLACKLIST
+                state.reason = f"{host} 拒绝为本机提供服务 ({code})"
+            else:
+                return
+            wait = state.blocked_until - now
+        self.logger.warning(f"⛔ {state.reason}，{wait:.0f} 秒内不再查询")
+
+    def success(self, host):
+        """收到正常回复，RATE退避重新从初始值开始"""
+        with self.lock:
+            state = self.states.get(host)
+            if state is not None:
+                state.backoff = 0.0
+
+    def ready_in(self, host):
+        """还要过多少秒才能再次查询该服务器（0表示现在就可以）"""
+        with self.lock:
+            state = self.states.get(host)
+            if state is None:
+                return 0.0
+            now = time.monotonic()
+            return max(0.0, state.blocked_until - now, state.last_query + self.min_interval - now)
+
+    def blocked(self, host):
+        """该服务器还要被暂停多少秒（0表示可以查询）"""
+        with self.lock:
+            state = self.states.get(host)
+            return max(0.0, state.blocked_until - time.monotonic()) if state is not None else 0.0
+
+
+# 进程内共享的查询节奏控制
+poll_gate = PollGate()
+
+
+# 与某个地址最近一次交换的时间戳（64位NTP原始值），用于下一次的交错请求
+class Exchange:
+    __slots__ = ("t1", "t2", "t4", "wall", "monotonic")
+
+    def __init__(self, t1, t2, t4):
+        self.t1 = t1
+        self.t2 = t2
+        self.t4 = t4
+        self.wall = time.time()
+        self.monotonic = time.monotonic()
+
+
+# 交错模式的状态：各地址最近一次交换，以及各服务器是否支持交错模式
+class InterleavedTracker:
+    def __init__(self, max_age=INTERLEAVED_MAX_AGE):
+        self.max_age = max_age
+        self.exchanges = {}
+        self.support = {}
+        self.lock = threading.Lock()
+
+    def previous(self, address):
+        """该地址可用于交错请求的上一次交换，没有或已过期时返回None"""
+        with self.lock:
+            exchange = self.exchanges.get(address)
+        if exchange is None or time.monotonic() - exchange.monotonic > self.max_age:
+            return None
+        return exchange
+
+    def remember(self, address, t1, t2, t4):
+        with self.lock:
+            self.exchanges[address] = Exchange(t1, t2, t4)
+
+    def note_reply(self, host, interleaved):
+        """发出交错请求后记录服务器的回复方式"""
+        with self.lock:
+            self.support[host] = interleaved
+
+    def supported(self, host):
+        """服务器是否支持交错模式：True/False，还没试过时为None"""
+        with self.lock:
+            return self.support.get(host)
+
+
+# 进程内共享的交错模式状态
+interleaved_tracker = InterleavedTracker()
+
+
+def ntp_diff(a, b):
+    """两个64位NTP时间戳之差（秒），在整数域做差以保留精度"""
+    d = (a - b) & 0xFFFFFFFFFFFFFFFF
+    if d >= 1 << 63:
+        d -= 1 << 64
+    return d / 4294967296.0
+
+
+# NTP查询结果，字段与 ntplib.NTPStats 一致（时间均为Unix秒）
+class NTPResponse:
+    def __init__(self, packet, t1, t4, address):
+        self.leap = packet.leap
+        self.version = packet.version
+        self.mode = packet.mode
+        self.stratum = packet.stratum
+        self.poll = packet.poll
+        self.precision = packet.precision
+        self.root_delay = short_to_seconds(packet.root_delay)
+        self.root_dispersion = short_to_seconds(packet.root_dispersion)
+        self.ref_id = packet.ref_id
+        self.ref_time = ntp_to_system(packet.ref_timestamp)
+        self.orig_time = ntp_to_system(t1)
+        self.recv_time = ntp_to_system(packet.recv_timestamp)
+        self.tx_time = ntp_to_system(packet.tx_timestamp)
+        self.dest_time = ntp_to_system(t4)
+        self.address = address
+        # 交错回复：发送时间戳是上一次回复实际发出的时间，结果描述的是上一次交换
+        self.interleaved = False
+        # 原始报文头和本地收发时间戳，供录制和回放（exchange_trace）重建本次结果
+        self.packet = packet.pack()
+        self.t1, self.t4 = t1, t4
+        t2, t3 = packet.recv_timestamp, packet.tx_timestamp
+        self.offset = (ntp_diff(t2, t1) + ntp_diff(t3, t4)) / 2
+        self.delay = ntp_diff(t4, t1) - ntp_diff(t3, t2)
+
+
+def resolve_candidates(host, port):
+    """解析服务器地址，按地址族交替排列（先用该主机上次胜出的地址族，默认IPv6）"""
+    with tracer.span("dns", server=host):
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_DGRAM)
+    addresses = []
+    for family, _, _, _, address in infos:
+        if (family, address) not in addresses:
+            addresses.append((family, address))
+    first = preferred_family.get(host, socket.AF_INET6)
+    primary = [a for a in addresses if a[0] == first]
+    secondary = [a for a in addresses if a[0] != first]
+    ordered = []
+    for i in range(max(len(primary), len(secondary))):
+        ordered.extend(primary[i:i + 1] + secondary[i:i + 1])
+    return ordered
+
+
+def scale_shift(exchange):
+    """上一次交换以来系统时钟被调整的量（NTP原始单位）：墙上时钟比单调时钟多走的部分"""
+    drift = (time.time() - exchange.wall) - (time.monotonic() - exchange.monotonic)
+    return int(round(drift * 4294967296.0))
+
+
+def query(host, port=NTP_PORT, version=3, timeout=5, extensions=None, validate=None, cancel=None,
+          interleaved=False):
+    """
+    向单个服务器发送一次NTP请求，超时抛出socket.timeout，DNS失败抛出socket.gaierror
+
+    服务器同时有IPv6和IPv4地址时按happy eyeballs方式竞速：先向首选地址发送，
+    HAPPY_EYEBALLS_DELAY内没有回复（或立即报错）就向另一地址族的地址再发一次，采用最先到达的有效回复
+
+    extensions(header) -> bytes 用于在报文头之后追加扩展字段（NTS需要对报文头做认证）；
+    validate(data, packet) -> bool 对回复做额外校验，返回False的回复按伪造报文丢弃；
+    cancel 为 cancellation.CancelToken，取消时立即中止等待并抛出Cancelled；
+    interleaved 为True时发送交错请求（该地址有未过期的上一次交换时），回复是交错回复时结果描述的是上一次交换
+    """
+    if cancel is not None:
+        cancel.check()
+    candidates = resolve_candidates(host, port)
+    if cancel is not None:
+        cancel.check()
+    poll_gate.acquire(host)
+    deadline = time.monotonic() + timeout
+    attempts = {}  # socket -> (t1, family, address, 上一次交换)
+    next_send = 0.0
+    last_error = None
+    first_send_ns = None
+    try:
+        while True:
+            now = time.monotonic()
+            if candidates and now >= next_send:
+                family, address = candidates.pop(0)
+                with tracer.span("socket", server=host):
+                    sock = socket.socket(family, socket.SOCK_DGRAM)
+                    sock.setblocking(False)
+                previous = interleaved_tracker.previous(address[0]) if interleaved else None
+                try:
+                    with tracer.span("send", server=host, address=address[0]):
+                        t1 = system_to_ntp(time.time())
+                        request = NTPPacket(version=version, mode=MODE_CLIENT, tx_timestamp=t1,
+                                            orig_timestamp=previous.t2 if previous else 0,
+                                            recv_timestamp=previous.t4 if previous else 0).pack()
+                        if extensions is not None:
+                            request += extensions(request)
+                        sock.sendto(request, address)
+                except OSError as e:
+                    # 例如IPv6路由不通时立即失败，马上尝试下一个地址
+                    sock.close()
+                    last_error = e
+                    continue
+                if first_send_ns is None:
+                    first_send_ns = time.monotonic_ns()
+                attempts[sock] = (t1, family, address, previous)
+                next_send = now + HAPPY_EYEBALLS_DELAY
+
+            if not attempts and not candidates:
+                raise last_error or socket.timeout("timed out")
+            if now >= deadline:
+                raise socket.timeout("timed out")
+            wait = deadline - now
+            if candidates:
+                wait = min(wait, max(0.0, next_send - now))
+            watched = list(attempts) + ([cancel] if cancel is not None else [])
+            readable, _, _ = select.select(watched, [], [], wait)
+            if cancel is not None and cancel.cancelled:
+                raise Cancelled("操作已取消")
+
+            for sock in readable:
+                t1, family, address, previous = attempts[sock]
+                try:
+                    data, sender = sock.recvfrom(1024)
+                except OSError as e:
+                    # 收到ICMP不可达等错误，放弃该地址并立即尝试下一个
+                    last_error = e
+                    del attempts[sock]
+                    sock.close()
+                    next_send = 0.0
+                    continue
+                t4 = system_to_ntp(time.time())
+                # 丢弃不是来自目标服务器或不是本次请求的回复（防伪造/迟到报文）
+                if sender[:2] != address[:2] or len(data) < NTP_PACKET_SIZE:
+                    continue
+                packet = NTPPacket.unpack(data)
+                if packet.orig_timestamp == t1:
+                    follow_up = None
+                elif previous is not None and packet.orig_timestamp == previous.t4:
+                    follow_up = previous
+                else:
+                    continue
+                if validate is not None and not validate(data, packet):
+                    continue
+                tracer.record("receive", first_send_ns, server=host, address=address[0])
+                preferred_family[host] = family
+                if packet.mode != MODE_SERVER:
+                    raise NTPError(f"无效的回复模式: {packet.mode}")
+                if packet.is_kod:
+                    poll_gate.kiss(host, packet.kiss_code)
+                    raise KissOfDeath(packet.kiss_code)
+                poll_gate.success(host)
+                if interleaved:
+                    interleaved_tracker.remember(address[0], t1, packet.recv_timestamp, t4)
+                    if previous is not None:
+                        interleaved_tracker.note_reply(host, follow_up is not None)
+                if follow_up is None:
+                    return NTPResponse(packet, t1, t4, address[0])
+                # 交错回复：T3属于上一次交换，与上一次的T1、T2、T4一起计算；
+                # 两次交换之间系统时钟被调整过时，把上一次的本地时间戳换算到调整后的时钟上
+                shift = scale_shift(follow_up)
+                packet.recv_timestamp = follow_up.t2
+                response = NTPResponse(packet, (follow_up.t1 + shift) & 0xFFFFFFFFFFFFFFFF,
+                                       (follow_up.t4 + shift) & 0xFFFFFFFFFFFFFFFF, address[0])
+                response.interleaved = True
+                return response
+    finally:
+        for sock in attempts:
+            sock.close()
@@ -0,0 +1,105 @@
+"""NTP报文编解码（RFC 5905），只依赖标准库，供服务端模式和自研客户端共用"""
+import struct
+import time
+
+# NTP纪元(1900-01-01)与Unix纪元(1970-01-01)之间的秒数
+NTP_EPOCH_DELTA = 2208988800
+NTP_PORT = 123
+NTP_PACKET_SIZE = 48
+
+# 模式
+MODE_CLIENT = 3
+MODE_SERVER = 4
+
+# 闰秒指示：3表示时钟未同步
+LEAP_NONE = 0
+LEAP_ALARM = 3
+
+# Kiss-o'-Death代码（stratum为0时放在ref_id字段）
+KOD_RATE = b"RATE"
+KOD_DENY = b"DENY"
+KOD_RSTR = b"RSTR"
+
+# LI/VN/Mode, stratum, poll, precision, root delay, root dispersion, ref id, 4个时间戳
+PACKET_FORMAT = struct.Struct("!BBbbII4sQQQQ")
+
+
+def system_to_ntp(timestamp):
+    """Unix时间戳(秒) -> 64位NTP时间戳"""
+    return int((timestamp + NTP_EPOCH_DELTA) * 4294967296.0) & 0xFFFFFFFFFFFFFFFF
+
+
+def ntp_to_system(ntp_timestamp):
+    """64位NTP时间戳 -> Unix时间戳(秒)"""
+    return ntp_timestamp / 4294967296.0 - NTP_EPOCH_DELTA
+
+
+def seconds_to_short(seconds):
+    """秒 -> NTP短格式(16.16定点)"""
+    return max(0, min(int(seconds * 65536.0), 0xFFFFFFFF))
+
+
+def short_to_seconds(value):
+    return value / 65536.0
+
+
+def precision_exponent(resolution=None):
+    """时钟分辨率 -> precision字段（以2为底的对数）"""
+    if resolution is None:
+        resolution = time.get_clock_info('time').resolution
+    exponent = -1
+    while 2.0 ** exponent > resolution and exponent > -30:
+        exponent -= 1
+    return exponent
+
+
+# NTP报文
+class NTPPacket:
+    __slots__ = ("leap", "version", "mode", "stratum", "poll", "precision",
+                 "root_delay", "root_dispersion", "ref_id",
+                 "ref_timestamp", "orig_timestamp", "recv_timestamp", "tx_timestamp")
+
+    def __init__(self, leap=LEAP_NONE, version=4, mode=MODE_CLIENT, stratum=0, poll=0, precision=0,
+                 root_delay=0, root_dispersion=0, ref_id=b"\0\0\0\0",
+                 ref_timestamp=0, orig_timestamp=0, recv_timestamp=0, tx_timestamp=0):
+        # 时间戳字段均为64位NTP原始值，root_delay/root_dispersion为16.16定点原始值
+        self.leap = leap
+        self.version = version
+        self.mode = mode
+        self.stratum = stratum
+        self.poll = poll
+        self.precision = precision
+        self.root_delay = root_delay
+        self.root_dispersion = root_dispersion
+        self.ref_id = ref_id
+        self.ref_timestamp = ref_timestamp
+        self.orig_timestamp = orig_timestamp
+        self.recv_timestamp = recv_timestamp
+        self.tx_timestamp = tx_timestamp
+
+    def pack(self):
+        return PACKET_FORMAT.pack(
+            (self.leap << 6) | (self.version << 3) | self.mode,
+            self.stratum, self.poll, self.precision,
+            self.root_delay, self.root_dispersion, self.ref_id,
+            self.ref_timestamp, self.orig_timestamp, self.recv_timestamp, self.tx_timestamp)
+
+    @classmethod
+    def unpack(cls, data):
+        """解析报文头部（忽略扩展字段），长度不足时抛出ValueError"""
+        if len(data) < NTP_PACKET_SIZE:
+            raise ValueError(f"NTP报文长度不足: {len(data)}字节")
+        (li_vn_mode, stratum, poll, precision, root_delay, root_dispersion, ref_id,
+         ref_ts, orig_ts, recv_ts, tx_ts) = PACKET_FORMAT.unpack_from(data)
+        return cls(li_vn_mode >> 6, (li_vn_mode >> 3) & 0x7, li_vn_mode & 0x7,
+                   stratum, poll, precision, root_delay, root_dispersion, ref_id,
+                   ref_ts, orig_ts, recv_ts, tx_ts)
+
+    @property
+    def is_kod(self):
+        """stratum为0的服务器回复是Kiss-o'-Death"""
+        return self.mode == MODE_SERVER and self.stratum == 0
+
+    @property
+    def kiss_code(self):
+        return self.ref_id.decode('ascii', 'replace') if self.is_kod else ""
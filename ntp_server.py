@@ -0,0 +1,308 @@
+"""
+局域网NTP服务端模式：把本机经过同步的时间提供给局域网内的其他机器
+
+回复基于预先生成的报文模板，每个请求只需填入三个时间戳；
+socket为非阻塞模式，每次可读时批量收取请求、批量发送回复。
+每个客户端按令牌桶限速，超限时回复RATE类型的Kiss-o'-Death（KoD本身也限频，避免被用于反射放大）。
+支持NTPv4交错模式（RFC 9769）：每个回复发出后记下实际的发送时间，按该回复的接收时间戳索引；
+请求的 origin 等于某个记录的接收时间戳时按交错模式回复，发送时间戳填上一次回复的实际发送时间。
+
+压测：python ntp_server.py --bench
+"""
+import sys
+import time
+import socket
+import select
+import struct
+import logging
+import argparse
+import ipaddress
+import threading
+import multiprocessing
+
+from ntp_packet import (NTP_PORT, NTP_PACKET_SIZE, MODE_CLIENT, MODE_SERVER, LEAP_NONE, LEAP_ALARM,
+                        KOD_RATE, KOD_DENY, NTPPacket, system_to_ntp, seconds_to_short,
+                        precision_exponent)
+from discipline import clock_state
+
+# 64位时间戳的打包器，直接写入回复模板
+TIMESTAMP = struct.Struct("!Q")
+# 模板中不随状态变化的字段每隔多久刷新一次（根离散度随时间增长）
+TEMPLATE_REFRESH_INTERVAL = 1.0
+
+
+# 客户端限速表项
+class ClientEntry:
+    __slots__ = ("tokens", "last_seen", "last_kod", "allowed")
+
+    def __init__(self, tokens, now, allowed):
+        self.tokens = tokens
+        self.last_seen = now
+        self.last_kod = -1e9
+        self.allowed = allowed
+
+
+# NTP服务端
+class NTPServer:
+    def __init__(self, host="0.0.0.0", port=NTP_PORT, state=None, batch_size=64,
+                 rate_limit=True, burst=8, min_interval=2.0, kod_interval=8.0,
+                 allowed_networks=None, max_clients=100000):
+        self.state = state or clock_state
+        self.batch_size = batch_size
+        self.rate_limit = rate_limit
+        # 令牌桶：最多连续burst个请求，之后平均每min_interval秒一个
+        self.burst = burst
+        self.refill_rate = 1.0 / min_interval
+        self.kod_interval = kod_interval
+        self.allowed_networks = [ipaddress.ip_network(n, strict=False) for n in (allowed_networks or [])]
+        self.max_clients = max_clients
+        self.clients = {}
+        # 交错模式：回复的接收时间戳 -> 该回复实际发出的时间（NTP原始值），最多保留max_clients条
+        self.transmit_times = {}
+        self.logger = logging.getLogger("NTPServer")
+
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+
+        self.precision = precision_exponent()
+        self.template = bytearray(NTP_PACKET_SIZE)
+        self.template_generation = -1
+        self.template_time = 0.0
+        self.recv_buffer = bytearray(1024)
+        self.running = False
+        self.thread = None
+        self.stats = {'received': 0, 'replied': 0, 'rate_limited': 0, 'kod_sent': 0,
+                      'denied': 0, 'malformed': 0, 'interleaved': 0}
+
+    def refresh_template(self, now_monotonic):
+        """根据时钟状态重新生成回复模板"""
+        state = self.state
+        with state.lock:
+            synced = state.synced
+            packet = NTPPacket(
+                leap=LEAP_NONE if synced else LEAP_ALARM,
+                version=4, mode=MODE_SERVER,
+                stratum=state.stratum,
+                precision=self.precision,
+                root_delay=seconds_to_short(state.root_delay),
+                root_dispersion=seconds_to_short(state.dispersion()),
+                ref_id=state.ref_id,
+                ref_timestamp=system_to_ntp(state.ref_time) if synced else 0)
+            self.template_generation = state.generation
+        self.template[:] = packet.pack()
+        self.template_time = now_monotonic
+
+    def admit(self, ip, now):
+        """判断是否回复该客户端：返回None表示正常回复，否则返回KoD代码或b""（静默丢弃）"""
+        entry = self.clients.get(ip)
+        if entry is None:
+            if len(self.clients) >= self.max_clients:
+                self.prune(now)
+            allowed = not self.allowed_networks or any(
+                ipaddress.ip_address(ip) in net for net in self.allowed_networks)
+            entry = self.clients[ip] = ClientEntry(self.burst, now, allowed)
+        if not entry.allowed:
+            self.stats['denied'] += 1
+            code = KOD_DENY
+        else:
+            if not self.rate_limit:
+                return None
+            entry.tokens = min(self.burst, entry.tokens + (now - entry.last_seen) * self.refill_rate)
+            entry.last_seen = now
+            if entry.tokens >= 1.0:
+                entry.tokens -= 1.0
+                return None
+            self.stats['rate_limited'] += 1
+            code = KOD_RATE
+        if now - entry.last_kod < self.kod_interval:
+            return b""
+        entry.last_kod = now
+        return code
+
+    def prune(self, now):
+        """清理令牌已经回满的客户端（与新客户端等价），仍然过多时整体清空"""
+        idle = self.burst / self.refill_rate
+        self.clients = {ip: e for ip, e in self.clients.items()
+                        if now - e.last_seen < idle or not e.allowed}
+        if len(self.clients) >= self.max_clients:
+            self.clients.clear()
+
+    def make_kod(self, request, code):
+        """生成Kiss-o'-Death回复：stratum 0，ref_id为代码，发送时间回填客户端的发送时间"""
+        packet = NTPPacket(leap=LEAP_ALARM, version=(request[0] >> 3) & 0x7, mode=MODE_SERVER,
+                           stratum=0, poll=request[2], precision=self.precision, ref_id=code)
+        reply = bytearray(packet.pack())
+        reply[24:32] = request[40:48]
+        reply[40:48] = request[40:48]
+        return reply
+
+    def serve_batch(self):
+        """收取当前所有待处理请求（最多batch_size个），然后统一发送回复"""
+        sock = self.sock
+        buf = self.recv_buffer
+        stats = self.stats
+        now_monotonic = time.monotonic()
+        if (self.template_generation != self.state.generation
+                or now_monotonic - self.template_time > TEMPLATE_REFRESH_INTERVAL):
+            self.refresh_template(now_monotonic)
+        template = self.template
+        correction = self.state.correction()
+        transmit_times = self.transmit_times
+        replies = []
+
+        for _ in range(self.batch_size):
+            try:
+                nbytes, addr = sock.recvfrom_into(buf)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                # Windows上对端端口不可达会在下一次recv时报错，忽略即可
+                continue
+            recv_ts = time.time() + correction
+            stats['received'] += 1
+            if nbytes < NTP_PACKET_SIZE or buf[0] & 0x7 != MODE_CLIENT:
+                stats['malformed'] += 1
+                continue
+            code = self.admit(addr[0], now_monotonic)
+            if code is None:
+                reply = bytearray(template)
+                reply[0] = (reply[0] & 0xC0) | (buf[0] & 0x38) | MODE_SERVER
+                reply[2] = buf[2]
+                rx = system_to_ntp(recv_ts)
+                TIMESTAMP.pack_into(reply, 32, rx)
+                # 交错请求的 origin 是本服务端上一次回复该客户端时的接收时间戳
+                previous_tx = transmit_times.get(TIMESTAMP.unpack_from(buf, 24)[0])
+                if previous_tx is not None:
+                    reply[24:32] = buf[32:40]
+                    TIMESTAMP.pack_into(reply, 40, previous_tx)
+                    stats['interleaved'] += 1
+                else:
+                    reply[24:32] = buf[40:48]
+            elif code:
+                reply = self.make_kod(buf, code)
+                stats['kod_sent'] += 1
+                rx, previous_tx = 0, None
+            else:
+                continue
+            replies.append((reply, addr, rx, previous_tx is None))
+
+        for reply, addr, rx, basic in replies:
+            # KoD回复(stratum 0)保留回填的客户端发送时间，交错回复已经填好上一次的实际发送时间
+            if reply[1] and basic:
+                TIMESTAMP.pack_into(reply, 40, system_to_ntp(time.time() + correction))
+            try:
+                sock.sendto(reply, addr)
+                stats['replied'] += 1
+            except OSError:
+                continue
+            if rx:
+                transmit_times[rx] = system_to_ntp(time.time() + correction)
+                if len(transmit_times) > self.max_clients:
+                    del transmit_times[next(iter(transmit_times))]
+        return len(replies)
+
+    def serve_forever(self, poll_interval=0.5):
+        self.running = True
+        self.logger.info(f"NTP服务端已启动，监听 {self.address[0]}:{self.address[1]}")
+        try:
+            while self.running:
+                readable, _, _ = select.select([self.sock], [], [], poll_interval)
+                if readable:
+                    # 一直处理到socket中没有积压的请求
+                    while self.serve_batch() >= self.batch_size:
+                        pass
+        finally:
+            self.sock.close()
+            self.logger.info(f"NTP服务端已停止，统计: {self.stats}")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="NTPServer", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=2.0):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+def run_load_generator(address, duration=5.0, window=256, result_queue=None):
+    """本地压测客户端：保持window个请求在途，返回每秒收到的回复数"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.setblocking(False)
+    request = NTPPacket(version=4, mode=MODE_CLIENT).pack()
+    buf = bytearray(1024)
+    received = 0
+    in_flight = 0
+    start = time.monotonic()
+    deadline = start + duration
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        while in_flight < window:
+            try:
+                sock.sendto(request, address)
+            except BlockingIOError:
+                break
+            in_flight += 1
+        readable, _, _ = select.select([sock], [], [], 0.05)
+        if not readable:
+            # 超时视为丢包，重新补满在途窗口
+            in_flight = 0
+            continue
+        while True:
+            try:
+                sock.recv_into(buf)
+            except BlockingIOError:
+                break
+            received += 1
+            in_flight -= 1
+    sock.close()
+    pps = received / (time.monotonic() - start)
+    if result_queue is not None:
+        result_queue.put(pps)
+    return pps
+
+
+def benchmark(duration=5.0, window=256, clients=1):
+    """在本机启动服务端并用独立进程施加负载，返回服务端每秒回复数"""
+    from discipline import ClockState
+    state = ClockState()
+    server = NTPServer(host="127.0.0.1", port=0, state=state, rate_limit=False)
+    server.start()
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=run_load_generator,
+                                       args=(server.address, duration, window, queue))
+               for _ in range(clients)]
+    for worker in workers:
+        worker.start()
+    total = sum(queue.get() for _ in workers)
+    for worker in workers:
+        worker.join()
+    server.stop()
+    return total, server.stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NTP服务端压测")
+    parser.add_argument("--bench", action="store_true", help="运行本地吞吐量压测")
+    parser.add_argument("--duration", type=float, default=5.0, help="压测时长（秒）")
+    parser.add_argument("--window", type=int, default=256, help="每个压测进程的在途请求数")
+    parser.add_argument("--clients", type=int, default=1, help="压测进程数")
+    args = parser.parse_args(argv)
+    if not args.bench:
+        parser.print_help()
+        return 0
+    pps, stats = benchmark(args.duration, args.window, args.clients)
+    print(f"吞吐量: {pps:,.0f} 包/秒 (时长 {args.duration}s, 压测进程 {args.clients}, 在途窗口 {args.window})")
+    print(f"服务端统计: {stats}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+NTP时间同步器：依次查询服务器并选出用于设置时钟的结果
+
+界面、无界面模式和离线回放（replay.py）共用同一套选择逻辑；开启录制时每次交换写入 exchange_trace.exchange_recorder。
+默认使用NTPv4交错模式（见 ntp_client.py）：与某个服务器的上一次交换还没过期时发送交错请求，
+服务器支持时用回复中上一次回复的精确发送时间戳重新计算；每次同步不会为此额外查询同一个服务器。
+
+各服务器按写法交给对应的时间源查询（见 time_sources.py）。HTTP和Roughtime是备用时间源，
+排在所有NTP服务器之后；连续 BLOCKED_AFTER 个NTP服务器超时（UDP 123可能被封锁）时跳过其余NTP服务器，
+直接改用备用时间源，之后的同步中NTP只用很短的超时试探一次，直到NTP重新可用。
+本进程还没有收到过NTP回复时（例如启动后的第一次同步）NTP查询同样只用短超时，
+在封锁UDP 123的网络中第一次同步也能在几秒内转向备用时间源。
+列表中没有备用时间源时使用 DEFAULT_FALLBACK_SOURCES。
+"""
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timezone
+
+from cancellation import Cancelled
+from discipline import clock_state, sample_store
+from exchange_trace import exchange_recorder
+from http_time import http_date_source
+from metrics import sync_metrics
+from roughtime import RoughtimeSource
+from time_sources import NTPSource, NTSSource
+from tracing import tracer
+import ntp_client
+
+# 本次同步中连续这么多个NTP服务器超时（且没有NTP服务器成功）就认为UDP 123被封锁
+BLOCKED_AFTER = 2
+# 还没收到过NTP回复、或认为UDP 123被封锁时，NTP查询只用这么短的超时试探（秒）
+PROBE_TIMEOUT = 2.0
+# 服务器列表中没有备用时间源时，NTP全部失败后使用的HTTP时间源
+DEFAULT_FALLBACK_SOURCES = ["https://www.baidu.com", "https://www.aliyun.com", "https://www.qq.com"]
+# 进程内共享：UDP 123是否被判断为封锁，以及是否收到过NTP回复
+ntp_blocked = threading.Event()
+ntp_reachable = threading.Event()
+
+# NTP时间同步器
+class NTPSync:
+    def __init__(self, servers=None, timeout=15, interleaved=True, fallback_sources=None):
+        # 默认NTP服务器列表
+        self.default_servers = [
+            "ntp.ntsc.ac.cn",
+            "ntp.aliyun.com",
+            "pool.ntp.org",
+            "time.windows.com", 
+            "ntp.tencent.com",
+            "time.edu.cn",
+            "ntp.tuna.tsinghua.edu.cn",
+            "ntp1.aliyun.com",
+            "ntp2.aliyun.com",
+            "ntp3.aliyun.com",
+            "ntp4.aliyun.com",
+            "time1.cloud.tencent.com",
+            "time2.cloud.tencent.com",
+            "time3.cloud.tencent.com",
+            "time4.cloud.tencent.com"
+        ]
+        self.servers = servers or self.default_servers
+        self.timeout = timeout
+        self.interleaved = interleaved
+        self.fallback_sources = DEFAULT_FALLBACK_SOURCES if fallback_sources is None else fallback_sources
+        # 按顺序匹配，普通NTP兜底
+        self.sources = [NTSSource(), http_date_source, RoughtimeSource(), NTPSource(interleaved)]
+        # 本次同步中连续超时的NTP查询数
+        self.timeouts = 0
+        self.logger = logging.getLogger("NTPSync")
+
+    # UDP 123是否被判断为封锁；生产环境进程内共享，离线回放（replay.py）改为每个同步器各自的标志
+    @property
+    def udp_blocked(self):
+        return ntp_blocked.is_set()
+
+    @udp_blocked.setter
+    def udp_blocked(self, blocked):
+        if blocked:
+            ntp_blocked.set()
+        else:
+            ntp_blocked.clear()
+
+    def source_for(self, server):
+        return next(source for source in self.sources if source.matches(server))
+    
+    def get_time_from_server(self, server, cancel=None):
+        """从单个服务器获取时间，返回延迟；被取消时抛出Cancelled"""
+        source = self.source_for(server)
+        timeout = self.timeout
+        if source.port123 and (self.udp_blocked or not ntp_reachable.is_set()):
+            timeout = min(timeout, PROBE_TIMEOUT)
+        start_time = time.time()
+        try:
+            with tracer.span("query", server=server, source=source.name):
+                response = source.query(server, timeout, cancel)
+            elapsed_time = (time.time() - start_time) * 1000  # 转换为毫秒
+            if source.port123:
+                self.ntp_answered()
+                ntp_reachable.set()
+            sync_metrics.record_request(server, True, response.delay)
+            exchange_recorder.record(server, elapsed_time, response=response)
+            sample_store.record(server, response.offset, clock_state.total_applied, response.delay, time.time())
+            return True, response, None, elapsed_time
+        except Cancelled:
+            raise
+        except ntp_client.PollDeferred as e:
+            # 没有发出请求，不计入服务器的成败统计
+            return False, None, str(e), 0.0
+        except socket.timeout:
+            elapsed_time = (time.time() - start_time) * 1000
+            error, kind = f"连接超时 ({timeout:g}秒)", "timeout"
+            if source.port123:
+                self.timeouts += 1
+        except socket.gaierror:
+            elapsed_time = (time.time() - start_time) * 1000
+            error, kind = "DNS解析失败", "dns"
+        except Exception as e:
+            elapsed_time = (time.time() - start_time) * 1000
+            error, kind = str(e), "error"
+        sync_metrics.record_request(server, False, 0.0)
+        exchange_recorder.record(server, elapsed_time, error=error, kind=kind)
+        return False, None, error, elapsed_time
+    
+    def ntp_answered(self):
+        """UDP 123上的时间源有了回复：清零连续超时计数，解除封锁判断"""
+        self.timeouts = 0
+        if self.udp_blocked:
+            self.udp_blocked = False
+            self.logger.info("✅ NTP恢复可用")
+    
+    def sync_time(self, cancel=None):
+        """尝试从多个服务器同步时间：先NTP，都失败时再用备用时间源"""
+        results = []
+        exchange_recorder.begin_sync(self.servers)
+        primary = [s for s in self.servers if not self.source_for(s).fallback]
+        fallback = [s for s in self.servers if self.source_for(s).fallback] or self.fallback_sources
+        
+        # 依次尝试服务器，选用第一个成功响应的
+        with tracer.span("select", candidates=len(self.servers)) as span_args:
+            for server in primary + fallback:
+                source = self.source_for(server)
+                if source.port123 and self.timeouts >= (1 if self.udp_blocked else BLOCKED_AFTER):
+                    continue
+                success, response, error, delay = self.get_time_from_server(server, cancel)
+                if self.timeouts >= BLOCKED_AFTER and not self.udp_blocked:
+                    self.udp_blocked = True
+                    self.logger.warning(f"⚠️ 连续 {self.timeouts} 个NTP服务器超时，UDP 123 可能被封锁，改用备用时间源")
+                results.append({
+                    'server': server,
+                    'success': success,
+                    'response': response,
+                    'error': error,
+                    'delay': delay
+                })
+                
+                if success:
+                    span_args['selected'] = server
+                    # 转换为UTC时间
+                    utc_time = datetime.fromtimestamp(response.tx_time, timezone.utc)
+                    return True, utc_time, server, delay, results
+        
+        return False, None, None, None, results
@@ -0,0 +1,613 @@
+"""
+NTS（Network Time Security, RFC 8915）客户端
+
+首次使用某个服务器时通过TLS 1.3完成NTS-KE握手，得到双向密钥和一批cookie；之后每次同步
+只消耗一个cookie做一次经过认证的UDP交换，回复中会带回新的cookie补充缓存，
+只有cookie用完（或服务器拒绝，NTSN）时才重新握手。cookie和密钥保存在本地文件中，重启后继续使用。
+
+Python标准库的ssl模块不支持导出TLS密钥材料，因此依赖 pyOpenSSL 和 cryptography；
+未安装时NTS不可用，其他功能不受影响。
+
+服务器在配置中写作 nts://主机[:NTS-KE端口]。本文件还带有一个本地NTS-KE/NTP替身服务端，
+配合自签名证书可以在本机完整演练握手和认证交换。
+"""
+import os
+import hmac
+import json
+import time
+import socket
+import select
+import struct
+import logging
+import ipaddress
+import threading
+from datetime import datetime, timedelta, timezone
+
+try:
+    from OpenSSL import SSL
+    from cryptography import x509
+    from cryptography.hazmat.primitives.cmac import CMAC
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    SSL = None
+    x509 = None
+
+import ntp_client
+from ntp_packet import NTP_PORT, NTP_PACKET_SIZE, MODE_CLIENT, MODE_SERVER, NTPPacket, system_to_ntp
+
+NTS_SCHEME = "nts://"
+NTS_KE_PORT = 4460
+ALPN_NTSKE = b"ntske/1"
+EXPORTER_LABEL = b"EXPORTER-network-time-security"
+NEXT_PROTOCOL_NTPV4 = 0
+AEAD_AES_SIV_CMAC_256 = 15
+KEY_LENGTH = 32
+# 每个服务器保持的cookie数量
+MAX_COOKIES = 8
+
+# NTS-KE记录类型
+REC_END = 0
+REC_NEXT_PROTOCOL = 1
+REC_ERROR = 2
+REC_WARNING = 3
+REC_AEAD = 4
+REC_COOKIE = 5
+REC_SERVER = 6
+REC_PORT = 7
+CRITICAL = 0x8000
+
+# NTP扩展字段类型
+EF_UNIQUE_ID = 0x0104
+EF_COOKIE = 0x0204
+EF_COOKIE_PLACEHOLDER = 0x0304
+EF_AUTHENTICATOR = 0x0404
+
+KOD_NTSN = "NTSN"
+
+
+class NTSError(Exception):
+    """NTS握手或认证失败"""
+
+
+def check_available():
+    if SSL is None:
+        raise NTSError("NTS需要安装 pyOpenSSL 和 cryptography: pip install pyopenssl cryptography")
+
+
+def parse_nts_server(server):
+    """nts://host[:port] -> (host, port)"""
+    address = server[len(NTS_SCHEME):] if server.startswith(NTS_SCHEME) else server
+    if address.startswith("["):
+        host, _, rest = address[1:].partition("]")
+        return host, int(rest[1:]) if rest.startswith(":") else NTS_KE_PORT
+    if address.count(":") == 1:
+        host, port = address.split(":")
+        return host, int(port)
+    return address, NTS_KE_PORT
+
+
+# ---------------------- AES-SIV (RFC 5297) ----------------------
+# cryptography自带的AESSIV不接受空明文，而NTS客户端请求的加密内容通常为空，这里按RFC自行组合CMAC和CTR
+
+def _dbl(block):
+    value = int.from_bytes(block, 'big') << 1
+    if value >> 128:
+        value = (value & ((1 << 128) - 1)) ^ 0x87
+    return value.to_bytes(16, 'big')
+
+
+def _xor(a, b):
+    return bytes(x ^ y for x, y in zip(a, b))
+
+
+def _cmac(key, data):
+    mac = CMAC(algorithms.AES(key))
+    mac.update(data)
+    return mac.finalize()
+
+
+def _s2v(key, components):
+    d = _cmac(key, b"\0" * 16)
+    for component in components[:-1]:
+        d = _xor(_dbl(d), _cmac(key, component))
+    last = components[-1]
+    if len(last) >= 16:
+        t = last[:-16] + _xor(last[-16:], d)
+    else:
+        t = _xor(_dbl(d), last + b"\x80" + b"\0" * (15 - len(last)))
+    return _cmac(key, t)
+
+
+def _ctr(key, siv, data):
+    counter = bytearray(siv)
+    counter[8] &= 0x7F
+    counter[12] &= 0x7F
+    cipher = Cipher(algorithms.AES(key), modes.CTR(bytes(counter))).encryptor()
+    return cipher.update(data) + cipher.finalize()
+
+
+def siv_encrypt(key, plaintext, associated_data):
+    """返回 SIV(16字节) + 密文；key前半用于S2V，后半用于CTR"""
+    half = len(key) // 2
+    siv = _s2v(key[:half], list(associated_data) + [plaintext])
+    return siv + _ctr(key[half:], siv, plaintext)
+
+
+def siv_decrypt(key, ciphertext, associated_data):
+    """校验并解密，认证失败抛出NTSError"""
+    if len(ciphertext) < 16:
+        raise NTSError("NTS认证失败")
+    half = len(key) // 2
+    siv = ciphertext[:16]
+    plaintext = _ctr(key[half:], siv, ciphertext[16:])
+    if not hmac.compare_digest(siv, _s2v(key[:half], list(associated_data) + [plaintext])):
+        raise NTSError("NTS认证失败")
+    return plaintext
+
+
+# ---------------------- 编解码 ----------------------
+
+def encode_record(record_type, body=b"", critical=True):
+    return struct.pack("!HH", record_type | (CRITICAL if critical else 0), len(body)) + body
+
+
+def decode_records(data):
+    """解析NTS-KE记录，返回 [(类型, 是否关键, 内容)]，到End of Message为止"""
+    records = []
+    pos = 0
+    while pos + 4 <= len(data):
+        record_type, length = struct.unpack_from("!HH", data, pos)
+        body = data[pos + 4:pos + 4 + length]
+        if len(body) < length:
+            break
+        records.append((record_type & ~CRITICAL, bool(record_type & CRITICAL), body))
+        pos += 4 + length
+        if record_type & ~CRITICAL == REC_END:
+            break
+    return records
+
+
+def encode_extension(field_type, body):
+    """NTP扩展字段：内容填充到4字节对齐，总长度至少16字节（RFC 7822）"""
+    padded = body + b"\0" * (-len(body) % 4)
+    padded += b"\0" * max(0, 12 - len(padded))
+    return struct.pack("!HH", field_type, len(padded) + 4) + padded
+
+
+def parse_extensions(data, start=NTP_PACKET_SIZE):
+    """解析扩展字段，返回 [(类型, 内容, 起始偏移)]"""
+    fields = []
+    pos = start
+    while pos + 4 <= len(data):
+        field_type, length = struct.unpack_from("!HH", data, pos)
+        if length < 4 or pos + length > len(data):
+            raise NTSError("扩展字段长度无效")
+        fields.append((field_type, data[pos + 4:pos + length], pos))
+        pos += length
+    return fields
+
+
+def encode_authenticator(key, associated_data, plaintext=b""):
+    """NTS认证与加密扩展字段：AES-SIV加密，nonce作为最后一个关联数据分量"""
+    nonce = os.urandom(16)
+    ciphertext = siv_encrypt(key, plaintext, [associated_data, nonce])
+    body = struct.pack("!HH", len(nonce), len(ciphertext)) + nonce + ciphertext
+    return encode_extension(EF_AUTHENTICATOR, body)
+
+
+def decode_authenticator(key, data, fields):
+    """校验回复中的认证字段并返回解密后的内容；认证失败抛出NTSError"""
+    for field_type, body, start in fields:
+        if field_type != EF_AUTHENTICATOR:
+            continue
+        nonce_length, ciphertext_length = struct.unpack_from("!HH", body)
+        nonce = body[4:4 + nonce_length]
+        cipher_start = 4 + nonce_length + (-nonce_length % 4)
+        ciphertext = body[cipher_start:cipher_start + ciphertext_length]
+        return siv_decrypt(key, ciphertext, [data[:start], nonce])
+    raise NTSError("回复中缺少NTS认证字段")
+
+
+def export_keys(conn):
+    """从TLS会话导出双向密钥 (c2s, s2c)"""
+    def export(direction):
+        context = struct.pack("!HHB", NEXT_PROTOCOL_NTPV4, AEAD_AES_SIV_CMAC_256, direction)
+        return conn.export_keying_material(EXPORTER_LABEL, KEY_LENGTH, context)
+    return export(0), export(1)
+
+
+# ---------------------- TLS辅助 ----------------------
+
+def _tls_call(conn, sock, deadline, func, *args, cancel=None):
+    """在非阻塞socket上执行pyOpenSSL操作，等待读写就绪直到超时或被取消"""
+    while True:
+        try:
+            return func(*args)
+        except SSL.WantReadError:
+            wait_read, wait_write = [sock], []
+        except SSL.WantWriteError:
+            wait_read, wait_write = [], [sock]
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout("NTS-KE超时")
+        if cancel is not None:
+            wait_read = wait_read + [cancel]
+        select.select(wait_read, wait_write, [], remaining)
+        if cancel is not None:
+            cancel.check()
+
+
+def _check_hostname(cert, host):
+    """校验证书的subjectAltName是否包含目标主机"""
+    try:
+        san = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+    except x509.ExtensionNotFound:
+        raise NTSError("服务器证书缺少subjectAltName")
+    try:
+        address = ipaddress.ip_address(host)
+        if address in san.get_values_for_type(x509.IPAddress):
+            return
+    except ValueError:
+        host = host.lower().rstrip(".")
+        for name in san.get_values_for_type(x509.DNSName):
+            name = name.lower().rstrip(".")
+            if name == host:
+                return
+            # 只允许最左侧一级通配
+            if name.startswith("*.") and "." in host and host.split(".", 1)[1] == name[2:]:
+                return
+    raise NTSError(f"服务器证书与主机名不匹配: {host}")
+
+
+# ---------------------- 会话与客户端 ----------------------
+
+# 单个NTS服务器的密钥和cookie
+class NTSSession:
+    def __init__(self, ntp_host, ntp_port, c2s, s2c, cookies, created=None):
+        self.ntp_host = ntp_host
+        self.ntp_port = ntp_port
+        self.c2s = c2s
+        self.s2c = s2c
+        self.cookies = list(cookies)
+        self.created = created or time.time()
+
+    def to_dict(self):
+        return {'ntp_host': self.ntp_host, 'ntp_port': self.ntp_port, 'c2s': self.c2s.hex(),
+                's2c': self.s2c.hex(), 'cookies': [c.hex() for c in self.cookies], 'created': self.created}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['ntp_host'], data['ntp_port'], bytes.fromhex(data['c2s']),
+                   bytes.fromhex(data['s2c']), [bytes.fromhex(c) for c in data['cookies']], data['created'])
+
+
+def nts_ke(host, port=NTS_KE_PORT, timeout=5, cafile=None, cancel=None):
+    """执行一次NTS-KE握手，返回新的NTSSession"""
+    check_available()
+    context = SSL.Context(SSL.TLS_METHOD)
+    context.set_min_proto_version(SSL.TLS1_3_VERSION)
+    context.set_alpn_protos([ALPN_NTSKE])
+    context.set_verify(SSL.VERIFY_PEER, lambda conn, cert, errno, depth, ok: bool(ok))
+    if cafile:
+        context.load_verify_locations(cafile)
+    else:
+        context.set_default_verify_paths()
+
+    deadline = time.monotonic() + timeout
+    sock = socket.create_connection((host, port), timeout=timeout)
+    sock.setblocking(False)
+    conn = SSL.Connection(context, sock)
+    try:
+        conn.set_connect_state()
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            conn.set_tlsext_host_name(host.encode('idna'))
+        _tls_call(conn, sock, deadline, conn.do_handshake, cancel=cancel)
+        if conn.get_alpn_proto_negotiated() != ALPN_NTSKE:
+            raise NTSError("服务器不支持NTS-KE (ALPN协商失败)")
+        _check_hostname(conn.get_peer_certificate().to_cryptography(), host)
+
+        request = (encode_record(REC_NEXT_PROTOCOL, struct.pack("!H", NEXT_PROTOCOL_NTPV4))
+                   + encode_record(REC_AEAD, struct.pack("!H", AEAD_AES_SIV_CMAC_256))
+                   + encode_record(REC_END))
+        sent = 0
+        while sent < len(request):
+            sent += _tls_call(conn, sock, deadline, conn.send, request[sent:], cancel=cancel)
+
+        data = b""
+        while True:
+            try:
+                chunk = _tls_call(conn, sock, deadline, conn.recv, 4096, cancel=cancel)
+            except SSL.ZeroReturnError:
+                break
+            if not chunk:
+                break
+            data += chunk
+            records = decode_records(data)
+            if records and records[-1][0] == REC_END:
+                break
+        c2s, s2c = export_keys(conn)
+    finally:
+        try:
+            conn.shutdown()
+        except SSL.Error:
+            pass
+        sock.close()
+
+    ntp_host, ntp_port, cookies = host, NTP_PORT, []
+    protocol_ok = aead_ok = False
+    for record_type, critical, body in decode_records(data):
+        if record_type == REC_ERROR:
+            raise NTSError(f"NTS-KE服务器返回错误: {struct.unpack('!H', body)[0]}")
+        elif record_type == REC_NEXT_PROTOCOL:
+            protocol_ok = struct.pack("!H", NEXT_PROTOCOL_NTPV4) in [body[i:i + 2] for i in range(0, len(body), 2)]
+        elif record_type == REC_AEAD:
+            aead_ok = body[:2] == struct.pack("!H", AEAD_AES_SIV_CMAC_256)
+        elif record_type == REC_COOKIE:
+            cookies.append(body)
+        elif record_type == REC_SERVER:
+            ntp_host = body.decode('ascii')
+        elif record_type == REC_PORT:
+            ntp_port = struct.unpack("!H", body)[0]
+        elif critical and record_type not in (REC_END, REC_WARNING):
+            raise NTSError(f"NTS-KE回复包含无法识别的关键记录: {record_type}")
+    if not (protocol_ok and aead_ok and cookies):
+        raise NTSError("NTS-KE协商失败（协议、算法或cookie缺失）")
+    return NTSSession(ntp_host, ntp_port, c2s, s2c, cookies)
+
+
+# NTS客户端：按服务器缓存会话，cookie用完才重新握手
+class NTSClient:
+    def __init__(self, store_path=None, timeout=5, cafile=None):
+        self.store_path = store_path
+        self.timeout = timeout
+        self.cafile = cafile
+        self.sessions = {}
+        self.lock = threading.Lock()
+        # 同步和服务器测试可能同时保存，写文件期间互斥（不占用会话锁，查询不必等磁盘）
+        self.save_lock = threading.Lock()
+        self.logger = logging.getLogger("NTSClient")
+        self.load()
+
+    def load(self):
+        if not self.store_path or not os.path.exists(self.store_path):
+            return
+        try:
+            with open(self.store_path, 'r', encoding='utf-8') as f:
+                self.sessions = {k: NTSSession.from_dict(v) for k, v in json.load(f).items()}
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.warning(f"读取NTS cookie缓存失败，将重新握手: {e}")
+            self.sessions = {}
+
+    def save(self):
+        """原子写入cookie缓存（只有当前用户可读写）"""
+        if not self.store_path:
+            return
+        tmp_path = self.store_path + ".tmp"
+        try:
+            with self.save_lock:
+                # 在写文件的锁内取快照，后保存的一定是较新的内容
+                with self.lock:
+                    data = {k: v.to_dict() for k, v in self.sessions.items()}
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.store_path)
+        except OSError as e:
+            # 缓存写不进去只影响重启后能否复用cookie，不影响本次已经成功的查询
+            self.logger.warning(f"保存NTS cookie缓存失败: {e}")
+
+    def take_cookie(self, server, cancel=None):
+        """取出一个cookie，没有可用cookie时先握手"""
+        with self.lock:
+            session = self.sessions.get(server)
+            if session is not None and session.cookies:
+                return session, session.cookies.pop(0)
+        host, port = parse_nts_server(server)
+        self.logger.info(f"与 {host}:{port} 进行NTS-KE握手")
+        session = nts_ke(host, port, self.timeout, self.cafile, cancel)
+        with self.lock:
+            self.sessions[server] = session
+            return session, session.cookies.pop(0)
+
+    def query(self, server, timeout=None, cancel=None):
+        """一次经过NTS认证的NTP查询，返回 ntp_client.NTPResponse"""
+        check_available()
+        timeout = timeout or self.timeout
+        session, cookie = self.take_cookie(server, cancel)
+        unique_id = os.urandom(32)
+        # 用占位字段请求额外的cookie，把缓存补回MAX_COOKIES个
+        placeholders = max(0, MAX_COOKIES - 1 - len(session.cookies))
+        fields = encode_extension(EF_UNIQUE_ID, unique_id) + encode_extension(EF_COOKIE, cookie)
+        fields += encode_extension(EF_COOKIE_PLACEHOLDER, b"\0" * len(cookie)) * placeholders
+        new_cookies = []
+        rejected = []
+
+        def extensions(header):
+            return fields + encode_authenticator(session.c2s, header + fields)
+
+        def validate(data, packet):
+            try:
+                received = parse_extensions(data)
+            except NTSError:
+                return False
+            if not any(t == EF_UNIQUE_ID and body == unique_id for t, body, _ in received):
+                return False
+            if packet.is_kod:
+                # NTS NAK：cookie不再有效，丢弃会话以便下次重新握手
+                if packet.kiss_code == KOD_NTSN:
+                    rejected.append(True)
+                return True
+            try:
+                plaintext = decode_authenticator(session.s2c, data, received)
+                inner = parse_extensions(plaintext, 0)
+            except NTSError:
+                return False
+            new_cookies.extend(body for t, body, _ in inner if t == EF_COOKIE)
+            return True
+
+        try:
+            response = ntp_client.query(session.ntp_host, session.ntp_port, version=4, timeout=timeout,
+                                        extensions=extensions, validate=validate, cancel=cancel)
+        except ntp_client.NTPError:
+            if rejected:
+                with self.lock:
+                    self.sessions.pop(server, None)
+                self.save()
+            raise
+        with self.lock:
+            session.cookies.extend(new_cookies)
+            del session.cookies[MAX_COOKIES:]
+        self.save()
+        return response
+
+
+# ---------------------- 本地替身服务端（测试用） ----------------------
+
+def make_self_signed_cert(hostname, certfile, keyfile, days=30):
+    """生成自签名证书，供本地NTS替身服务端使用"""
+    check_available()
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, hostname)])
+    try:
+        alt_name = x509.IPAddress(ipaddress.ip_address(hostname))
+    except ValueError:
+        alt_name = x509.DNSName(hostname)
+    now = datetime.now(timezone.utc)
+    cert = (x509.CertificateBuilder()
+            .subject_name(name).issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - timedelta(days=1))
+            .not_valid_after(now + timedelta(days=days))
+            .add_extension(x509.SubjectAlternativeName([alt_name]), critical=False)
+            .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+            .sign(key, hashes.SHA256()))
+    with open(certfile, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+
+
+# 本地NTS-KE和NTS-NTP替身服务端：cookie为用主密钥加密的双向密钥
+class LocalNTSServer:
+    def __init__(self, certfile, keyfile, host="127.0.0.1", ke_port=0, ntp_port=0):
+        check_available()
+        self.master_key = os.urandom(32)
+        self.host = host
+        self.context = SSL.Context(SSL.TLS_METHOD)
+        self.context.set_min_proto_version(SSL.TLS1_3_VERSION)
+        self.context.use_certificate_file(certfile)
+        self.context.use_privatekey_file(keyfile)
+        self.context.set_alpn_select_callback(
+            lambda conn, protos: ALPN_NTSKE if ALPN_NTSKE in protos else SSL.NO_OVERLAPPING_PROTOCOLS)
+        self.ke_sock = socket.create_server((host, ke_port))
+        self.ntp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.ntp_sock.bind((host, ntp_port))
+        self.ke_address = self.ke_sock.getsockname()
+        self.ntp_address = self.ntp_sock.getsockname()
+        self.running = False
+        self.threads = []
+        self.stats = {'handshakes': 0, 'requests': 0, 'rejected': 0}
+
+    def make_cookie(self, c2s, s2c):
+        nonce = os.urandom(16)
+        return nonce + siv_encrypt(self.master_key, c2s + s2c, [nonce])
+
+    def open_cookie(self, cookie):
+        nonce, sealed = cookie[:16], cookie[16:]
+        keys = siv_decrypt(self.master_key, sealed, [nonce])
+        return keys[:KEY_LENGTH], keys[KEY_LENGTH:]
+
+    def handle_ke(self, sock):
+        # pyOpenSSL直接操作文件描述符，替身服务端使用阻塞socket即可
+        sock.setblocking(True)
+        conn = SSL.Connection(self.context, sock)
+        conn.set_accept_state()
+        try:
+            conn.do_handshake()
+            data = b""
+            while not (decode_records(data) and decode_records(data)[-1][0] == REC_END):
+                data += conn.recv(4096)
+            c2s, s2c = export_keys(conn)
+            reply = (encode_record(REC_NEXT_PROTOCOL, struct.pack("!H", NEXT_PROTOCOL_NTPV4))
+                     + encode_record(REC_AEAD, struct.pack("!H", AEAD_AES_SIV_CMAC_256))
+                     + encode_record(REC_PORT, struct.pack("!H", self.ntp_address[1]))
+                     + b"".join(encode_record(REC_COOKIE, self.make_cookie(c2s, s2c), critical=False)
+                                for _ in range(MAX_COOKIES))
+                     + encode_record(REC_END))
+            conn.sendall(reply)
+            conn.shutdown()
+            self.stats['handshakes'] += 1
+        except (SSL.Error, OSError):
+            pass
+        finally:
+            sock.close()
+
+    def handle_ntp(self, data, addr):
+        recv_ts = system_to_ntp(time.time())
+        request = NTPPacket.unpack(data)
+        if request.mode != MODE_CLIENT:
+            return None
+        fields = parse_extensions(data)
+        unique_id = next((body for t, body, _ in fields if t == EF_UNIQUE_ID), None)
+        cookie = next((body for t, body, _ in fields if t == EF_COOKIE), None)
+        placeholders = sum(1 for t, _, _ in fields if t == EF_COOKIE_PLACEHOLDER)
+        header = NTPPacket(version=request.version, mode=MODE_SERVER, stratum=1, poll=request.poll,
+                           precision=-20, ref_id=b"NTS\0", ref_timestamp=recv_ts,
+                           orig_timestamp=request.tx_timestamp, recv_timestamp=recv_ts)
+        try:
+            c2s, s2c = self.open_cookie(cookie)
+            decode_authenticator(c2s, data, fields)
+        except Exception:
+            # cookie或认证无效：回复NTS NAK
+            self.stats['rejected'] += 1
+            header.stratum = 0
+            header.ref_id = KOD_NTSN.encode('ascii')
+            header.tx_timestamp = request.tx_timestamp
+            return header.pack() + encode_extension(EF_UNIQUE_ID, unique_id or b"")
+        self.stats['requests'] += 1
+        header.tx_timestamp = system_to_ntp(time.time())
+        reply = header.pack() + encode_extension(EF_UNIQUE_ID, unique_id)
+        cookies = b"".join(encode_extension(EF_COOKIE, self.make_cookie(c2s, s2c))
+                           for _ in range(1 + placeholders))
+        return reply + encode_authenticator(s2c, reply, cookies)
+
+    def serve_ke(self):
+        while self.running:
+            try:
+                sock, _ = self.ke_sock.accept()
+            except OSError:
+                break
+            self.handle_ke(sock)
+
+    def serve_ntp(self):
+        while self.running:
+            try:
+                data, addr = self.ntp_sock.recvfrom(4096)
+            except OSError:
+                break
+            try:
+                reply = self.handle_ntp(data, addr)
+            except (ValueError, NTSError, struct.error):
+                continue
+            if reply:
+                self.ntp_sock.sendto(reply, addr)
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=self.serve_ke, daemon=True),
+                        threading.Thread(target=self.serve_ntp, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        self.ke_sock.close()
+        self.ntp_sock.close()
@@ -34,10 +34,21 @@ pyinstaller ^
   --windowed ^
   --name="时间同步工具" ^
   --icon="clock.ico" ^
-  --manifest="uac.manifest" ^
   --clean ^
   --add-data="clock.ico;." ^
   main.py
+if %errorlevel% neq 0 goto done
+
+:: 打包时间设置助手（唯一需要管理员权限的部分）
+pyinstaller ^
+  --onefile ^
+  --noconsole ^
+  --name="TimeSyncHelper" ^
+  --icon="clock.ico" ^
+  --manifest="uac.manifest" ^
+  time_helper.py
+
+:done
 
 :: 检查打包结果
 if %errorlevel% equ 0 (
@@ -0,0 +1,153 @@
+"""
+离线回放录制的NTP交换（exchange_trace.py），用生产环境的真实轨迹比较选择算法的改动
+
+每次录制的同步交给 NTPSync 的选择逻辑重新决策：查询某个服务器时不访问网络，直接返回录制的结果，
+耗时按录制值累计（不真正等待），所以比实际运行快得多。对每次同步统计：
+  决策耗时   选出结果前累计的交换耗时
+  偏移误差   选中的偏移与本次同步所有成功交换偏移的中位数之差（至少两个成功交换时才有参照）
+同一份轨迹在算法改动前后各回放一次，比较两次的汇总即可。
+
+用法: python replay.py trace.jsonl.gz [--json] [--verbose]
+"""
+import sys
+import json
+import time
+import argparse
+from collections import deque
+
+from exchange_trace import load_trace
+from ntp_sync import NTPSync
+
+
+def percentile(values, fraction):
+    """最近秩百分位数，values为空时返回None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+# 回放用的同步器：选择逻辑继承自NTPSync，查询改为读取录制的交换
+class ReplaySync(NTPSync):
+    # UDP 123封锁判断只在本次回放内有效，不影响进程内共享的 ntp_blocked
+    udp_blocked = False
+
+    def __init__(self, recorded):
+        super().__init__(recorded.servers)
+        self.pending = {}
+        for exchange in recorded.exchanges:
+            self.pending.setdefault(exchange["server"], deque()).append(exchange)
+        self.elapsed = 0.0
+        self.queries = 0
+
+    def get_time_from_server(self, server, cancel=None):
+        exchanges = self.pending.get(server)
+        if not exchanges:
+            # 录制时没有查询这个服务器（原算法在它之前就做出了决策）
+            return False, None, "未录制", 0.0
+        exchange = exchanges.popleft()
+        self.elapsed += exchange["elapsed"]
+        self.queries += 1
+        port123 = self.source_for(server).port123
+        if exchange["response"] is None:
+            if port123 and exchange["kind"] == "timeout":
+                self.timeouts += 1
+            return False, None, exchange["error"], exchange["elapsed"]
+        if port123:
+            self.ntp_answered()
+        return True, exchange["response"], None, exchange["elapsed"]
+
+
+def replay_sync(recorded):
+    """回放一次同步，返回结果字典"""
+    offsets = [e["response"].offset for e in recorded.successes()]
+    reference = median(offsets) if len(offsets) >= 2 else None
+    ntp_sync = ReplaySync(recorded)
+    success, _, server, _, results = ntp_sync.sync_time()
+    result = {"time": recorded.time, "success": success, "server": server,
+              "decision_ms": ntp_sync.elapsed, "queries": ntp_sync.queries,
+              "offset": None, "error": None}
+    if success:
+        result["offset"] = results[-1]["response"].offset
+        if reference is not None:
+            result["error"] = result["offset"] - reference
+    return result
+
+
+def replay(path):
+    """回放整个轨迹，返回 (各次同步的结果, 回放耗时秒)"""
+    start = time.perf_counter()
+    results = [replay_sync(recorded) for recorded in load_trace(path)]
+    return results, time.perf_counter() - start
+
+
+def summarize(results, replay_seconds):
+    decisions = [r["decision_ms"] for r in results]
+    errors = [abs(r["error"]) * 1000 for r in results if r["error"] is not None]
+    return {
+        "syncs": len(results),
+        "success_rate": sum(r["success"] for r in results) / len(results) if results else None,
+        "queries_per_sync": sum(r["queries"] for r in results) / len(results) if results else None,
+        "decision_ms_p50": percentile(decisions, 0.5),
+        "decision_ms_p95": percentile(decisions, 0.95),
+        "decision_ms_max": max(decisions) if decisions else None,
+        "abs_error_ms_mean": sum(errors) / len(errors) if errors else None,
+        "abs_error_ms_p95": percentile(errors, 0.95),
+        "compared_syncs": len(errors),
+        "replay_seconds": replay_seconds,
+        "recorded_seconds": sum(decisions) / 1000,
+    }
+
+
+def format_summary(summary):
+    def fmt(value, spec):
+        return "-" if value is None else format(value, spec)
+    speedup = (summary["recorded_seconds"] / summary["replay_seconds"]
+               if summary["replay_seconds"] > 0 else None)
+    return "\n".join([
+        f"同步次数: {summary['syncs']}  成功率: {fmt(summary['success_rate'], '.1%')}  "
+        f"平均查询数: {fmt(summary['queries_per_sync'], '.2f')}",
+        f"决策耗时: p50 {fmt(summary['decision_ms_p50'], '.1f')}ms  p95 {fmt(summary['decision_ms_p95'], '.1f')}ms  "
+        f"最大 {fmt(summary['decision_ms_max'], '.1f')}ms",
+        f"偏移误差（与中位数相比，{summary['compared_syncs']} 次有参照）: 平均 {fmt(summary['abs_error_ms_mean'], '.3f')}ms  "
+        f"p95 {fmt(summary['abs_error_ms_p95'], '.3f')}ms",
+        f"回放耗时 {summary['replay_seconds']:.3f} 秒（录制的决策耗时合计 {summary['recorded_seconds']:.1f} 秒，"
+        f"加速 {fmt(speedup, '.0f')} 倍）",
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="回放录制的NTP交换，评估同步选择算法")
+    parser.add_argument("trace", help="录制的轨迹文件（main.py --record-exchanges 生成）")
+    parser.add_argument("--json", action="store_true", help="以JSON输出汇总，便于比较算法改动前后的结果")
+    parser.add_argument("--verbose", action="store_true", help="逐次输出每次同步的回放结果")
+    args = parser.parse_args(argv)
+
+    results, replay_seconds = replay(args.trace)
+    summary = summarize(results, replay_seconds)
+    if args.verbose:
+        for r in results:
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r["time"]))
+            if not r["success"]:
+                print(f"{stamp}  失败  查询 {r['queries']} 次  {r['decision_ms']:.1f}ms")
+                continue
+            error = "-" if r["error"] is None else f"{r['error'] * 1000:+.3f}ms"
+            print(f"{stamp}  {r['server']}  偏移 {r['offset'] * 1000:+.3f}ms  误差 {error}  "
+                  f"查询 {r['queries']} 次  {r['decision_ms']:.1f}ms")
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print(format_summary(summary))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+"""
+Roughtime时间源：服务器用Ed25519签名的时间，可以证明回复确实来自该服务器且对应本次请求（请求中的随机数）
+
+实现的是Google最初的Roughtime协议（64字节随机数、SHA-512 Merkle树、MIDP/RADI以微秒计）。
+消息为标签-值表：标签数N、N-1个值偏移、N个按小端整数升序排列的4字节标签，之后是各个值，全部小端。
+回复中 CERT 是长期密钥对临时密钥（DELE: MINT/MAXT/PUBK）的签名，SIG 是临时密钥对 SREP（ROOT/MIDP/RADI）的签名，
+ROOT 是包含本次随机数的Merkle树根（PATH/INDX 给出路径）。
+
+服务器写作 roughtime://主机[:端口]/长期公钥（base64），默认端口2002。
+Ed25519签名依赖 cryptography；未安装时Roughtime不可用，其他功能不受影响。
+本文件还带有一个本地替身服务端（RoughtimeServer），可以给时间加上任意偏移来演练。
+"""
+import os
+import time
+import base64
+import socket
+import select
+import struct
+import hashlib
+import logging
+import threading
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+except ImportError:
+    Ed25519PublicKey = None
+
+from cancellation import Cancelled
+from time_sources import SourceResponse, TimeSource
+
+ROUGHTIME_SCHEME = "roughtime://"
+ROUGHTIME_PORT = 2002
+# 请求填充到的长度，避免被用于反射放大
+REQUEST_SIZE = 1024
+NONCE_SIZE = 64
+HASH_SIZE = 64
+# 签名上下文
+DELEGATION_CONTEXT = b"RoughTime v1 delegation signature--\x00"
+RESPONSE_CONTEXT = b"RoughTime v1 response signature\x00"
+# Roughtime服务器通常直接连着参考时钟
+ROUGHTIME_STRATUM = 1
+# 替身服务端临时密钥的有效期（秒）和给出的半径（微秒）
+DELEGATION_LIFETIME = 24 * 3600
+DEFAULT_RADIUS = 1000000
+
+
+class RoughtimeError(Exception):
+    """Roughtime回复格式错误或验证失败"""
+
+
+def check_available():
+    if Ed25519PublicKey is None:
+        raise RoughtimeError("Roughtime需要安装 cryptography: pip install cryptography")
+
+
+def tag_value(tag):
+    """标签排序用的小端整数值"""
+    return struct.unpack("<I", tag)[0]
+
+
+def encode_message(fields):
+    """{标签: 值} -> 消息字节，值的长度必须是4的倍数"""
+    tags = sorted(fields, key=tag_value)
+    offsets, position = [], 0
+    for tag in tags[:-1]:
+        position += len(fields[tag])
+        offsets.append(position)
+    header = struct.pack(f"<{1 + len(offsets)}I", len(tags), *offsets)
+    return header + b"".join(tags) + b"".join(fields[tag] for tag in tags)
+
+
+def decode_message(data):
+    """消息字节 -> {标签: 值}，格式错误时抛出RoughtimeError"""
+    if len(data) < 4 or len(data) % 4:
+        raise RoughtimeError("消息长度无效")
+    count = struct.unpack_from("<I", data)[0]
+    header = 4 + 4 * (count - 1) + 4 * count if count else 4
+    if count == 0 or header > len(data):
+        raise RoughtimeError("消息头无效")
+    offsets = [0] + list(struct.unpack_from(f"<{count - 1}I", data, 4))
+    tags = [data[4 * count + 4 * i:4 * count + 4 * i + 4] for i in range(count)]
+    ends = offsets[1:] + [len(data) - header]
+    fields = {}
+    for tag, start, end in zip(tags, offsets, ends):
+        if start > end or start % 4 or header + end > len(data):
+            raise RoughtimeError("值偏移无效")
+        fields[tag] = data[header + start:header + end]
+    return fields
+
+
+def require(fields, tag, size=None):
+    value = fields.get(tag)
+    if value is None or (size is not None and len(value) != size):
+        raise RoughtimeError(f"缺少或无效的 {tag.decode('ascii', 'replace').strip(chr(0) + chr(255))}")
+    return value
+
+
+def leaf_hash(nonce):
+    return hashlib.sha512(b"\x00" + nonce).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha512(b"\x01" + left + right).digest()
+
+
+def make_request(nonce):
+    """带随机数的请求，填充到 REQUEST_SIZE 字节"""
+    padding = REQUEST_SIZE - len(encode_message({b"NONC": nonce, b"PAD\xff": b""}))
+    return encode_message({b"NONC": nonce, b"PAD\xff": b"\0" * padding})
+
+
+def verify_response(data, nonce, public_key):
+    """验证回复，返回 (MIDP微秒, RADI微秒)"""
+    check_available()
+    fields = decode_message(data)
+    signature = require(fields, b"SIG\x00", 64)
+    srep_bytes = require(fields, b"SREP")
+    cert = decode_message(require(fields, b"CERT"))
+    dele_bytes = require(cert, b"DELE")
+    dele = decode_message(dele_bytes)
+    srep = decode_message(srep_bytes)
+    try:
+        Ed25519PublicKey.from_public_bytes(public_key).verify(
+            require(cert, b"SIG\x00", 64), DELEGATION_CONTEXT + dele_bytes)
+        Ed25519PublicKey.from_public_bytes(require(dele, b"PUBK", 32)).verify(
+            signature, RESPONSE_CONTEXT + srep_bytes)
+    except InvalidSignature:
+        raise RoughtimeError("签名验证失败")
+    # 沿Merkle路径从本次随机数算到树根
+    index = struct.unpack("<I", require(fields, b"INDX", 4))[0]
+    path = require(fields, b"PATH")
+    if len(path) % HASH_SIZE:
+        raise RoughtimeError("PATH 长度无效")
+    digest = leaf_hash(nonce)
+    for i in range(0, len(path), HASH_SIZE):
+        sibling = path[i:i + HASH_SIZE]
+        digest = node_hash(sibling, digest) if index & 1 else node_hash(digest, sibling)
+        index >>= 1
+    if digest != require(srep, b"ROOT", HASH_SIZE):
+        raise RoughtimeError("回复与本次请求不匹配")
+    midpoint = struct.unpack("<Q", require(srep, b"MIDP", 8))[0]
+    radius = struct.unpack("<I", require(srep, b"RADI", 4))[0]
+    min_time = struct.unpack("<Q", require(dele, b"MINT", 8))[0]
+    max_time = struct.unpack("<Q", require(dele, b"MAXT", 8))[0]
+    if not min_time <= midpoint <= max_time:
+        raise RoughtimeError("时间不在临时密钥的有效期内")
+    return midpoint, radius
+
+
+def parse_roughtime_server(server):
+    """roughtime://host[:port]/base64公钥 -> (host, port, 公钥32字节)"""
+    address, _, key = server[len(ROUGHTIME_SCHEME):].partition("/")
+    if address.startswith("["):
+        host, _, rest = address[1:].partition("]")
+        port = int(rest[1:]) if rest.startswith(":") else ROUGHTIME_PORT
+    elif address.count(":") == 1:
+        host, port = address.split(":")
+        port = int(port)
+    else:
+        host, port = address, ROUGHTIME_PORT
+    try:
+        public_key = base64.b64decode(key, validate=True)
+    except ValueError:
+        public_key = b""
+    if len(public_key) != 32:
+        raise RoughtimeError("Roughtime服务器需要写明长期公钥: roughtime://主机[:端口]/base64公钥")
+    return host, port, public_key
+
+
+# Roughtime时间源
+class RoughtimeSource(TimeSource):
+    name = "roughtime"
+    fallback = True
+
+    def matches(self, server):
+        return server.startswith(ROUGHTIME_SCHEME)
+
+    def query(self, server, timeout, cancel=None):
+        check_available()
+        host, port, public_key = parse_roughtime_server(server)
+        family, _, _, _, address = socket.getaddrinfo(host, port, 0, socket.SOCK_DGRAM)[0]
+        nonce = os.urandom(NONCE_SIZE)
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            deadline = time.monotonic() + timeout
+            t1 = time.time()
+            sock.sendto(make_request(nonce), address)
+            while True:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    raise socket.timeout("timed out")
+                watched = [sock] + ([cancel] if cancel is not None else [])
+                readable, _, _ = select.select(watched, [], [], wait)
+                if cancel is not None and cancel.cancelled:
+                    raise Cancelled("操作已取消")
+                if sock not in readable:
+                    continue
+                data, sender = sock.recvfrom(65536)
+                t4 = time.time()
+                if sender[:2] != address[:2]:
+                    continue
+                try:
+                    midpoint, radius = verify_response(data, nonce, public_key)
+                except RoughtimeError as e:
+                    # 伪造或迟到的回复：继续等待本次请求的回复
+                    logging.getLogger("Roughtime").debug(f"丢弃 {host} 的回复: {e}")
+                    continue
+                break
+        finally:
+            sock.close()
+        offset = midpoint / 1e6 - (t1 + t4) / 2
+        return SourceResponse(self.name, address[0], offset, t4 - t1, radius / 1e6, ROUGHTIME_STRATUM, t1, t4)
+
+
+# 本地Roughtime替身服务端：每个请求单独签名（Merkle树只有一个叶子），时间按本机时间加offset秒给出
+class RoughtimeServer:
+    def __init__(self, host="127.0.0.1", port=0, private_key=None, offset=0.0, radius=DEFAULT_RADIUS):
+        check_available()
+        self.long_term_key = private_key or Ed25519PrivateKey.generate()
+        self.offset = offset
+        self.radius = radius
+        self.sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.address = self.sock.getsockname()
+        self.delegate()
+        self.running = False
+        self.thread = None
+        self.stats = {'requests': 0, 'malformed': 0}
+        self.logger = logging.getLogger("RoughtimeServer")
+
+    @property
+    def public_key(self):
+        """长期公钥（base64），写在客户端的服务器地址里"""
+        raw = self.long_term_key.public_key().public_bytes(serialization.Encoding.Raw,
+                                                            serialization.PublicFormat.Raw)
+        return base64.b64encode(raw).decode("ascii")
+
+    @property
+    def url(self):
+        return f"{ROUGHTIME_SCHEME}{self.address[0]}:{self.address[1]}/{self.public_key}"
+
+    def delegate(self):
+        """生成临时密钥并用长期密钥签发"""
+        self.online_key = Ed25519PrivateKey.generate()
+        now = int((time.time() + self.offset) * 1e6)
+        dele = encode_message({
+            b"MINT": struct.pack("<Q", now - DELEGATION_LIFETIME * 1000000),
+            b"MAXT": struct.pack("<Q", now + DELEGATION_LIFETIME * 1000000),
+            b"PUBK": self.online_key.public_key().public_bytes(serialization.Encoding.Raw,
+                                                               serialization.PublicFormat.Raw),
+        })
+        self.cert = encode_message({b"SIG\x00": self.long_term_key.sign(DELEGATION_CONTEXT + dele),
+                                    b"DELE": dele})
+
+    def handle(self, data):
+        nonce = require(decode_message(data), b"NONC", NONCE_SIZE)
+        srep = encode_message({
+            b"ROOT": leaf_hash(nonce),
+            b"MIDP": struct.pack("<Q", int((time.time() + self.offset) * 1e6)),
+            b"RADI": struct.pack("<I", self.radius),
+        })
+        return encode_message({
+            b"SIG\x00": self.online_key.sign(RESPONSE_CONTEXT + srep),
+            b"PATH": b"",
+            b"SREP": srep,
+            b"CERT": self.cert,
+            b"INDX": struct.pack("<I", 0),
+        })
+
+    def serve_forever(self, poll_interval=0.5):
+        while self.running:
+            readable, _, _ = select.select([self.sock], [], [], poll_interval)
+            if not readable:
+                continue
+            try:
+                data, addr = self.sock.recvfrom(65536)
+            except OSError:
+                continue
+            # 不回复小于请求最小长度的报文，避免放大
+            if len(data) < REQUEST_SIZE:
+                self.stats['malformed'] += 1
+                continue
+            try:
+                reply = self.handle(data)
+            except (RoughtimeError, struct.error):
+                self.stats['malformed'] += 1
+                continue
+            self.stats['requests'] += 1
+            self.sock.sendto(reply, addr)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.serve_forever, name="RoughtimeServer", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=2.0):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.sock.close()
@@ -0,0 +1,221 @@
+"""
+pool.ntp.org 类服务器池的管理
+
+池域名每次解析只返回少量随机后端，直接当作一个服务器使用时每次同步只能碰到一个随机后端。
+这里反复解析池域名，积累不同的后端地址作为候选，定期测量各候选的延迟和抖动并排序，
+保持质量最好的k个为活动服务器，在后台线程中用更好的候选替换表现差的活动服务器。
+同步时池域名被展开为这些活动服务器，不需要在配置中额外增加条目。
+刷新测量与同步查询共用 ntp_client.poll_gate，刚测量过的后端在最小查询间隔内由同步直接使用这次测量（recent_response），
+不会因被拦下而跳过。
+"""
+import copy
+import time
+import socket
+import logging
+import threading
+from collections import deque
+
+import ntp_client
+
+# 连续失败多少次后不再作为活动服务器
+MAX_FAILURES = 3
+# 每个候选保留的测量样本数
+SAMPLE_WINDOW = 8
+
+
+def is_pool_hostname(server):
+    """pool.ntp.org 及其子域名（如 cn.pool.ntp.org）；带协议前缀的写法（nts://、https:// 等）不展开"""
+    if "://" in server:
+        return False
+    host = server.rstrip(".").lower()
+    return host == "pool.ntp.org" or host.endswith(".pool.ntp.org")
+
+
+# 池中的一个后端地址
+class Candidate:
+    def __init__(self, address, hostname):
+        self.address = address
+        self.hostname = hostname
+        self.samples = deque(maxlen=SAMPLE_WINDOW)  # (delay, offset)
+        self.failures = 0
+        self.last_probe = 0.0
+        # 最近一次成功的测量及其墙上时间，供同步在最小查询间隔内直接使用
+        self.last_response = None
+        self.last_wall = 0.0
+
+    def record(self, response):
+        self.samples.append((response.delay, response.offset))
+        self.failures = 0
+        self.last_probe = time.monotonic()
+        self.last_response = response
+        self.last_wall = time.time()
+
+    def recent(self, max_age):
+        """不超过max_age秒的上一次测量，换算到现在的系统时钟上（期间时钟被调整过的部分从偏移中扣除）；没有时返回None"""
+        if self.last_response is None or self.failures:
+            return None
+        age = time.monotonic() - self.last_probe
+        if age > max_age:
+            return None
+        stepped = (time.time() - self.last_wall) - age
+        response = copy.copy(self.last_response)
+        response.offset -= stepped
+        response.tx_time += age + stepped
+        return response
+
+    def record_failure(self):
+        self.failures += 1
+        self.last_probe = time.monotonic()
+
+    def score(self):
+        """质量分（秒，越小越好）：最小延迟 + 偏移抖动 + 失败惩罚；没有样本或连续失败过多时为无穷大"""
+        if not self.samples or self.failures >= MAX_FAILURES:
+            return float('inf')
+        delays = [d for d, _ in self.samples]
+        offsets = [o for _, o in self.samples]
+        mean = sum(offsets) / len(offsets)
+        jitter = (sum((o - mean) ** 2 for o in offsets) / len(offsets)) ** 0.5
+        return min(delays) + jitter + 0.1 * self.failures
+
+
+# 单个池域名
+class ServerPool:
+    def __init__(self, hostname, active_count=4, max_candidates=16, timeout=3, query=None):
+        self.hostname = hostname
+        self.active_count = active_count
+        self.max_candidates = max_candidates
+        self.timeout = timeout
+        self.query = query or ntp_client.query
+        self.candidates = {}
+        self.active = []
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("ServerPool")
+
+    def resolve(self, rounds=3):
+        """多次解析池域名收集不同的后端，候选已满时淘汰最差的非活动候选"""
+        found = 0
+        for _ in range(rounds):
+            try:
+                infos = socket.getaddrinfo(self.hostname, 123, 0, socket.SOCK_DGRAM)
+            except socket.gaierror:
+                break
+            for info in infos:
+                address = info[4][0]
+                with self.lock:
+                    if address in self.candidates:
+                        continue
+                    if len(self.candidates) >= self.max_candidates and not self.evict_worst():
+                        continue
+                    self.candidates[address] = Candidate(address, self.hostname)
+                    found += 1
+        return found
+
+    def evict_worst(self):
+        inactive = [c for c in self.candidates.values() if c.address not in self.active and c.samples]
+        if not inactive:
+            return False
+        worst = max(inactive, key=lambda c: c.score())
+        del self.candidates[worst.address]
+        return True
+
+    def probe(self, candidate):
+        try:
+            candidate.record(self.query(candidate.address, timeout=self.timeout))
+        except ntp_client.PollDeferred:
+            # 刚被同步查询过：这次不测量，不算失败；因KoD被暂停的后端照常计为失败，以便被替换
+            if ntp_client.poll_gate.blocked(candidate.address):
+                candidate.record_failure()
+        except Exception:
+            candidate.record_failure()
+
+    def refresh(self):
+        """解析、测量所有候选并重新选出活动服务器"""
+        self.resolve()
+        with self.lock:
+            candidates = list(self.candidates.values())
+        for candidate in candidates:
+            self.probe(candidate)
+        with self.lock:
+            ranked = sorted(self.candidates.values(), key=lambda c: c.score())
+            active = [c.address for c in ranked if c.score() != float('inf')][:self.active_count]
+            replaced = set(self.active) - set(active)
+            self.active = active
+        if replaced:
+            self.logger.info(f"{self.hostname}: 替换表现差的后端 {sorted(replaced)}，当前活动 {active}")
+        return active
+
+    def active_servers(self):
+        with self.lock:
+            return list(self.active)
+
+    def recent_response(self, address, max_age):
+        with self.lock:
+            candidate = self.candidates.get(address)
+            return candidate.recent(max_age) if candidate is not None else None
+
+
+# 管理配置中出现的所有池域名，后台定期刷新
+class PoolManager:
+    def __init__(self, refresh_interval=600, active_count=4):
+        self.refresh_interval = refresh_interval
+        self.active_count = active_count
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = None
+
+    def expand(self, servers):
+        """把服务器列表中的池域名展开为当前活动的后端地址；尚未测量完成时保留域名本身"""
+        expanded = []
+        for server in servers:
+            if not is_pool_hostname(server):
+                expanded.append(server)
+                continue
+            pool = self.track(server)
+            active = pool.active_servers()
+            expanded.extend(a for a in (active or [server]) if a not in expanded)
+        return expanded
+
+    def recent_response(self, address, max_age=ntp_client.MIN_POLL_INTERVAL):
+        """刷新时刚测量过该后端时返回那次测量（见 Candidate.recent），否则返回None"""
+        with self.lock:
+            pools = list(self.pools.values())
+        for pool in pools:
+            response = pool.recent_response(address, max_age)
+            if response is not None:
+                return response
+        return None
+
+    def track(self, hostname):
+        with self.lock:
+            pool = self.pools.get(hostname)
+            if pool is None:
+                pool = self.pools[hostname] = ServerPool(hostname, self.active_count)
+                self.start()
+                self.wakeup.set()
+            return pool
+
+    def start(self):
+        if self.thread is None and not self.stopped:
+            self.thread = threading.Thread(target=self.run, name="PoolManager", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stopped:
+            with self.lock:
+                pools = list(self.pools.values())
+            for pool in pools:
+                if self.stopped:
+                    break
+                pool.refresh()
+            self.wakeup.wait(self.refresh_interval)
+            self.wakeup.clear()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+
+# 进程内共享的池管理器
+pool_manager = PoolManager()
@@ -0,0 +1,265 @@
+"""
+机群时钟偏移普查：并发查询大量主机的NTP服务，批量计算各主机的时钟偏移和网络延迟
+
+所有请求通过少量非阻塞UDP socket发出，在途请求数有上限；请求的发送时间戳字段填入随机数，
+用来把回复对应到目标主机。偏移和延迟在收齐后按数组批量计算（安装了NumPy时向量化），
+目标很多时按块分给多个进程并行查询。
+
+用法: python survey.py hosts.txt [--csv report.csv] [--timeout 2] [--max-in-flight 1000]
+"""
+import os
+import csv
+import sys
+import time
+import random
+import socket
+import select
+import struct
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ntp_packet import (NTP_PORT, NTP_PACKET_SIZE, MODE_CLIENT, MODE_SERVER, LEAP_ALARM,
+                        NTPPacket, system_to_ntp)
+
+TIMESTAMP = struct.Struct("!Q")
+# 请求报文前40字节固定不变，只有最后8字节的发送时间戳（随机数）逐个填写
+REQUEST_PREFIX = NTPPacket(version=4, mode=MODE_CLIENT).pack()[:40]
+# 每个进程至少分到多少个目标才值得启用多进程
+TARGETS_PER_PROCESS = 2500
+
+
+def parse_target(line):
+    """解析一行目标：host、host:port、[ipv6]:port 或 ipv6"""
+    line = line.strip()
+    if line.startswith("["):
+        host, _, rest = line[1:].partition("]")
+        return host, int(rest[1:]) if rest.startswith(":") else NTP_PORT
+    if line.count(":") == 1:
+        host, port = line.split(":")
+        return host, int(port)
+    return line, NTP_PORT
+
+
+def load_targets(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [parse_target(line) for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+def resolve_targets(targets, workers=64):
+    """并发解析主机名，返回 [(family, sockaddr) 或 None, ...] 和对应的错误信息"""
+    def resolve(target):
+        host, port = target
+        try:
+            family, _, _, _, sockaddr = socket.getaddrinfo(host, port, 0, socket.SOCK_DGRAM)[0]
+            return (family, sockaddr[:2]), None
+        except (socket.gaierror, UnicodeError) as e:
+            return None, f"DNS解析失败: {e}"
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        resolved = list(executor.map(resolve, targets))
+    return [r[0] for r in resolved], [r[1] for r in resolved]
+
+
+def probe(addresses, timeout=2.0, max_in_flight=1000, retries=1):
+    """
+    向所有地址并发发送NTP请求
+    返回每个目标的原始时间戳 (t1, t2, t3, t4)（64位NTP整数，未收到回复时为None）、stratum和错误信息
+    """
+    count = len(addresses)
+    stamps = [None] * count
+    strata = [0] * count
+    errors = [None if addr else "DNS解析失败" for addr in addresses]
+    sockets = {}
+    for addr in addresses:
+        if addr and addr[0] not in sockets:
+            sock = socket.socket(addr[0], socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            sock.setblocking(False)
+            sockets[addr[0]] = sock
+
+    queue = deque((i, 0) for i, addr in enumerate(addresses) if addr)
+    pending = {}        # nonce -> (index, t1, attempt)
+    deadlines = deque() # (deadline, nonce)，按发送顺序排列，超时时间相同所以天然有序
+    buf = bytearray(1024)
+    getrandbits = random.getrandbits
+
+    while queue or pending:
+        # 补满在途窗口
+        while queue and len(pending) < max_in_flight:
+            index, attempt = queue.popleft()
+            family, sockaddr = addresses[index]
+            nonce = getrandbits(64)
+            t1 = time.time()
+            try:
+                sockets[family].sendto(REQUEST_PREFIX + TIMESTAMP.pack(nonce), sockaddr)
+            except BlockingIOError:
+                queue.appendleft((index, attempt))
+                break
+            except OSError as e:
+                errors[index] = f"发送失败: {e}"
+                continue
+            pending[nonce] = (index, system_to_ntp(t1), attempt)
+            deadlines.append((time.monotonic() + timeout, nonce))
+
+        wait = max(0.0, deadlines[0][0] - time.monotonic()) if deadlines else 0.0
+        readable, _, _ = select.select(list(sockets.values()), [], [], min(wait, 0.05))
+        for sock in readable:
+            while True:
+                try:
+                    nbytes, sender = sock.recvfrom_into(buf)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    continue
+                t4 = system_to_ntp(time.time())
+                if nbytes < NTP_PACKET_SIZE or buf[0] & 0x7 != MODE_SERVER:
+                    continue
+                nonce = TIMESTAMP.unpack_from(buf, 24)[0]
+                entry = pending.get(nonce)
+                # 只接受来自目标地址本身的回复
+                if entry is None or sender[:2] != addresses[entry[0]][1]:
+                    continue
+                del pending[nonce]
+                index = entry[0]
+                packet = NTPPacket.unpack(buf)
+                strata[index] = packet.stratum
+                if packet.is_kod:
+                    errors[index] = f"Kiss-o'-Death: {packet.kiss_code}"
+                elif packet.leap == LEAP_ALARM:
+                    errors[index] = "服务器时钟未同步"
+                else:
+                    stamps[index] = (entry[1], packet.recv_timestamp, packet.tx_timestamp, t4)
+                    errors[index] = None
+
+        # 处理超时：重试或记为失败
+        now = time.monotonic()
+        while deadlines and deadlines[0][0] <= now:
+            _, nonce = deadlines.popleft()
+            entry = pending.pop(nonce, None)
+            if entry is None:
+                continue
+            index, _, attempt = entry
+            if attempt < retries:
+                queue.append((index, attempt + 1))
+            else:
+                errors[index] = f"连接超时 ({timeout}秒)"
+
+    for sock in sockets.values():
+        sock.close()
+    return stamps, strata, errors
+
+
+def compute_offsets(t1, t2, t3, t4):
+    """
+    按数组批量计算偏移和往返延迟（秒）
+    输入为64位NTP时间戳整数序列；先在整数域做差（按2^64回绕），避免大数浮点相减损失精度
+    """
+    if np is not None:
+        t1, t2, t3, t4 = (np.asarray(t, dtype=np.uint64) for t in (t1, t2, t3, t4))
+        scale = 1.0 / 4294967296.0
+        a = (t2 - t1).view(np.int64) * scale
+        b = (t3 - t4).view(np.int64) * scale
+        rtt = (t4 - t1).view(np.int64) * scale - (t3 - t2).view(np.int64) * scale
+        return (a + b) / 2.0, rtt
+
+    def diff(x, y):
+        d = (x - y) & 0xFFFFFFFFFFFFFFFF
+        return (d - (1 << 64) if d >= (1 << 63) else d) / 4294967296.0
+
+    offsets = [(diff(b, a) + diff(c, d)) / 2.0 for a, b, c, d in zip(t1, t2, t3, t4)]
+    delays = [diff(d, a) - diff(c, b) for a, b, c, d in zip(t1, t2, t3, t4)]
+    return offsets, delays
+
+
+def survey_chunk(targets, timeout, max_in_flight, retries):
+    """单个进程内完成解析和查询，返回原始结果（便于跨进程传递）"""
+    addresses, dns_errors = resolve_targets(targets)
+    stamps, strata, errors = probe(addresses, timeout, max_in_flight, retries)
+    return [(stamps[i], strata[i], dns_errors[i] or errors[i]) for i in range(len(targets))]
+
+
+def survey(targets, timeout=2.0, max_in_flight=1000, retries=1, processes=None):
+    """
+    普查所有目标，返回按偏移绝对值从大到小排序的结果行
+    每行: {'host', 'port', 'offset', 'delay', 'stratum', 'error'}（偏移和延迟单位为毫秒）
+    """
+    if processes is None:
+        processes = min(os.cpu_count() or 1, max(1, len(targets) // TARGETS_PER_PROCESS))
+    if processes > 1:
+        size = -(-len(targets) // processes)
+        chunks = [targets[i:i + size] for i in range(0, len(targets), size)]
+        # 在途上限按进程平分，整体上限不变
+        per_process = max(1, max_in_flight // len(chunks))
+        with multiprocessing.Pool(len(chunks)) as pool:
+            parts = pool.starmap(survey_chunk, [(c, timeout, per_process, retries) for c in chunks])
+        raw = [row for part in parts for row in part]
+    else:
+        raw = survey_chunk(targets, timeout, max_in_flight, retries)
+
+    answered = [i for i, (stamps, _, _) in enumerate(raw) if stamps]
+    offsets, delays = compute_offsets(*zip(*(raw[i][0] for i in answered))) if answered else ([], [])
+    rows = [{'host': host, 'port': port, 'offset': None, 'delay': None,
+             'stratum': stratum, 'error': error}
+            for (host, port), (_, stratum, error) in zip(targets, raw)]
+    for i, offset, delay in zip(answered, offsets, delays):
+        rows[i]['offset'] = float(offset) * 1000
+        rows[i]['delay'] = float(delay) * 1000
+    rows.sort(key=lambda r: (r['offset'] is None, -abs(r['offset'] or 0.0)))
+    return rows
+
+
+def write_csv(rows, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["host", "port", "offset_ms", "delay_ms", "stratum", "error"])
+        for r in rows:
+            writer.writerow([r['host'], r['port'],
+                             "" if r['offset'] is None else f"{r['offset']:.3f}",
+                             "" if r['delay'] is None else f"{r['delay']:.3f}",
+                             r['stratum'], r['error'] or ""])
+
+
+def format_report(rows, limit=50):
+    ok = [r for r in rows if r['offset'] is not None]
+    lines = [f"共 {len(rows)} 台主机，成功 {len(ok)} 台，失败 {len(rows) - len(ok)} 台"]
+    lines.append(f"{'主机':<40} {'偏移(ms)':>12} {'延迟(ms)':>10} {'层级':>4}")
+    for r in ok[:limit]:
+        lines.append(f"{r['host'] + ':' + str(r['port']):<40} {r['offset']:>12.3f} {r['delay']:>10.3f} {r['stratum']:>4}")
+    if len(ok) > limit:
+        lines.append(f"... 其余 {len(ok) - limit} 台主机见CSV报告")
+    for r in rows[len(ok):][:limit]:
+        lines.append(f"{r['host'] + ':' + str(r['port']):<40} 失败: {r['error']}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="机群时钟偏移普查")
+    parser.add_argument("targets", help="目标列表文件，每行一个 host 或 host:port")
+    parser.add_argument("--csv", help="把完整结果写入CSV文件")
+    parser.add_argument("--timeout", type=float, default=2.0, help="单次请求超时（秒）")
+    parser.add_argument("--retries", type=int, default=1, help="超时后的重试次数")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="同时在途的最大请求数")
+    parser.add_argument("--processes", type=int, help="并行进程数（默认按目标数量自动决定）")
+    args = parser.parse_args(argv)
+
+    targets = load_targets(args.targets)
+    start = time.monotonic()
+    rows = survey(targets, args.timeout, args.max_in_flight, args.retries, args.processes)
+    elapsed = time.monotonic() - start
+    print(format_report(rows))
+    print(f"耗时 {elapsed:.2f} 秒")
+    if args.csv:
+        write_csv(rows, args.csv)
+        print(f"完整结果已写入 {args.csv}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
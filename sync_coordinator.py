@@ -0,0 +1,72 @@
+"""
+同步协调器：同一时间最多只有一次真正访问网络的同步
+
+同步进行中再次请求时并入当前同步，所有请求方得到同一个结果；
+距上次成功的同步不足 min_spacing 秒时直接返回上次的结果，不再访问网络；失败的同步不计入，下一次请求会重新同步。
+结果为 perform_sync 返回的 (success, message, server, delay)。
+这样自动同步、手动同步、托盘定时和事件触发的同步不会同时查询服务器、抢着设置时钟。
+"""
+import time
+import logging
+import threading
+from concurrent.futures import Future
+
+# 两次访问网络的同步之间的最小间隔（秒）
+MIN_SYNC_SPACING = 10.0
+
+
+class SyncCoordinator:
+    def __init__(self, min_spacing=MIN_SYNC_SPACING, logger=None):
+        self.min_spacing = min_spacing
+        self.logger = logger or logging.getLogger("SyncCoordinator")
+        self.lock = threading.Lock()
+        self.current = None
+        self.last_result = None
+        self.last_finished = None
+
+    def submit(self, launch, force=False):
+        """
+        请求一次同步，返回 concurrent.futures.Future
+
+        需要真正同步时调用 launch() 启动（可以在后台运行），完成后必须调用 finish()；
+        force为True时忽略最小间隔（例如检测到时钟跳变，上次的结果已经失效）
+        """
+        with self.lock:
+            if self.current is not None:
+                self.logger.info("同步正在进行中，本次请求并入当前同步")
+                return self.current
+            if not force and self.last_finished is not None:
+                age = time.monotonic() - self.last_finished
+                if age < self.min_spacing:
+                    self.logger.info(f"距上次同步仅 {age:.1f} 秒，直接使用上次的结果")
+                    future = Future()
+                    future.set_result(self.last_result)
+                    return future
+            future = self.current = Future()
+        try:
+            launch()
+        except BaseException as e:
+            self.finish(error=e)
+        return future
+
+    def finish(self, result=None, error=None, remember=None):
+        """结束当前同步，通知所有请求方；remember默认只在同步成功时为True，为False时不作为最小间隔的依据"""
+        if remember is None:
+            remember = bool(result and result[0])
+        with self.lock:
+            future, self.current = self.current, None
+            if error is None and remember:
+                self.last_result = result
+                self.last_finished = time.monotonic()
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run(self, func, force=False):
+        """阻塞版本：在调用线程中执行 func()（或等待进行中的同步）并返回结果"""
+        def launch():
+            self.finish(func())
+        return self.submit(launch, force).result()
@@ -0,0 +1,81 @@
+"""
+同步时刻的安排：启动后的首次同步和之后的定时同步都加入随机或按主机分散的偏移
+
+大量机器同时启动（例如停电恢复）时，如果都在启动后1秒、之后每整小时同步，会在同一秒涌向同样几个服务器，
+大量请求超时甚至被限速。这里首次同步延迟一个随机时间，定时同步的间隔加入随机抖动；
+启用按主机分散时，改用由主机名和机器ID算出的固定槽位：各主机均匀分布在整个间隔内，且每台主机的时刻稳定可预期。
+"""
+import time
+import uuid
+import random
+import socket
+import hashlib
+
+# 首次同步前至少等待的时间（秒），让界面和网络先就绪
+MIN_START_DELAY = 1.0
+# 无界面和托盘模式下首次同步的默认随机延迟上限（秒）
+DEFAULT_START_DELAY = 30.0
+# 定时同步间隔的默认随机抖动比例（±10%）
+DEFAULT_POLL_JITTER = 0.1
+# 两次定时同步之间的最短间隔（秒），避免按槽位对齐时刚同步完又立即同步
+MIN_POLL_DELAY = 5.0
+
+
+def machine_id():
+    """尽量稳定的本机标识：Linux的machine-id，其他平台取网卡MAC地址"""
+    for path in ("/etc/machine-id", "/var/lib/dbus/machine-id"):
+        try:
+            with open(path, "r", encoding="ascii") as f:
+                value = f.read().strip()
+            if value:
+                return value
+        except OSError:
+            pass
+    return f"{uuid.getnode():012x}"
+
+
+def host_fraction(host=None):
+    """由主机名和机器ID散列得到 [0, 1) 内的固定值，同一主机每次相同，不同主机均匀分布"""
+    key = f"{host or socket.gethostname()}|{machine_id()}".encode("utf-8")
+    return int.from_bytes(hashlib.sha256(key).digest()[:8], "big") / 2 ** 64
+
+
+# 同步时刻安排
+class SyncSchedule:
+    def __init__(self, interval, start_delay=DEFAULT_START_DELAY, jitter=DEFAULT_POLL_JITTER,
+                 spread=False, host=None):
+        self.interval = interval
+        self.start_delay = start_delay
+        self.jitter = jitter
+        self.spread = spread
+        self.fraction = host_fraction(host) if spread else None
+        self.random = random.Random()
+
+    def first_delay(self):
+        """启动后到首次同步的秒数"""
+        if self.spread:
+            return MIN_START_DELAY + self.fraction * self.start_delay
+        return MIN_START_DELAY + self.random.uniform(0.0, self.start_delay)
+
+    def next_delay(self, now=None):
+        """从现在到下一次定时同步的秒数"""
+        if self.jitter:
+            wobble = self.random.uniform(-self.jitter, self.jitter) * self.interval
+        else:
+            wobble = 0.0
+        if not self.spread:
+            return max(MIN_POLL_DELAY, self.interval + wobble)
+        # 对齐到本主机在每个间隔内的固定槽位（按墙上时钟，各主机互不协调也能错开）
+        if now is None:
+            now = time.time()
+        slot = self.fraction * self.interval
+        delay = (slot - now) % self.interval
+        if delay < MIN_POLL_DELAY:
+            delay += self.interval
+        return max(MIN_POLL_DELAY, delay + wobble)
+
+    def describe(self):
+        if self.spread:
+            slot = self.fraction * self.interval
+            return f"每 {self.interval:.0f} 秒同步一次，本机槽位 +{slot:.0f} 秒（抖动 ±{self.jitter:.0%}）"
+        return f"每 {self.interval:.0f} 秒同步一次（抖动 ±{self.jitter:.0%}）"
@@ -0,0 +1,57 @@
+"""
+时钟跳变检测：本程序自己写入的调整（包括同一检测周期内的多次调整）不应被当作外部跳变
+
+在仓库根目录运行: python -m unittest discover tests
+"""
+import unittest
+
+from clock_events import ClockEventWatcher, CHECK_INTERVAL
+from discipline import ClockState
+
+
+# 假时钟：记录调整量，可以设定为失败
+class FakeClock:
+    def __init__(self, succeed=True):
+        self.succeed = succeed
+        self.steps = []
+
+    def apply_offset(self, offset):
+        self.steps.append(offset)
+        return self.succeed, ""
+
+
+class ClockJumpTest(unittest.TestCase):
+    def setUp(self):
+        self.state = ClockState()
+        self.watcher = ClockEventWatcher(lambda reason: None)
+
+    def samples(self, external=0.0):
+        """一个检测周期前后的采样：期间本程序的调整都已写入墙上时间，另有external秒的外部跳变"""
+        before = (1000.0, 50.0, None, 0.0)
+        wall_change = CHECK_INTERVAL + external + sum(self.clock.steps if self.clock.succeed else [])
+        after = (before[0] + wall_change, before[1] + CHECK_INTERVAL, None, self.state.stepped_total)
+        return before, after
+
+    def test_step_and_correction_in_one_window(self):
+        self.clock = FakeClock()
+        self.state.step(self.clock, 30.0)
+        self.state.step(self.clock, 0.2)
+        self.assertAlmostEqual(self.state.stepped_total, 30.2)
+        self.assertIsNone(self.watcher.check_clock(*self.samples()))
+
+    def test_external_jump_is_still_reported(self):
+        self.clock = FakeClock()
+        self.state.step(self.clock, 30.0)
+        reason = self.watcher.check_clock(*self.samples(external=-10.0))
+        self.assertIn("-10.0", reason)
+
+    def test_failed_step_is_not_counted(self):
+        self.clock = FakeClock(succeed=False)
+        applied, _ = self.state.step(self.clock, 30.0)
+        self.assertFalse(applied)
+        self.assertEqual(self.state.stepped_total, 0.0)
+        self.assertIsNone(self.watcher.check_clock(*self.samples()))
+
+
+if __name__ == "__main__":
+    unittest.main()
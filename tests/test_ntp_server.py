@@ -0,0 +1,116 @@
+"""
+NTP服务端（ntp_server.NTPServer）：不启动服务线程，直接调用serve_batch并检查回复的各个字段
+
+在仓库根目录运行: python -m unittest discover tests
+"""
+import select
+import socket
+import time
+import unittest
+
+from discipline import ClockState, STRATUM_UNSYNCED
+from ntp_packet import (NTPPacket, MODE_CLIENT, MODE_SERVER, LEAP_NONE, LEAP_ALARM, system_to_ntp,
+                        ntp_to_system)
+from ntp_server import NTPServer
+
+
+# 同步成功时的NTP回复（ClockState.update需要的字段）
+class Response:
+    offset = 0.0
+    delay = 0.01
+    stratum = 1
+    root_delay = 0.0
+    root_dispersion = 0.001
+
+
+class ServeBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.state = ClockState()
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.bind(("127.0.0.1", 0))
+        self.client.settimeout(1.0)
+        self.addCleanup(self.client.close)
+
+    def make_server(self, **kwargs):
+        server = NTPServer(host="127.0.0.1", port=0, state=self.state, **kwargs)
+        self.addCleanup(server.sock.close)
+        return server
+
+    def exchange(self, server, version=4, reply_expected=True):
+        """发出一个客户端请求，调用一次serve_batch，返回 (请求的发送时间戳, 解析后的回复或None)"""
+        tx = system_to_ntp(time.time())
+        self.client.sendto(NTPPacket(version=version, mode=MODE_CLIENT, poll=6, tx_timestamp=tx).pack(),
+                           server.address)
+        select.select([server.sock], [], [], 1.0)
+        server.serve_batch()
+        if not reply_expected:
+            self.assertEqual(select.select([self.client], [], [], 0.1)[0], [])
+            return tx, None
+        return tx, NTPPacket.unpack(self.client.recv(1024))
+
+    def test_basic_reply_fields(self):
+        server = self.make_server(rate_limit=False)
+        self.state.update("ntp.example.org", Response(), applied=True)
+        before = time.time()
+        tx, reply = self.exchange(server, version=3)
+        self.assertEqual(reply.mode, MODE_SERVER)
+        self.assertEqual(reply.version, 3)
+        self.assertEqual(reply.poll, 6)
+        # origin 回显客户端的发送时间戳，接收/发送时间戳取本机时间
+        self.assertEqual(reply.orig_timestamp, tx)
+        self.assertLessEqual(reply.recv_timestamp, reply.tx_timestamp)
+        self.assertAlmostEqual(ntp_to_system(reply.recv_timestamp), before, delta=0.5)
+        self.assertEqual(reply.leap, LEAP_NONE)
+        self.assertEqual(reply.stratum, 2)
+
+    def test_unsynced_reply_is_alarm(self):
+        server = self.make_server(rate_limit=False)
+        _, reply = self.exchange(server)
+        self.assertEqual(reply.leap, LEAP_ALARM)
+        self.assertEqual(reply.stratum, STRATUM_UNSYNCED)
+        self.assertEqual(reply.ref_timestamp, 0)
+
+    def test_template_follows_generation(self):
+        server = self.make_server(rate_limit=False)
+        _, reply = self.exchange(server)
+        self.assertEqual(reply.leap, LEAP_ALARM)
+        # 同步后generation变化，下一个回复立即使用新的模板（不等定时刷新）
+        self.state.update("ntp.example.org", Response(), applied=True)
+        _, reply = self.exchange(server)
+        self.assertEqual(reply.leap, LEAP_NONE)
+        self.assertEqual(reply.stratum, 2)
+        self.assertEqual(server.template_generation, self.state.generation)
+
+    def test_allowed_networks_deny(self):
+        server = self.make_server(allowed_networks=["10.0.0.0/8"], kod_interval=60.0)
+        tx, reply = self.exchange(server)
+        self.assertEqual((reply.stratum, reply.ref_id), (0, b"DENY"))
+        self.assertEqual(reply.orig_timestamp, tx)
+        # KoD本身限频：间隔内的请求静默丢弃
+        self.exchange(server, reply_expected=False)
+        self.assertEqual(server.stats['denied'], 2)
+        self.assertEqual(server.stats['kod_sent'], 1)
+
+    def test_rate_limit_kod(self):
+        server = self.make_server(burst=2, min_interval=60.0, kod_interval=0.0)
+        for _ in range(2):
+            _, reply = self.exchange(server)
+            self.assertNotEqual(reply.stratum, 0)
+        tx, reply = self.exchange(server)
+        self.assertEqual((reply.stratum, reply.ref_id), (0, b"RATE"))
+        self.assertEqual(reply.tx_timestamp, tx)
+        self.assertEqual(server.stats['rate_limited'], 1)
+
+    def test_malformed_requests_are_ignored(self):
+        server = self.make_server(rate_limit=False)
+        self.client.sendto(b"\x1b" + b"\0" * 10, server.address)
+        self.client.sendto(NTPPacket(mode=MODE_SERVER).pack(), server.address)
+        select.select([server.sock], [], [], 1.0)
+        time.sleep(0.05)
+        server.serve_batch()
+        self.assertEqual(server.stats['malformed'], 2)
+        self.assertEqual(select.select([self.client], [], [], 0.1)[0], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
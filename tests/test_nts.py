@@ -0,0 +1,123 @@
+"""
+NTS：AES-SIV（RFC 5297测试向量）、与本地替身服务端（nts.LocalNTSServer）的NTS-KE握手、
+经过认证的NTP交换、cookie的消耗与补充、cookie缓存文件，以及被篡改的回复
+
+在仓库根目录运行: python -m unittest discover tests
+"""
+import os
+import socket
+import tempfile
+import unittest
+
+import ntp_client
+import nts
+from test_stand_ins import FreshClientState
+
+
+class SIVTest(unittest.TestCase):
+    def test_rfc5297_vector(self):
+        key = bytes.fromhex("fffefdfcfbfaf9f8f7f6f5f4f3f2f1f0f0f1f2f3f4f5f6f7f8f9fafbfcfdfeff")
+        associated_data = bytes.fromhex("101112131415161718191a1b1c1d1e1f2021222324252627")
+        plaintext = bytes.fromhex("112233445566778899aabbccddee")
+        expected = bytes.fromhex("85632d07c6e8f37f950acd320a2ecc9340c02b9690c4dc04daef7f6afe5c")
+        self.assertEqual(nts.siv_encrypt(key, plaintext, [associated_data]), expected)
+        self.assertEqual(nts.siv_decrypt(key, expected, [associated_data]), plaintext)
+
+    def test_tampering_is_detected(self):
+        key = os.urandom(32)
+        # NTS客户端请求加密的内容通常为空
+        sealed = nts.siv_encrypt(key, b"", [b"header", b"nonce"])
+        self.assertEqual(nts.siv_decrypt(key, sealed, [b"header", b"nonce"]), b"")
+        with self.assertRaises(nts.NTSError):
+            nts.siv_decrypt(key, sealed, [b"headeR", b"nonce"])
+        with self.assertRaises(nts.NTSError):
+            nts.siv_decrypt(key, bytes([sealed[0] ^ 1]) + sealed[1:], [b"header", b"nonce"])
+
+
+# 可以篡改回复的替身服务端
+class TamperingServer(nts.LocalNTSServer):
+    tamper = None
+
+    def handle_ntp(self, data, addr):
+        reply = super().handle_ntp(data, addr)
+        return self.tamper(reply) if reply and self.tamper else reply
+
+
+@unittest.skipIf(nts.SSL is None, "需要 pyOpenSSL 和 cryptography")
+class NTSExchangeTest(FreshClientState):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        certfile, keyfile = os.path.join(directory.name, "cert.pem"), os.path.join(directory.name, "key.pem")
+        nts.make_self_signed_cert("127.0.0.1", certfile, keyfile)
+        self.certfile = certfile
+        self.store_path = os.path.join(directory.name, "nts_cookies.json")
+        self.server = TamperingServer(certfile, keyfile)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.url = f"{nts.NTS_SCHEME}127.0.0.1:{self.server.ke_address[1]}"
+        self.client = self.new_client()
+
+    def new_client(self):
+        return nts.NTSClient(store_path=self.store_path, timeout=2, cafile=self.certfile)
+
+    def test_handshake_and_authenticated_exchange(self):
+        response = self.client.query(self.url)
+        self.assertLess(abs(response.offset), 0.05)
+        self.assertEqual(self.server.stats['handshakes'], 1)
+        self.assertEqual(self.server.stats['requests'], 1)
+        # 用掉一个cookie，回复补回一个
+        self.assertEqual(len(self.client.sessions[self.url].cookies), nts.MAX_COOKIES)
+
+    def test_cookies_are_reused_and_refilled(self):
+        self.client.query(self.url)
+        session = self.client.sessions[self.url]
+        del session.cookies[1:]
+        self.client.query(self.url)
+        # 只剩一个cookie时请求里带上占位字段，回复把缓存补满，不需要重新握手
+        self.assertEqual(len(session.cookies), nts.MAX_COOKIES)
+        self.assertEqual(self.server.stats['handshakes'], 1)
+        self.assertEqual(self.server.stats['requests'], 2)
+
+    def test_cookie_cache_survives_restart(self):
+        self.client.query(self.url)
+        if os.name == 'posix':
+            self.assertEqual(os.stat(self.store_path).st_mode & 0o777, 0o600)
+        restarted = self.new_client()
+        self.assertEqual(len(restarted.sessions[self.url].cookies), nts.MAX_COOKIES)
+        restarted.query(self.url)
+        self.assertEqual(self.server.stats['handshakes'], 1)
+
+    def test_rejected_cookie_forces_new_handshake(self):
+        self.client.query(self.url)
+        self.client.sessions[self.url].c2s = os.urandom(nts.KEY_LENGTH)
+        with self.assertRaises(ntp_client.KissOfDeath):
+            self.client.query(self.url)
+        self.assertNotIn(self.url, self.client.sessions)
+        self.client.query(self.url)
+        self.assertEqual(self.server.stats['handshakes'], 2)
+
+    def assert_reply_dropped(self, tamper):
+        self.client.query(self.url)
+        self.server.tamper = tamper
+        with self.assertRaises(socket.timeout):
+            self.client.query(self.url, timeout=0.5)
+
+    def test_wrong_unique_id_is_dropped(self):
+        def swap_uid(reply):
+            fields = nts.parse_extensions(reply)
+            start = next(start for t, _, start in fields if t == nts.EF_UNIQUE_ID)
+            return reply[:start + 4] + os.urandom(32) + reply[start + 36:]
+        self.assert_reply_dropped(swap_uid)
+
+    def test_modified_authenticator_is_dropped(self):
+        self.assert_reply_dropped(lambda reply: reply[:-1] + bytes([reply[-1] ^ 1]))
+
+    def test_modified_header_is_dropped(self):
+        # 改动被认证的报文头（接收时间戳）
+        self.assert_reply_dropped(lambda reply: reply[:35] + bytes([reply[35] ^ 1]) + reply[36:])
+
+
+if __name__ == "__main__":
+    unittest.main()
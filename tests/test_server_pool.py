@@ -0,0 +1,41 @@
+"""
+服务器池：刷新测量过的后端在最小查询间隔内，同步直接使用那次测量而不是被poll_gate拦下
+
+在仓库根目录运行: python -m unittest discover tests
+"""
+import unittest
+
+import ntp_client
+from server_pool import Candidate, ServerPool, pool_manager
+from time_sources import NTPSource
+from test_stand_ins import FreshClientState
+
+
+class RefreshReuseTest(FreshClientState):
+    def setUp(self):
+        super().setUp()
+        ntp_client.poll_gate = ntp_client.PollGate()
+        self.server = self.start_server(rate_limit=False)
+        port = self.server.address[1]
+        self.pool = ServerPool("test.pool.ntp.org", timeout=2,
+                               query=lambda address, timeout: ntp_client.query(address, port=port, timeout=timeout))
+        self.pool.candidates["127.0.0.1"] = Candidate("127.0.0.1", self.pool.hostname)
+        pool_manager.pools[self.pool.hostname] = self.pool
+        self.addCleanup(pool_manager.pools.pop, self.pool.hostname)
+
+    def test_sync_reuses_refresh_measurement(self):
+        self.pool.probe(self.pool.candidates["127.0.0.1"])
+        self.assertEqual(self.server.stats['replied'], 1)
+        response = NTPSource(interleaved=False).query("127.0.0.1", timeout=2)
+        self.assertLess(abs(response.offset), 0.05)
+        # 没有再次发出请求
+        self.assertEqual(self.server.stats['replied'], 1)
+
+    def test_deferred_without_measurement(self):
+        ntp_client.poll_gate.acquire("127.0.0.2")
+        with self.assertRaises(ntp_client.PollDeferred):
+            NTPSource(interleaved=False).query("127.0.0.2", timeout=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
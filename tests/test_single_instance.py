@@ -0,0 +1,73 @@
+"""
+单实例转发：已有实例持有锁并监听时，第二次启动把命令转发给它后立即退出
+
+在仓库根目录运行: python -m unittest discover tests
+"""
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+try:
+    from PyQt5.QtCore import QCoreApplication, QDir, QLockFile
+except ImportError:
+    QCoreApplication = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 第二个实例：与运行中的实例使用同一个测试用标识，带 --sync 启动
+SECOND_INSTANCE = """
+import sys
+import main
+main.SINGLE_INSTANCE_KEY = sys.argv[1]
+sys.argv = ["main.py", "--sync"]
+main.main()
+"""
+
+
+@unittest.skipIf(QCoreApplication is None, "需要 PyQt5")
+class ForwardingTest(unittest.TestCase):
+    def setUp(self):
+        import main
+        self.app = QCoreApplication.instance() or QCoreApplication([])
+        self.key = f"TimeSyncTool-test-{os.getpid()}"
+        self.lock = QLockFile(os.path.join(QDir.tempPath(), self.key + ".lock"))
+        self.assertTrue(self.lock.tryLock(0))
+        self.addCleanup(self.lock.unlock)
+        self.server = main.SingleInstanceServer(key=self.key)
+        self.assertTrue(self.server.listen())
+        self.addCleanup(self.server.close)
+        self.received = []
+        self.server.command_received.connect(self.received.append)
+
+    def wait_for(self, condition, timeout=20.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            self.app.processEvents()
+            time.sleep(0.01)
+        return condition()
+
+    def test_second_instance_forwards_and_exits(self):
+        env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+        second = subprocess.Popen([sys.executable, "-c", SECOND_INSTANCE, self.key], cwd=ROOT, env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.addCleanup(second.kill)
+        self.assertTrue(self.wait_for(lambda: second.poll() is not None and self.received),
+                        f"第二个实例没有转发命令或没有退出: {self.received}")
+        self.assertEqual(self.received, ["sync"])
+        self.assertEqual(second.wait(), 0, second.stdout.read().decode("utf-8", "replace"))
+        second.stdout.close()
+
+    def test_unknown_command_is_ignored(self):
+        import main
+        main_key, main.SINGLE_INSTANCE_KEY = main.SINGLE_INSTANCE_KEY, self.key
+        self.addCleanup(setattr, main, "SINGLE_INSTANCE_KEY", main_key)
+        with self.assertLogs("TimeSyncApp", "WARNING"):
+            self.assertTrue(main.forward_to_running_instance("unknown"))
+            self.wait_for(lambda: False, timeout=0.5)
+        self.assertEqual(self.received, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
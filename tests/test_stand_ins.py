@@ -0,0 +1,160 @@
+"""
+在本机回环地址上运行各个替身服务端，检查对应客户端的行为：
+NTP交错模式和Kiss-o'-Death退避（ntp_server.NTPServer）、HTTP Date区间收敛（http_time.HTTPDateServer）、
+Roughtime签名和Merkle路径校验（roughtime.RoughtimeServer）
+
+在仓库根目录运行: python -m unittest discover tests
+"""
+import os
+import socket
+import time
+import struct
+import unittest
+
+import ntp_client
+import roughtime
+from discipline import ClockState
+from http_time import HTTPDateServer, HTTPDateSource
+from ntp_server import NTPServer
+
+
+# 每个用例使用新的查询节奏和交错状态，不受其他用例（以及进程内共享状态）的影响
+class FreshClientState(unittest.TestCase):
+    def setUp(self):
+        self.saved = ntp_client.poll_gate, ntp_client.interleaved_tracker
+        ntp_client.poll_gate = ntp_client.PollGate(min_interval=0.0)
+        ntp_client.interleaved_tracker = ntp_client.InterleavedTracker()
+
+    def tearDown(self):
+        ntp_client.poll_gate, ntp_client.interleaved_tracker = self.saved
+
+    def start_server(self, **kwargs):
+        state = ClockState()
+        state.synced, state.stratum = True, 2
+        server = NTPServer(host="127.0.0.1", port=0, state=state, **kwargs)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def query(self, server):
+        return ntp_client.query("127.0.0.1", port=server.address[1], version=4, timeout=2, interleaved=True)
+
+
+class InterleavedTest(FreshClientState):
+    def test_second_exchange_is_interleaved(self):
+        server = self.start_server(rate_limit=False)
+        first = self.query(server)
+        second = self.query(server)
+        self.assertFalse(first.interleaved)
+        self.assertTrue(second.interleaved)
+        self.assertEqual(server.stats['interleaved'], 1)
+        self.assertTrue(ntp_client.interleaved_tracker.supported("127.0.0.1"))
+        # 交错回复描述的是上一次交换，用的是服务端实际发出上一次回复的时间，延迟不会为负
+        self.assertGreaterEqual(second.delay, 0.0)
+        self.assertLess(abs(second.offset), 0.05)
+
+
+class KissOfDeathTest(FreshClientState):
+    def test_rate_backs_off_without_sending(self):
+        server = self.start_server(burst=1, min_interval=60.0, kod_interval=0.0)
+        self.query(server)
+        with self.assertRaises(ntp_client.KissOfDeath) as raised:
+            self.query(server)
+        self.assertEqual(raised.exception.code, "RATE")
+        self.assertGreater(ntp_client.poll_gate.blocked("127.0.0.1"), 0.0)
+        received = server.stats['received']
+        with self.assertRaises(ntp_client.PollDeferred):
+            self.query(server)
+        self.assertEqual(server.stats['received'], received)
+
+    def test_deny_blacklists_server(self):
+        server = self.start_server(allowed_networks=["10.0.0.0/8"])
+        with self.assertRaises(ntp_client.KissOfDeath) as raised:
+            self.query(server)
+        self.assertEqual(raised.exception.code, "DENY")
+        self.assertGreater(ntp_client.poll_gate.blocked("127.0.0.1"), ntp_client.RATE_BACKOFF)
+        with self.assertRaises(ntp_client.PollDeferred):
+            self.query(server)
+        self.assertEqual(server.stats['received'], 1)
+
+
+class HTTPDateTest(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPDateServer(offset=1.234)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.source = HTTPDateSource()
+        self.addCleanup(self.source.close)
+
+    def test_interval_narrows_around_offset(self):
+        response = self.source.query(self.server.url, 5)
+        # 只有整秒的Date头，多次请求后区间应远小于1秒且包含真实偏移
+        self.assertLess(response.root_dispersion, 0.25)
+        self.assertLessEqual(abs(response.offset - 1.234), response.root_dispersion + 0.002)
+        self.assertGreater(self.server.stats['requests'], 1)
+
+    def test_connection_is_reused(self):
+        self.source.query(self.server.url, 5)
+        self.source.query(self.server.url, 5)
+        self.assertEqual(self.server.stats['connections'], 1)
+
+
+@unittest.skipIf(roughtime.Ed25519PublicKey is None, "需要 cryptography")
+class RoughtimeTest(unittest.TestCase):
+    def setUp(self):
+        self.server = roughtime.RoughtimeServer(offset=-0.5)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.public_key = roughtime.parse_roughtime_server(self.server.url)[2]
+
+    def test_query_reports_offset(self):
+        response = roughtime.RoughtimeSource().query(self.server.url, 2)
+        self.assertAlmostEqual(response.offset, -0.5, delta=0.01)
+
+    def test_wrong_key_is_rejected(self):
+        other_server = roughtime.RoughtimeServer()
+        self.addCleanup(other_server.sock.close)
+        other = other_server.public_key
+        server = f"{roughtime.ROUGHTIME_SCHEME}{self.server.address[0]}:{self.server.address[1]}/{other}"
+        with self.assertRaises(socket.timeout):
+            roughtime.RoughtimeSource().query(server, 0.5)
+        other_key = roughtime.parse_roughtime_server(server)[2]
+        reply = self.server.handle(roughtime.make_request(os.urandom(roughtime.NONCE_SIZE)))
+        with self.assertRaisesRegex(roughtime.RoughtimeError, "签名"):
+            roughtime.verify_response(reply, os.urandom(roughtime.NONCE_SIZE), other_key)
+
+    def test_reply_must_cover_nonce(self):
+        reply = self.server.handle(roughtime.make_request(os.urandom(roughtime.NONCE_SIZE)))
+        with self.assertRaisesRegex(roughtime.RoughtimeError, "不匹配"):
+            roughtime.verify_response(reply, os.urandom(roughtime.NONCE_SIZE), self.public_key)
+
+    def batch_reply(self, nonces, index, path):
+        """按两个随机数组成的Merkle树签发回复（替身服务端每次只签一个随机数）"""
+        root = roughtime.node_hash(*(roughtime.leaf_hash(nonce) for nonce in nonces))
+        srep = roughtime.encode_message({
+            b"ROOT": root,
+            b"MIDP": struct.pack("<Q", int(time.time() * 1e6)),
+            b"RADI": struct.pack("<I", roughtime.DEFAULT_RADIUS),
+        })
+        return roughtime.encode_message({
+            b"SIG\x00": self.server.online_key.sign(roughtime.RESPONSE_CONTEXT + srep),
+            b"PATH": path,
+            b"SREP": srep,
+            b"CERT": self.server.cert,
+            b"INDX": struct.pack("<I", index),
+        })
+
+    def test_merkle_path(self):
+        nonces = [os.urandom(roughtime.NONCE_SIZE) for _ in range(2)]
+        sibling = roughtime.leaf_hash(nonces[0])
+        roughtime.verify_response(self.batch_reply(nonces, 1, sibling), nonces[1], self.public_key)
+        # 路径方向或兄弟节点不对时算不出签名覆盖的树根
+        with self.assertRaisesRegex(roughtime.RoughtimeError, "不匹配"):
+            roughtime.verify_response(self.batch_reply(nonces, 0, sibling), nonces[1], self.public_key)
+        with self.assertRaisesRegex(roughtime.RoughtimeError, "不匹配"):
+            roughtime.verify_response(self.batch_reply(nonces, 1, roughtime.leaf_hash(nonces[1])),
+                                      nonces[1], self.public_key)
+
+
+if __name__ == "__main__":
+    unittest.main()
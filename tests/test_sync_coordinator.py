@@ -0,0 +1,42 @@
+"""
+同步协调器：最小间隔内复用上次成功的结果，失败的同步不被复用
+
+在仓库根目录运行: python -m unittest discover tests
+"""
+import unittest
+
+from sync_coordinator import SyncCoordinator
+
+
+class CoordinatorTest(unittest.TestCase):
+    def setUp(self):
+        self.coordinator = SyncCoordinator(min_spacing=60.0)
+        self.calls = 0
+
+    def sync(self, result):
+        def func():
+            self.calls += 1
+            return result
+        return self.coordinator.run(func)
+
+    def test_success_is_reused_within_spacing(self):
+        ok = (True, "ok", "ntp.example.org", 0.01)
+        self.assertEqual(self.sync(ok), ok)
+        self.assertEqual(self.sync((False, "失败", None, None)), ok)
+        self.assertEqual(self.calls, 1)
+
+    def test_failure_is_not_reused(self):
+        failed = (False, "所有服务器均无法连接", None, None)
+        self.assertEqual(self.sync(failed), failed)
+        ok = (True, "ok", "ntp.example.org", 0.01)
+        self.assertEqual(self.sync(ok), ok)
+        self.assertEqual(self.calls, 2)
+
+    def test_force_ignores_spacing(self):
+        self.sync((True, "ok", "ntp.example.org", 0.01))
+        self.coordinator.run(lambda: (True, "again", None, None), force=True)
+        self.assertEqual(self.coordinator.last_result[1], "again")
+
+
+if __name__ == "__main__":
+    unittest.main()
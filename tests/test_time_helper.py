@@ -0,0 +1,122 @@
+"""
+特权时间设置助手：请求认证（HMAC和一次性nonce）、回复认证、偏移上限，以及不发请求的连接不会挡住其他客户端
+（使用假时钟，不会真正修改系统时间）
+
+在仓库根目录运行: python -m unittest discover tests
+"""
+import json
+import math
+import os
+import socket
+import threading
+import time
+import unittest
+
+import time_helper
+from time_helper import HelperClient, HelperServer
+
+
+# 假时钟：只记录收到的调整量
+class FakeClock:
+    def __init__(self):
+        self.offsets = []
+
+    def apply_offset(self, offset):
+        self.offsets.append(offset)
+        return True, f"已调整 {offset}"
+
+
+class HelperTest(unittest.TestCase):
+    def setUp(self):
+        self.key = os.urandom(32)
+        self.clock = FakeClock()
+        self.server = self.start_server(self.key, self.clock)
+        self.client = HelperClient(self.key, port=self.server.address[1])
+
+    def start_server(self, key, clock):
+        server = HelperServer(key, clock=clock, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 2.0)
+        self.addCleanup(server.close)
+        return server
+
+    def raw_request(self, build):
+        """手工发出一次请求：build(助手nonce) 返回请求字典，返回助手的回复"""
+        with socket.create_connection(self.server.address, timeout=2) as conn:
+            nonce = json.loads(time_helper._read_line(conn))["nonce"]
+            time_helper._send_json(conn, build(nonce))
+            return json.loads(time_helper._read_line(conn))
+
+    def signed(self, nonce, op="apply_offset", offset=1.5, client_nonce="c" * 32):
+        return {"op": op, "offset": offset, "nonce": client_nonce,
+                "mac": time_helper.compute_mac(self.key, nonce, client_nonce, op, offset)}
+
+    def test_valid_request(self):
+        self.assertTrue(self.client.ping())
+        ok, message = self.client.apply_offset(0.25)
+        self.assertTrue(ok, message)
+        self.assertEqual(self.clock.offsets, [0.25])
+
+    def test_bad_mac_is_rejected(self):
+        def build(nonce):
+            request = self.signed(nonce)
+            request["mac"] = time_helper.compute_mac(os.urandom(32), nonce, request["nonce"], "apply_offset", 1.5)
+            return request
+        self.assertEqual(self.raw_request(build), {"ok": False, "message": "认证失败"})
+        # MAC只覆盖原来的偏移，改动偏移同样无法通过认证
+        def altered(nonce):
+            request = self.signed(nonce)
+            request["offset"] = 3600.0
+            return request
+        self.assertFalse(self.raw_request(altered)["ok"])
+        self.assertEqual(self.clock.offsets, [])
+
+    def test_replayed_request_is_rejected(self):
+        captured = []
+        def build(nonce):
+            captured.append(self.signed(nonce))
+            return captured[0]
+        self.assertTrue(self.raw_request(build)["ok"])
+        # 新连接的nonce不同，原样重放截获的请求无效
+        self.assertFalse(self.raw_request(lambda nonce: captured[0])["ok"])
+        self.assertEqual(self.clock.offsets, [1.5])
+
+    def test_offset_out_of_range(self):
+        for offset in (time_helper.MAX_OFFSET * 2, -time_helper.MAX_OFFSET * 2, math.inf):
+            ok, message = self.client.apply_offset(offset)
+            self.assertFalse(ok)
+            self.assertIn("超出允许范围", message)
+        self.assertEqual(self.clock.offsets, [])
+
+    def test_forged_reply_fails_in_client(self):
+        # 冒充者占用了端口但没有密钥：请求在冒充者处认证失败，它的回复在客户端也无法通过认证
+        impostor_clock = FakeClock()
+        impostor = self.start_server(os.urandom(32), impostor_clock)
+        ok, message = HelperClient(self.key, port=impostor.address[1]).apply_offset(0.5)
+        self.assertFalse(ok)
+        self.assertIn("未通过认证", message)
+        # 回复中的认证码必须对应本次的客户端nonce
+        good = time_helper.compute_reply_mac(self.key, "a" * 32, True, "pong")
+        self.assertNotEqual(good, time_helper.compute_reply_mac(self.key, "b" * 32, True, "pong"))
+        self.assertNotEqual(good, time_helper.compute_reply_mac(self.key, "a" * 32, False, "pong"))
+
+    def test_idle_connection_does_not_block(self):
+        idle = socket.create_connection(self.server.address, timeout=5)
+        self.addCleanup(idle.close)
+        start = time.monotonic()
+        self.assertTrue(self.client.apply_offset(0.1)[0])
+        self.assertLess(time.monotonic() - start, 0.5)
+        # 不发请求的连接在期限后被断开
+        idle.recv(4096)
+        self.assertEqual(idle.recv(4096), b"")
+        self.assertLess(time.monotonic() - start, time_helper.REQUEST_DEADLINE + 1.0)
+
+    def test_shutdown(self):
+        self.assertTrue(self.client.shutdown()[0])
+        time.sleep(0.2)
+        self.assertFalse(self.client.ping())
+
+
+if __name__ == "__main__":
+    unittest.main()
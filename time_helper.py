@@ -0,0 +1,357 @@
+"""
+特权时间设置助手
+
+唯一职责是通过经过认证的本地IPC接收“调整时间偏移”请求并调用时钟后端，
+这样GUI和其他组件都可以以普通权限运行。为了启动和响应足够快，
+这里只导入标准库中必要的模块，不依赖PyQt5和ntplib。
+
+密钥由助手启动时生成，只交给启动它的进程，不落盘（同一用户的其他进程读不到）：
+    POSIX    写到标准输出，启动者通过管道读取（管道只有启动者持有）
+    Windows  连接启动者创建的命名管道，双方核对对端进程ID（助手核对管道服务端是启动者，启动者核对连接的是助手）
+启动者退出后助手随之退出（--parent 指定启动者的进程ID）。
+
+协议（基于127.0.0.1 TCP，每行一个JSON消息，每个连接一次请求）：
+    助手 -> 客户端  {"nonce": "<随机十六进制>"}
+    客户端 -> 助手  {"op": "apply_offset", "offset": 0.123, "nonce": "<客户端随机数>", "mac": "<HMAC-SHA256>"}
+    助手 -> 客户端  {"ok": true, "message": "...", "mac": "<HMAC-SHA256>"}
+请求 mac = HMAC-SHA256(密钥, 助手nonce + "|" + 客户端nonce + "|" + op + "|" + offset)，
+回复 mac = HMAC-SHA256(密钥, "reply|" + 客户端nonce + "|" + ok + "|" + message)，
+客户端据此确认回复来自持有密钥的助手，而不是抢先占用了端口的其他进程。
+"""
+import os
+import sys
+import json
+import hmac
+import math
+import time
+import socket
+import hashlib
+import threading
+
+DEFAULT_HELPER_PORT = 47123
+# 通过标准输出交出密钥（POSIX）
+KEY_CHANNEL_STDOUT = "-"
+# Windows命名管道名前缀，后接随机部分
+KEY_PIPE_PREFIX = r"\\.\pipe\TimeSyncHelper-"
+PIPE_REJECT_REMOTE_CLIENTS = 0x8
+# 单次请求允许调整的最大偏移（秒），防止异常值把时间改到离谱的年份
+MAX_OFFSET = 10 * 365 * 24 * 3600
+HELPER_OPS = ("ping", "apply_offset", "shutdown")
+# 连接后必须在这么长时间内发来完整的请求，否则直接断开（秒）
+REQUEST_DEADLINE = 1.0
+# 同时处理的连接数上限，超出时新连接直接关闭
+MAX_CONNECTIONS = 16
+
+
+def compute_mac(key, nonce, client_nonce, op, offset=0.0):
+    message = f"{nonce}|{client_nonce}|{op}|{float(offset)!r}".encode('ascii')
+    return hmac.new(key, message, hashlib.sha256).hexdigest()
+
+
+def compute_reply_mac(key, client_nonce, ok, message):
+    data = f"reply|{client_nonce}|{bool(ok)}|{message}".encode('utf-8')
+    return hmac.new(key, data, hashlib.sha256).hexdigest()
+
+
+def _read_line(conn, limit=4096, deadline=None):
+    """读取一行；给出deadline（monotonic时刻）时整行必须在此之前到齐，逐字节拖延也会超时"""
+    data = b""
+    while not data.endswith(b"\n"):
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout("timed out")
+            conn.settimeout(remaining)
+        chunk = conn.recv(limit - len(data))
+        if not chunk:
+            break
+        data += chunk
+        if len(data) >= limit:
+            break
+    return data
+
+
+def _send_json(conn, obj):
+    conn.sendall((json.dumps(obj, ensure_ascii=False) + "\n").encode('utf-8'))
+
+
+# 助手服务端
+class HelperServer:
+    def __init__(self, key, clock=None, host="127.0.0.1", port=DEFAULT_HELPER_PORT, timeout=REQUEST_DEADLINE):
+        """clock需提供apply_offset(offset) -> (success, message)，测试时可传入假时钟"""
+        if clock is None:
+            import clock_backend as clock
+        self.key = key
+        self.clock = clock
+        self.timeout = timeout
+        self.running = False
+        # 每个连接在自己的线程中处理，一个不发请求的连接不会挡住其他客户端；调整时钟本身串行执行
+        self.clock_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Windows上独占端口，防止其他进程再绑定同一端口截获请求；POSIX上允许在上一个助手的TIME_WAIT期间重新启动
+        if hasattr(socket, "SO_EXCLUSIVEADDRUSE"):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+        else:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(8)
+        self.address = self.sock.getsockname()
+
+    def reply(self, conn, client_nonce, ok, message):
+        """发送带认证码的回复（客户端nonce未知时无法认证，客户端会拒绝）"""
+        _send_json(conn, {"ok": ok, "message": message,
+                          "mac": compute_reply_mac(self.key, client_nonce, ok, message)})
+
+    def handle(self, conn):
+        """处理单个连接，返回False表示收到关闭请求"""
+        deadline = time.monotonic() + self.timeout
+        conn.settimeout(self.timeout)
+        nonce = os.urandom(16).hex()
+        _send_json(conn, {"nonce": nonce})
+        try:
+            request = json.loads(_read_line(conn, deadline=deadline).decode('utf-8'))
+            op = request["op"]
+            offset = float(request.get("offset", 0.0))
+            client_nonce = str(request["nonce"])
+            mac = str(request["mac"])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            _send_json(conn, {"ok": False, "message": "请求格式错误"})
+            return True
+
+        if not hmac.compare_digest(mac, compute_mac(self.key, nonce, client_nonce, op, offset)):
+            _send_json(conn, {"ok": False, "message": "认证失败"})
+            return True
+        if op not in HELPER_OPS:
+            self.reply(conn, client_nonce, False, f"不支持的操作: {op}")
+            return True
+
+        if op == "ping":
+            self.reply(conn, client_nonce, True, "pong")
+        elif op == "shutdown":
+            self.reply(conn, client_nonce, True, "助手已退出")
+            return False
+        elif not math.isfinite(offset) or abs(offset) > MAX_OFFSET:
+            self.reply(conn, client_nonce, False, f"偏移超出允许范围: {offset}")
+        else:
+            with self.clock_lock:
+                success, message = self.clock.apply_offset(offset)
+            self.reply(conn, client_nonce, bool(success), message)
+        return True
+
+    def serve_forever(self):
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    conn, _ = self.sock.accept()
+                except OSError:
+                    break
+                if not self.slots.acquire(blocking=False):
+                    conn.close()
+                    continue
+                threading.Thread(target=self.serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            self.running = False
+            self.sock.close()
+
+    def serve_connection(self, conn):
+        try:
+            with conn:
+                if not self.handle(conn):
+                    self.close()
+        except OSError:
+            pass
+        finally:
+            self.slots.release()
+
+    def close(self):
+        """可从其他线程调用：先shutdown唤醒阻塞在accept上的serve_forever"""
+        self.running = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+# 助手客户端（GUI和其他非特权组件使用）
+class HelperClient:
+    def __init__(self, key, host="127.0.0.1", port=DEFAULT_HELPER_PORT, timeout=2.0):
+        self.key = key
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def request(self, op, offset=0.0):
+        """发送一次请求，返回 (success, message)；回复认证失败时视为失败"""
+        client_nonce = os.urandom(16).hex()
+        try:
+            with socket.create_connection((self.host, self.port), timeout=self.timeout) as conn:
+                nonce = json.loads(_read_line(conn).decode('utf-8'))["nonce"]
+                _send_json(conn, {"op": op, "offset": float(offset), "nonce": client_nonce,
+                                  "mac": compute_mac(self.key, nonce, client_nonce, op, offset)})
+                reply = json.loads(_read_line(conn).decode('utf-8'))
+            ok, message = bool(reply.get("ok")), str(reply.get("message", ""))
+            if not hmac.compare_digest(str(reply.get("mac", "")),
+                                       compute_reply_mac(self.key, client_nonce, ok, message)):
+                return False, f"时间设置助手的回复未通过认证: {message}"
+            return ok, message
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            return False, f"无法连接时间设置助手: {e}"
+
+    def ping(self):
+        return self.request("ping")[0]
+
+    def apply_offset(self, offset):
+        return self.request("apply_offset", offset)
+
+    def shutdown(self):
+        return self.request("shutdown")
+
+
+def _win_pipe_process_id(handle, server):
+    """命名管道对端（server为True时是服务端，否则是客户端）的进程ID"""
+    import ctypes
+    from ctypes import wintypes
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    query = kernel32.GetNamedPipeServerProcessId if server else kernel32.GetNamedPipeClientProcessId
+    query.argtypes = [wintypes.HANDLE, ctypes.POINTER(wintypes.ULONG)]
+    query.restype = wintypes.BOOL
+    pid = wintypes.ULONG()
+    if not query(handle, ctypes.byref(pid)):
+        raise ctypes.WinError(ctypes.get_last_error())
+    return pid.value
+
+
+def send_key(key, channel, parent_pid):
+    """助手端：把密钥交给启动者（channel为"-"时写到标准输出，否则连接该命名管道）"""
+    line = (key.hex() + "\n").encode('ascii')
+    if channel == KEY_CHANNEL_STDOUT:
+        sys.stdout.buffer.write(line)
+        sys.stdout.flush()
+        return
+    if not channel.startswith(KEY_PIPE_PREFIX):
+        raise ValueError(f"无效的密钥通道: {channel}")
+    import msvcrt
+    with open(channel, 'wb', buffering=0) as pipe:
+        # 管道名可能被同一用户的其他进程抢先创建，只把密钥交给启动者创建的管道
+        server_pid = _win_pipe_process_id(msvcrt.get_osfhandle(pipe.fileno()), server=True)
+        if server_pid != parent_pid:
+            raise PermissionError(f"密钥管道的服务端进程 {server_pid} 不是启动者 {parent_pid}")
+        pipe.write(line)
+
+
+def read_key(stream, timeout):
+    """启动者端（POSIX）：从助手的标准输出管道读取密钥，超时或助手提前退出时返回None"""
+    import select
+    deadline = time.monotonic() + timeout
+    data = b""
+    while not data.endswith(b"\n"):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([stream], [], [], remaining)[0]:
+            return None
+        chunk = os.read(stream.fileno(), 128)
+        if not chunk:
+            return None
+        data += chunk
+    try:
+        return bytes.fromhex(data.decode('ascii').strip()) or None
+    except ValueError:
+        return None
+
+
+# 启动者端（Windows）：接收密钥的命名管道，只有单个实例，拒绝远程连接
+class KeyPipe:
+    def __init__(self):
+        import _winapi
+        self.name = KEY_PIPE_PREFIX + os.urandom(16).hex()
+        self.handle = _winapi.CreateNamedPipe(
+            self.name,
+            _winapi.PIPE_ACCESS_INBOUND | _winapi.FILE_FLAG_FIRST_PIPE_INSTANCE | _winapi.FILE_FLAG_OVERLAPPED,
+            _winapi.PIPE_WAIT | PIPE_REJECT_REMOTE_CLIENTS,  # 字节流模式
+            1, 0, 4096, _winapi.NMPWAIT_WAIT_FOREVER, _winapi.NULL)
+
+    def wait(self, overlapped, deadline):
+        import _winapi
+        remaining = max(0, int((deadline - time.monotonic()) * 1000))
+        if _winapi.WaitForMultipleObjects([overlapped.event], False, remaining) == _winapi.WAIT_TIMEOUT:
+            overlapped.cancel()
+            overlapped.GetOverlappedResult(True)
+            return False
+        return overlapped.GetOverlappedResult(True)[1] == 0
+
+    def receive(self, helper_pid, timeout):
+        """等待助手连接并读取密钥；连接的不是helper_pid进程、超时或出错时返回None"""
+        import _winapi
+        deadline = time.monotonic() + timeout
+        try:
+            if not self.wait(_winapi.ConnectNamedPipe(self.handle, overlapped=True), deadline):
+                return None
+            if _win_pipe_process_id(self.handle, server=False) != helper_pid:
+                return None
+            overlapped, _ = _winapi.ReadFile(self.handle, 128, overlapped=True)
+            if not self.wait(overlapped, deadline):
+                return None
+            return bytes.fromhex(overlapped.getbuffer().decode('ascii').strip()) or None
+        except (OSError, ValueError):
+            return None
+        finally:
+            self.close()
+
+    def close(self):
+        import _winapi
+        if self.handle is not None:
+            _winapi.CloseHandle(self.handle)
+            self.handle = None
+
+
+def watch_parent(parent_pid, on_exit):
+    """启动者进程退出后调用on_exit（后台线程）"""
+    def run():
+        if sys.platform == 'win32':
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            handle = kernel32.OpenProcess(0x00100000, False, parent_pid)  # SYNCHRONIZE
+            if handle:
+                kernel32.WaitForSingleObject(handle, 0xFFFFFFFF)  # INFINITE
+                kernel32.CloseHandle(handle)
+        else:
+            while True:
+                try:
+                    os.kill(parent_pid, 0)
+                except ProcessLookupError:
+                    break
+                except PermissionError:
+                    pass
+                time.sleep(1.0)
+        on_exit()
+    threading.Thread(target=run, name="ParentWatch", daemon=True).start()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    port = DEFAULT_HELPER_PORT
+    parent_pid = None
+    channel = KEY_CHANNEL_STDOUT
+    # 参数很少，手工解析以避免导入argparse
+    args = iter(argv)
+    for arg in args:
+        if arg == "--port":
+            port = int(next(args, port))
+        elif arg == "--parent":
+            parent_pid = int(next(args))
+        elif arg == "--key-channel":
+            channel = next(args, channel)
+    key = os.urandom(32)
+    # 端口绑定成功后才交出密钥，启动者据此判断助手已就绪
+    server = HelperServer(key, port=port)
+    send_key(key, channel, parent_pid)
+    if parent_pid is not None:
+        watch_parent(parent_pid, server.close)
+    server.serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+时间源抽象：NTPSync 按服务器的写法选用时间源，各时间源把一次查询整理成与 ntp_client.NTPResponse 字段相同的结果
+
+  主机名或IP                       NTP（ntp_client.py，支持交错模式）
+  nts://主机[:端口]                NTS认证的NTP（nts.py）
+  http://主机 或 https://主机      HTTP Date头（http_time.py）
+  roughtime://主机[:端口]/公钥     Roughtime（roughtime.py）
+
+NTP和NTS经过UDP 123端口；HTTP和Roughtime是备用时间源（fallback为True），
+只有UDP 123上的时间源都失败时才查询，用于出口封锁了UDP 123的网络（见 ntp_sync.py）。
+"""
+import os
+import threading
+
+import ntp_client
+from nts import NTSClient, NTS_SCHEME
+from server_pool import pool_manager
+
+
+# 非NTP时间源的查询结果，字段与 ntp_client.NTPResponse 一致（时间均为Unix秒）
+class SourceResponse:
+    def __init__(self, source, address, offset, delay, dispersion, stratum, t1, t4):
+        self.source = source
+        self.address = address
+        self.offset = offset
+        self.delay = delay
+        self.leap = 0
+        self.stratum = stratum
+        self.root_delay = 0.0
+        # 时间源自身的不确定度（HTTP为Date头推算区间的半宽，Roughtime为服务器给出的半径）
+        self.root_dispersion = dispersion
+        self.orig_time = t1
+        self.dest_time = t4
+        self.recv_time = self.tx_time = (t1 + t4) / 2 + offset
+        self.interleaved = False
+        # 没有NTP报文，录制时直接记录偏移和延迟
+        self.packet = None
+        self.t1, self.t4 = t1, t4
+
+
+# 时间源基类
+class TimeSource:
+    # 时间源名称，用于日志和录制
+    name = ""
+    # 备用时间源：只有UDP 123上的时间源都失败时才查询
+    fallback = False
+    # 经过UDP 123端口（出口封锁时会一直超时）
+    port123 = False
+
+    def matches(self, server):
+        """该服务器写法是否由本时间源处理"""
+        raise NotImplementedError
+
+    def query(self, server, timeout, cancel=None):
+        """查询一次，返回 NTPResponse 或 SourceResponse；超时抛出socket.timeout，取消时抛出Cancelled"""
+        raise NotImplementedError
+
+
+# 普通NTP服务器
+class NTPSource(TimeSource):
+    name = "ntp"
+    port123 = True
+
+    def __init__(self, interleaved=True):
+        self.interleaved = interleaved
+
+    def matches(self, server):
+        return True
+
+    def query(self, server, timeout, cancel=None):
+        try:
+            return ntp_client.query(server, version=4 if self.interleaved else 3, timeout=timeout,
+                                    cancel=cancel, interleaved=self.interleaved)
+        except ntp_client.PollDeferred:
+            # 池的后端刚在后台刷新中测量过：直接使用那次测量，不再查询
+            response = pool_manager.recent_response(server)
+            if response is None:
+                raise
+            return response
+
+
+# NTS客户端：cookie在多次同步之间复用，并保存到文件供重启后继续使用
+_nts_client = None
+_nts_client_lock = threading.Lock()
+
+def get_nts_client():
+    global _nts_client
+    with _nts_client_lock:
+        if _nts_client is None:
+            _nts_client = NTSClient(store_path=os.path.abspath("nts_cookies.json"))
+        return _nts_client
+
+
+# NTS服务器：有缓存cookie时只需一次经过认证的UDP交换
+class NTSSource(TimeSource):
+    name = "nts"
+    port123 = True
+
+    def matches(self, server):
+        return server.startswith(NTS_SCHEME)
+
+    def query(self, server, timeout, cancel=None):
+        return get_nts_client().query(server, timeout=timeout, cancel=cancel)
@@ -0,0 +1,64 @@
+"""
+同步热路径的分阶段计时（DNS、建socket、发送、接收、选择、设置时钟、线程切换）
+
+每个阶段记录为一个span：名称、单调时钟纳秒起止时间、线程ID和附加参数。
+span保存在固定容量的环形缓冲区中（deque追加在CPython中是原子的，无需加锁），
+可以导出为JSON列表或Chrome trace格式（chrome://tracing、Perfetto可直接打开）。
+"""
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+class SpanRecorder:
+    def __init__(self, capacity=4096, enabled=True):
+        self.buffer = deque(maxlen=capacity)
+        self.enabled = enabled
+
+    def record(self, name, start_ns, end_ns=None, **args):
+        """记录一个已经结束的阶段，end_ns为空时取当前时间"""
+        if self.enabled:
+            if end_ns is None:
+                end_ns = time.monotonic_ns()
+            self.buffer.append((name, start_ns, end_ns, threading.get_ident(), args))
+
+    @contextmanager
+    def span(self, name, **args):
+        """用with语句包住一个阶段；可在with内向返回的字典中补充参数"""
+        start_ns = time.monotonic_ns()
+        try:
+            yield args
+        finally:
+            self.record(name, start_ns, None, **args)
+
+    def clear(self):
+        self.buffer.clear()
+
+    def spans(self):
+        return list(self.buffer)
+
+    def to_json(self):
+        return [{'name': name, 'start_ns': start, 'end_ns': end, 'duration_ns': end - start,
+                 'thread': tid, 'args': args}
+                for name, start, end, tid, args in self.spans()]
+
+    def to_chrome_trace(self):
+        """Chrome trace的完整事件(ph=X)，时间单位为微秒"""
+        pid = os.getpid()
+        events = [{'name': name, 'ph': 'X', 'ts': start / 1000.0, 'dur': (end - start) / 1000.0,
+                   'pid': pid, 'tid': tid, 'args': {k: str(v) for k, v in args.items()}}
+                  for name, start, end, tid, args in self.spans()]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, path, fmt="chrome"):
+        data = self.to_chrome_trace() if fmt == "chrome" else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        return len(self.buffer)
+
+
+# 进程内共享的span记录器
+tracer = SpanRecorder()